@@ -0,0 +1,667 @@
+# =========================================================
+# END-TO-END LOAD BENCHMARK
+#
+#   python bench/load.py --users 200 --duration 120
+#   python bench/load.py --users 400 --shards 4   # main.py SHARDS=4 subprocess, getUpdates orqali
+#
+# Haqiqiy `dp` handlerlari ishlaydi; tashqi servislar lokal stand-in:
+#   - fake Telegram Bot API (latency, global/per-chat limit, 429 + retry_after)
+#   - fake Groq (chat + whisper), translate, dictionary, TTS (latency, xato ulushi)
+# N ta simulyatsiya qilingan user Speaking / Dictionary / Writing flow’larini
+# to‘liq o‘tadi. Natija: har step p50/p95/p99, throughput, event-loop lag.
+#
+# Talab: main.py dependency’lari + ffmpeg (voice -> wav konvertatsiya).
+# =========================================================
+
+from __future__ import annotations
+
+import io
+import os
+import sys
+import json
+import wave
+import time
+import random
+import asyncio
+import argparse
+import shutil
+import datetime
+import threading
+import itertools
+import signal
+import subprocess
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+
+# ---------------------------------------------------------
+# Stand-in server (alohida thread + event loop’da ishlaydi)
+# ---------------------------------------------------------
+class Inbox:
+    # bot yuborgan xabarlar (chat bo‘yicha) — simulyatsiya userlari shu yerdan kutadi
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.items: Dict[int, List[Tuple[float, str]]] = defaultdict(list)
+        self.events: Dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+
+    def push_threadsafe(self, chat_id: int, text: str):
+        self.loop.call_soon_threadsafe(self._push, chat_id, text, time.monotonic())
+
+    def _push(self, chat_id: int, text: str, ts: float):
+        self.items[chat_id].append((ts, text))
+        self.events[chat_id].set()
+
+    async def wait_for(self, chat_id: int, start: int, pred, timeout: float) -> Tuple[int, float, str]:
+        deadline = time.monotonic() + timeout
+        pos = start
+        while True:
+            items = self.items[chat_id]
+            while pos < len(items):
+                ts, text = items[pos]
+                pos += 1
+                if pred(text):
+                    return pos, ts, text
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            ev = self.events[chat_id]
+            ev.clear()
+            try:
+                await asyncio.wait_for(ev.wait(), timeout=left)
+            except asyncio.TimeoutError:
+                raise
+
+
+class Bucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class FakeServices:
+    def __init__(self, args, inbox: Inbox, voice_bytes: bytes):
+        self.args = args
+        self.inbox = inbox
+        self.voice_bytes = voice_bytes
+        self.msg_ids = itertools.count(1000)
+        self.global_bucket = Bucket(args.tg_global_rate, args.tg_global_rate)
+        self.chat_buckets: Dict[int, Bucket] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+        # reply keyboard bilan yuborilgan xabarlar — Telegram ularni edit qilmaydi
+        self.reply_kb_msgs: set = set()
+        # --shards: update’lar getUpdates long-poll orqali beriladi
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.updates: List[Dict] = []
+        self.updates_event: Optional[asyncio.Event] = None
+
+    def push_update_threadsafe(self, update: Dict):
+        self.loop.call_soon_threadsafe(self._push_update, update)
+
+    def _push_update(self, update: Dict):
+        self.updates.append(update)
+        self.updates_event.set()
+
+    async def get_updates(self, offset: int, timeout: float) -> List[Dict]:
+        deadline = time.monotonic() + timeout
+        while True:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if self.updates or time.monotonic() >= deadline:
+                return self.updates[:100]
+            self.updates_event.clear()
+            try:
+                await asyncio.wait_for(self.updates_event.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+    def count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    async def latency(self, ms: float):
+        # log-normal: ko‘p so‘rovlar tez, dumi uzun
+        if ms > 0:
+            await asyncio.sleep(random.lognormvariate(0, 0.5) * ms / 1000.0)
+
+    def failing(self) -> bool:
+        return random.random() < self.args.error_rate
+
+    # ---------------- Telegram ----------------
+    def _message(self, chat_id: int, text: Optional[str]) -> Dict:
+        return {
+            "message_id": next(self.msg_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+    def _too_many(self, retry_after: int) -> web.Response:
+        self.count("tg_429")
+        return web.json_response({
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {retry_after}",
+            "parameters": {"retry_after": retry_after},
+        }, status=429)
+
+    async def telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.count(f"tg_{method}")
+        await self.latency(self.args.tg_latency)
+
+        chat_raw = data.get("chat_id")
+        chat_id = int(chat_raw) if chat_raw and str(chat_raw).lstrip("-").isdigit() else 0
+        ok = lambda result: web.json_response({"ok": True, "result": result})
+
+        if method.startswith(("send", "edit")):
+            if not self.global_bucket.take():
+                return self._too_many(1)
+            bucket = self.chat_buckets.setdefault(chat_id, Bucket(self.args.tg_chat_rate, 3))
+            if not bucket.take():
+                return self._too_many(random.randint(1, 3))
+
+        if method == "getUpdates":
+            return ok(await self.get_updates(int(data.get("offset") or 0), float(data.get("timeout") or 0)))
+        if method == "getMe":
+            return ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method == "editMessageText" and int(data.get("message_id") or 0) in self.reply_kb_msgs:
+            self.count("tg_edit_rejected")
+            return web.json_response({"ok": False, "error_code": 400,
+                                      "description": "Bad Request: message can't be edited"}, status=400)
+        if method in ("sendMessage", "editMessageText", "sendPhoto", "sendVoice", "sendAudio", "sendDocument"):
+            text = data.get("text") or data.get("caption") or ""
+            if method != "sendMessage" and method != "editMessageText":
+                text = f"[{method}] {text}"
+            # edit ham inbox’ga tushadi: progressive natijalar edit bilan to‘ladi
+            self.inbox.push_threadsafe(chat_id, str(text))
+            msg = self._message(chat_id, str(text))
+            if method != "editMessageText" and '"keyboard"' in str(data.get("reply_markup") or ""):
+                self.reply_kb_msgs.add(msg["message_id"])
+            return ok(msg)
+        if method == "getChatMember":
+            uid = int(data.get("user_id") or 0)
+            return ok({"status": "member", "user": {"id": uid, "is_bot": False, "first_name": f"U{uid}"}})
+        if method == "getChat":
+            return ok({"id": chat_id, "type": "private", "first_name": f"U{chat_id}", "username": f"u{chat_id}",
+                       "accent_color_id": 0, "max_reaction_count": 0,
+                       "accepted_gift_types": {"unlimited_gifts": False, "limited_gifts": False,
+                                               "unique_gifts": False, "premium_subscription": False}})
+        if method == "getFile":
+            fid = str(data.get("file_id") or "voice")
+            return ok({"file_id": fid, "file_unique_id": fid, "file_size": len(self.voice_bytes),
+                       "file_path": f"voice/{fid}.ogg"})
+        return ok(True)
+
+    async def telegram_file(self, request: web.Request) -> web.Response:
+        self.count("tg_file")
+        await self.latency(self.args.tg_latency)
+        return web.Response(body=self.voice_bytes, content_type="audio/ogg")
+
+    # ---------------- Groq ----------------
+    def _chat_content(self, payload: Dict) -> Dict:
+        # so‘rov turiga qarab javob hajmi (latency chiqish uzunligiga proporsional)
+        system = str((payload.get("messages") or [{}])[0].get("content", ""))
+        task = lambda i: {"task_no": i, "strengths": ["clear purpose"], "issues": ["too short", "repetition"],
+                          "grammar_mistakes": ["articles", "past tense"], "rewrite": FAKE_REWRITE}
+        if "Evaluate ONE task" in system:
+            return {"score_20_75": random.randint(30, 65), **task(0)}
+        if "examiner notes" in system:
+            return {"feedback_uz": "Yaxshi, lekin grammatikaga e’tibor bering.", "overall_mistakes": ["articles", "tense"]}
+        return {
+            "score_20_75": random.randint(30, 65),
+            "feedback_uz": "Yaxshi, lekin grammatikaga e’tibor bering.",
+            "overall_mistakes": ["articles", "tense"],
+            "per_question": [{"relevance_to_question": 4, "mistakes": ["article missing"]} for _ in range(10)],
+            "per_task": [task(i) for i in (1, 2, 3)],
+            "corrected_best_version": FAKE_REWRITE * 2,
+        }
+
+    async def groq_chat(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.count("groq_chat")
+        stream = bool(payload.get("stream"))
+        text = json.dumps(self._chat_content(payload), ensure_ascii=False)
+
+        # --groq-latency: katta model, to‘liq (3 task) javob. ~10% birinchi token, qolgani generatsiya;
+        # 8b model ~3x tez
+        speed = 0.35 if "8b" in str(payload.get("model")) else 1.0
+        gen = self.args.groq_latency * 0.9 * speed * min(1.0, len(text) / FULL_ANSWER_CHARS)
+        first = self.args.groq_latency * 0.1 * speed
+        await self.latency(first if stream else first + gen)
+        if self.failing():
+            self.count("groq_chat_err")
+            return web.json_response({"error": "overloaded"}, status=503)
+
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                 "total_tokens": prompt_tokens + len(text) // 4}
+
+        if stream:
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+            pieces = range(0, len(text), 24)
+            for i in pieces:
+                chunk = {"choices": [{"index": 0, "delta": {"content": text[i:i + 24]}}]}
+                await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(gen / 1000.0 / len(pieces))
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+            await resp.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+            await resp.write_eof()
+            return resp
+
+        finish = "stop"
+        if random.random() < self.args.bad_json_rate:
+            # max_tokens’ga urilgan javob: o‘rtasida kesiladi
+            self.count("groq_chat_truncated")
+            text = text[:random.randint(len(text) // 3, len(text) - 1)]
+            finish = "length"
+
+        return web.json_response({
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish}],
+            "usage": usage,
+        })
+
+    @staticmethod
+    def _wav_seconds(data) -> float:
+        try:
+            with wave.open(io.BytesIO(data["file"].file.read())) as w:
+                return w.getnframes() / float(w.getframerate())
+        except Exception:
+            return 0.0
+
+    async def groq_stt(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        self.count("groq_stt")
+        # whisper: qo‘shimcha + audio uzunligiga proporsional (upload + inference)
+        await self.latency(self.args.stt_latency + self.args.stt_per_second * self._wav_seconds(data))
+        if self.failing():
+            self.count("groq_stt_err")
+            return web.json_response({"error": "overloaded"}, status=503)
+        return web.json_response({"text": "I think reading books is a good way to relax after school."})
+
+    # ---------------- translate / dictionary / TTS ----------------
+    async def translate(self, request: web.Request) -> web.Response:
+        self.count("translate")
+        await self.latency(self.args.lookup_latency)
+        if self.failing():
+            return web.Response(status=500)
+        q = request.query.get("q", "")
+        return web.json_response([[[f"tr({q})", q, None, None]], None, request.query.get("sl", "en")])
+
+    async def dictionary(self, request: web.Request) -> web.Response:
+        self.count("dictionary")
+        await self.latency(self.args.lookup_latency)
+        if self.failing():
+            return web.Response(status=500)
+        word = request.match_info["word"]
+        return web.json_response([{
+            "word": word,
+            "phonetics": [{"text": f"/{word}/", "audio": ""}],
+            "meanings": [{"definitions": [{"definition": f"meaning of {word}"}]}],
+        }])
+
+    async def tts(self, request: web.Request) -> web.Response:
+        self.count("tts")
+        await self.latency(self.args.lookup_latency)
+        return web.Response(body=self.voice_bytes, content_type="audio/mpeg")
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.telegram)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.telegram_file)
+        app.router.add_post("/groq/chat/completions", self.groq_chat)
+        app.router.add_post("/groq/audio/transcriptions", self.groq_stt)
+        app.router.add_get("/translate", self.translate)
+        app.router.add_get("/dict/{word}", self.dictionary)
+        app.router.add_get("/tts", self.tts)
+        return app
+
+
+def start_services(services: FakeServices, port: int) -> threading.Thread:
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        services.loop = loop
+        services.updates_event = asyncio.Event()
+        runner = web.AppRunner(services.app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    ready.wait(10)
+    return t
+
+
+def make_voice_bytes(seconds: float) -> bytes:
+    from pydub.generators import Sine
+    import tempfile
+    seg = Sine(220).to_audio_segment(duration=int(seconds * 1000)).apply_gain(-20)
+    fd, path = tempfile.mkstemp(suffix=".ogg")
+    os.close(fd)
+    try:
+        seg.export(path, format="ogg", codec="libopus")
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+# ---------------------------------------------------------
+# Simulyatsiya qilingan userlar
+# ---------------------------------------------------------
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.flows: Dict[str, int] = defaultdict(int)
+
+    def add(self, step: str, seconds: float):
+        self.samples[step].append(seconds)
+
+
+def pct(xs: List[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))]
+
+
+class SimUser:
+    def __init__(self, main, uid: int, inbox: Inbox, rec: Recorder, args, services: FakeServices):
+        self.main = main
+        self.services = services
+        self.uid = uid
+        self.inbox = inbox
+        self.rec = rec
+        self.args = args
+        self.pos = 0
+
+    def _update(self, text: Optional[str] = None, voice: bool = False):
+        from aiogram.types import Update, Message, Chat, User, Voice
+        uid = self.uid
+        mid = next(UPDATE_IDS)
+        msg = Message(
+            message_id=mid,
+            date=datetime.datetime.now(),
+            chat=Chat(id=uid, type="private"),
+            from_user=User(id=uid, is_bot=False, first_name=f"U{uid}", username=f"u{uid}"),
+            text=text,
+            voice=Voice(file_id=f"v{uid}_{mid}", file_unique_id=f"v{mid}", duration=self.args.voice_seconds) if voice else None,
+        )
+        return Update(update_id=mid, message=msg)
+
+    async def send(self, text: Optional[str] = None, voice: bool = False) -> float:
+        # polling’dagi kabi: har update alohida task
+        t0 = time.monotonic()
+        update = self._update(text, voice)
+        if self.args.shards:
+            self.services.push_update_threadsafe(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+        else:
+            asyncio.create_task(self.main.dp.feed_update(self.main.bot, update))
+        return t0
+
+    async def expect(self, pred, timeout: Optional[float] = None) -> Tuple[float, str]:
+        self.pos, ts, text = await self.inbox.wait_for(self.uid, self.pos, pred, timeout or self.args.step_timeout)
+        return ts, text
+
+    async def think(self):
+        await asyncio.sleep(random.uniform(0, self.args.think))
+
+    async def step(self, name: str, text: Optional[str], pred, voice: bool = False) -> str:
+        t0 = await self.send(text, voice)
+        ts, reply = await self.expect(pred)
+        self.rec.add(name, ts - t0)
+        return reply
+
+    async def speaking(self):
+        is_question = lambda t: t.startswith(("PART ", "📌 CUE CARD", "📊 Natija"))
+        reply = await self.step("speaking.start", "🗣 Speaking", is_question)
+        while not reply.startswith("📊 Natija"):
+            await self.think()
+            reply = await self.step(
+                "speaking.result" if reply.startswith("PART 3 — Savol 3/3") else "speaking.answer",
+                None, is_question, voice=True,
+            )
+
+    async def dictionary(self):
+        await self.step("menu", "📚 Dictionary", lambda t: "Dictionary" in t)
+        await self.step("menu", "🇬🇧 EN → UZ 🔊", lambda t: "English so‘z" in t)
+        for _ in range(self.args.dict_words):
+            await self.think()
+            word = random.choice(WORDS)
+            await self.step("dict.lookup", word, lambda t: t.startswith("🇬🇧 EN:"))
+        await self.step("menu", "⬅️ Orqaga", lambda t: "Menu" in t)
+
+    async def writing(self):
+        await self.step("menu", "✍️ Writing", lambda t: t.startswith("✍️ Writing"))
+        await self.think()
+        t0 = await self.send(WRITING_ANSWER)
+        ts, _ = await self.expect(lambda t: t.startswith(("📊 Writing natija", "🧩 Task")))
+        self.rec.add("writing.first", ts - t0)
+        self.pos -= 1   # bitta xabar (single) ham first, ham result bo‘lishi mumkin
+        ts, _ = await self.expect(lambda t: t.startswith("📊 Writing natija") and "⏳" not in t)
+        self.rec.add("writing.result", ts - t0)
+
+    async def run(self, deadline: float):
+        flows = [("speaking", self.speaking), ("dictionary", self.dictionary), ("writing", self.writing)]
+        weights = [self.args.mix_speaking, self.args.mix_dict, self.args.mix_writing]
+        await self.step("start", "/start", lambda t: "Xush salom" in t)
+        while time.monotonic() < deadline:
+            name, flow = random.choices(flows, weights=weights)[0]
+            try:
+                await flow()
+                self.rec.flows[name] += 1
+            except asyncio.TimeoutError:
+                self.rec.errors[f"{name}.timeout"] += 1
+                await self.send("⬅️ Orqaga")
+                self.pos = len(self.inbox.items[self.uid])
+                await asyncio.sleep(1)
+
+
+UPDATE_IDS = itertools.count(1)
+
+FAKE_REWRITE = (
+    "Many people believe that passion matters more than salary when choosing a career, "
+    "but in my opinion both are important for a balanced life. "
+) * 8
+
+FULL_ANSWER_CHARS = 8000
+
+WORDS = ["apple", "book", "river", "window", "improve", "quickly", "honest", "journey", "weather", "achieve"]
+
+WRITING_ANSWER = (
+    "1) Hi Sam! Can you remind me about my mum's birthday next Friday? I always forget dates. Thanks!\n"
+    "2) Dear Mr. Brown, I am writing to inform you that I lost access to the client account. "
+    "Could you please reset the password? Kind regards, Ali\n"
+    "3) Many people believe that passion is more important than salary when choosing a career. "
+    "In my opinion, both matter, but passion keeps people motivated for a long time. "
+    "However, a good salary is necessary to support a family. "
+    "For example, my uncle chose a job he loves, and although he earns less, he is happy and successful."
+)
+
+
+async def loop_lag_monitor(samples: List[float], stop: asyncio.Event, interval: float = 0.1):
+    while not stop.is_set():
+        t0 = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.monotonic() - t0 - interval))
+
+
+# ---------------------------------------------------------
+# Run
+# ---------------------------------------------------------
+def parse_args():
+    p = argparse.ArgumentParser(description="End-to-end load benchmark for the bot handlers")
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--duration", type=float, default=120, help="sekund (flow’lar boshlanadigan oyna)")
+    p.add_argument("--ramp", type=float, default=10, help="userlar shu vaqt ichida qo‘shiladi")
+    p.add_argument("--think", type=float, default=1.0, help="user javob berishdan oldin max kutish (s)")
+    p.add_argument("--mix-speaking", type=float, default=0.5)
+    p.add_argument("--mix-dict", type=float, default=0.3)
+    p.add_argument("--mix-writing", type=float, default=0.2)
+    p.add_argument("--dict-words", type=int, default=3)
+    p.add_argument("--voice-seconds", type=int, default=8)
+    p.add_argument("--step-timeout", type=float, default=180)
+    p.add_argument("--port", type=int, default=18081)
+    p.add_argument("--tg-latency", type=float, default=60, help="ms")
+    p.add_argument("--tg-global-rate", type=float, default=30)
+    p.add_argument("--tg-chat-rate", type=float, default=1)
+    p.add_argument("--groq-latency", type=float, default=2500, help="ms")
+    p.add_argument("--stt-latency", type=float, default=900, help="ms")
+    p.add_argument("--stt-per-second", type=float, default=25, help="ms / audio sekund")
+    p.add_argument("--lookup-latency", type=float, default=200, help="ms")
+    p.add_argument("--error-rate", type=float, default=0.02)
+    p.add_argument("--bad-json-rate", type=float, default=0.05, help="kesilgan Groq JSON javoblari ulushi")
+    p.add_argument("--shards", type=int, default=0,
+                   help=">0: main.py’ni SHARDS=N bilan alohida process’da ishga tushirish (supervisor + worker’lar)")
+    p.add_argument("--json", help="natijani shu faylga ham yozish")
+    return p.parse_args()
+
+
+def configure_env(args):
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ["BOT_TOKEN"] = "123456:BENCHMARK"
+    os.environ["GROQ_API_KEY"] = "bench"
+    os.environ["TELEGRAM_API_URL"] = base
+    os.environ["GROQ_BASE"] = f"{base}/groq"
+    os.environ["TRANSLATE_URL"] = f"{base}/translate"
+    os.environ["DICT_API_URL"] = f"{base}/dict"
+    os.environ["TTS_URL"] = f"{base}/tts"
+
+
+async def run(args) -> Dict:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+
+    loop = asyncio.get_running_loop()
+    inbox = Inbox(loop)
+    voice = make_voice_bytes(args.voice_seconds) if shutil.which("ffmpeg") else b"OggS"
+    services = FakeServices(args, inbox, voice)
+    start_services(services, args.port)
+
+    bot_proc = None
+    workdir = None
+    if args.shards:
+        # users/stats fayllari vaqtinchalik papkada; stdout bench’niki bilan aralashadi
+        workdir = tempfile.TemporaryDirectory()
+        env = dict(os.environ, SHARDS=str(args.shards), PORT=str(args.port + 1))
+        bot_proc = subprocess.Popen([sys.executable, os.path.abspath(main.__file__)], cwd=workdir.name, env=env)
+    else:
+        main.start_background_jobs()
+        main.STATE_READY.set()   # bench’da users/stats fayldan yuklanmaydi
+
+    rec = Recorder()
+    if args.shards:
+        # har shard’dan bitta user /start’ga javob bermaguncha o‘lchov boshlanmaydi
+        warm = {}
+        for uid in itertools.count(1):
+            warm.setdefault(main.shard_of(uid, args.shards), uid)
+            if len(warm) == args.shards:
+                break
+        await asyncio.gather(*(SimUser(main, uid, inbox, Recorder(), args, services)
+                               .step("start", "/start", lambda t: "Xush salom" in t) for uid in warm.values()))
+
+    lag: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(loop_lag_monitor(lag, stop))
+
+    t0 = time.monotonic()
+    deadline = t0 + args.duration
+    users = [SimUser(main, 10_000 + i, inbox, rec, args, services) for i in range(args.users)]
+
+    async def delayed(u: SimUser, delay: float):
+        await asyncio.sleep(delay)
+        await u.run(deadline)
+
+    await asyncio.gather(*(delayed(u, args.ramp * i / max(1, args.users)) for i, u in enumerate(users)))
+    elapsed = time.monotonic() - t0
+    stop.set()
+    await lag_task
+    if bot_proc:
+        bot_proc.send_signal(signal.SIGINT)   # supervisor worker’larni to‘xtatib, fayllarni birlashtiradi
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, bot_proc.wait, 60)
+        except subprocess.TimeoutExpired:
+            bot_proc.kill()
+        workdir.cleanup()
+
+    report = {
+        "users": args.users,
+        "shards": args.shards,
+        "elapsed_s": round(elapsed, 1),
+        "flows": dict(rec.flows),
+        "flows_per_s": round(sum(rec.flows.values()) / elapsed, 3),
+        "steps": {
+            name: {
+                "n": len(xs),
+                "p50": round(pct(xs, 0.50), 3),
+                "p95": round(pct(xs, 0.95), 3),
+                "p99": round(pct(xs, 0.99), 3),
+                "per_s": round(len(xs) / elapsed, 2),
+            } for name, xs in sorted(rec.samples.items())
+        },
+        "errors": dict(rec.errors),
+        "loop_lag_ms": {
+            "p50": round(pct(lag, 0.50) * 1000, 1),
+            "p95": round(pct(lag, 0.95) * 1000, 1),
+            "p99": round(pct(lag, 0.99) * 1000, 1),
+            "max": round(max(lag or [0.0]) * 1000, 1),
+        },
+        "services": dict(services.counters),
+        # --shards: bu ko‘rsatkichlar worker process’larda qoladi
+        "outbound": {} if args.shards else dict(main.OUTBOUND.stats),
+        "executors": {} if args.shards else {name: ex.metrics() for name, ex in main.EXECUTORS.items()},
+        "groq": {} if args.shards else {f"{route}/{model}": row for (route, model), row in main.GROQ_USAGE.snapshot().items()},
+    }
+    return report
+
+
+def print_report(r: Dict):
+    shards = f", {r['shards']} shards" if r.get("shards") else ""
+    print(f"\n=== LOAD: {r['users']} users, {r['elapsed_s']}s{shards} ===")
+    print(f"flows: {r['flows']}  ({r['flows_per_s']}/s)")
+    print(f"{'step':<18}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'/s':>8}")
+    for name, s in r["steps"].items():
+        print(f"{name:<18}{s['n']:>7}{s['p50']:>9.3f}{s['p95']:>9.3f}{s['p99']:>9.3f}{s['per_s']:>8.2f}")
+    lag = r["loop_lag_ms"]
+    print(f"loop lag ms: p50 {lag['p50']} · p95 {lag['p95']} · p99 {lag['p99']} · max {lag['max']}")
+    if r["errors"]:
+        print(f"errors: {r['errors']}")
+    print(f"telegram 429: {r['services'].get('tg_429', 0)} · edit rad etildi: {r['services'].get('tg_edit_rejected', 0)} · outbound: {r['outbound']}")
+    for key, g in sorted(r["groq"].items()):
+        print(f"groq {key}: {g['calls']} calls · {g['errors']} err · "
+              f"in {g['prompt_tokens']} / out {g['completion_tokens']} tok · "
+              f"repaired {g['repaired']} · bad json {g['bad_json']} · "
+              f"{g['completion_tokens'] / g['seconds'] if g['seconds'] else 0:.0f} tok/s")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.mix_speaking > 0 and not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg topilmadi: speaking flow uchun kerak (yoki --mix-speaking 0)")
+    configure_env(args)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,353 @@
+# =========================================================
+# MICROBENCHMARKS (regression gate)
+#
+#   python bench/micro.py                 # baselines.json bilan solishtirish
+#   python bench/micro.py --save          # joriy natijani baseline qilib yozish
+#   python bench/micro.py --sizes 10000 --only users
+#
+# Har case eng yaxshi vaqt (sekund / chaqiruv, timeit kabi min) bilan o‘lchanadi —
+# median’ga qaraganda shovqinga chidamliroq. Baseline’dan --threshold
+# (default 25%) dan ko‘proq sekinlashgan case bo‘lsa exit code 1.
+# Baseline mashinaga bog‘liq — boshqa mashinada avval --save qiling.
+# =========================================================
+
+from __future__ import annotations
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+from typing import Callable, Dict, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINES_FILE = os.path.join(HERE, "baselines.json")
+
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+import main  # noqa: E402
+
+
+# ---------------------------------------------------------
+# Runner
+# ---------------------------------------------------------
+class Case:
+    def __init__(self, name: str, fn: Callable[[], object], setup: Optional[Callable[[], None]] = None,
+                 teardown: Optional[Callable[[], None]] = None, number: int = 1,
+                 each: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.teardown = teardown
+        self.each = each       # har chaqiruvdan oldin, o‘lchovdan tashqarida (holatni tiklash)
+        self.number = number   # bitta o‘lchovdagi chaqiruvlar soni (tez funksiyalar uchun)
+
+
+def _timed(case: Case) -> float:
+    if not case.each:
+        t0 = time.perf_counter()
+        for _ in range(case.number):
+            case.fn()
+        return time.perf_counter() - t0
+    dt = 0.0
+    for _ in range(case.number):
+        case.each()
+        t0 = time.perf_counter()
+        case.fn()
+        dt += time.perf_counter() - t0
+    return dt
+
+
+def measure(case: Case, min_time: float, min_repeat: int) -> Tuple[float, int]:
+    if case.setup:
+        case.setup()
+    try:
+        if case.each:
+            case.each()
+        case.fn()   # warm-up
+        times: List[float] = []
+        spent = 0.0
+        while len(times) < min_repeat or spent < min_time:
+            gc.collect()
+            gc.disable()
+            try:
+                dt = _timed(case)
+            finally:
+                gc.enable()
+            times.append(dt / case.number)
+            spent += dt
+            if len(times) >= 200:
+                break
+        return min(times), len(times)
+    finally:
+        if case.teardown:
+            case.teardown()
+
+
+# ---------------------------------------------------------
+# Data generators (deterministik)
+# ---------------------------------------------------------
+WORDS = ("the people believe that money is important because work family time city school "
+         "friend manager email account password study career passion salary health").split()
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    out = []
+    for i in range(words):
+        out.append(rng.choice(WORDS))
+        if i % 14 == 13:
+            out[-1] += "."
+    return " ".join(out)
+
+
+def make_writing(rng: random.Random, words_per_task: int) -> str:
+    return "\n".join(f"{n}) {make_text(rng, words_per_task)}" for n in (1, 2, 3))
+
+
+def make_users(rng: random.Random, n: int) -> Dict[str, Dict]:
+    now = time.time()
+    out: Dict[str, Dict] = {}
+    for i in range(n):
+        first = now - rng.uniform(0, 365 * 86400)
+        rec = {
+            "first": first,
+            "last": rng.uniform(first, now),
+            "sub_ok": 1 if rng.random() < 0.7 else 0,
+            "sub_first": first,
+            "sub_last": rng.uniform(first, now),
+        }
+        if rng.random() < 0.6:
+            rec["username"] = f"user{i}"
+            rec["name"] = f"Name {i}"
+        out[str(1_000_000 + i)] = rec
+    return out
+
+
+def make_model_output(rng: random.Random, items: int) -> str:
+    obj = {
+        "score_20_75": 48,
+        "feedback_uz": "Yaxshi, lekin grammatikaga e’tibor bering. " * 20,
+        "overall_mistakes": [make_text(rng, 8) for _ in range(items)],
+        "per_task": [{"task_no": n, "issues": [make_text(rng, 10) for _ in range(items)],
+                      "rewrite": make_text(rng, 250)} for n in (1, 2, 3)],
+    }
+    return "Here is the evaluation:\n```json\n" + json.dumps(obj, ensure_ascii=False, indent=2) + "\n```\n"
+
+
+def make_events(seed: int, n: int, root: str, days: int = 30):
+    # bitta partition, main.EventStore formatida (ts o‘suvchi)
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    path = os.path.join(root, "p0")
+    os.makedirs(path, exist_ok=True)
+    now = int(time.time())
+    np.sort(rng.integers(now - days * 86400, now, n)).astype("<u4").tofile(os.path.join(path, "ts.col"))
+    rng.integers(1, max(2, n // 50), n).astype("<i8").tofile(os.path.join(path, "user.col"))
+    kind = rng.integers(0, len(main.EVENT_KINDS), n).astype("u1")
+    kind.tofile(os.path.join(path, "kind.col"))
+    np.where(kind == main.EVENT_KINDS.index("dict"), -1, rng.integers(20, 76, n)).astype("i1").tofile(os.path.join(path, "score.col"))
+    rng.integers(100, 60_000, n).astype("<u4").tofile(os.path.join(path, "latency_ms.col"))
+    np.array([n], dtype="<i8").tofile(os.path.join(path, "count.i8"))
+
+
+def make_voice(rng: random.Random, seconds: int):
+    # gap’lari bor "nutq": shovqin bo‘laklari + 250–700ms pauzalar (16kHz mono, ffmpeg’siz)
+    from pydub import AudioSegment
+    from pydub.generators import WhiteNoise
+    seg = AudioSegment.silent(0, frame_rate=16000)
+    while len(seg) < seconds * 1000:
+        seg += WhiteNoise().to_audio_segment(duration=rng.randint(1500, 5000)).apply_gain(-15).set_frame_rate(16000)
+        seg += AudioSegment.silent(rng.randint(250, 700), frame_rate=16000)
+    return seg.set_channels(1).set_sample_width(2)
+
+
+# ---------------------------------------------------------
+# Cases
+# ---------------------------------------------------------
+def build_cases(sizes: List[int], tmpdir: str, only: Optional[str] = None) -> List[Case]:
+    rng = random.Random(42)
+    cases: List[Case] = []
+    wanted = lambda name: not only or only in name
+
+    # --- writing split ---
+    for words in (100, 2_000, 20_000):
+        text = make_writing(rng, words)
+        cases.append(Case(f"split_writing_3_tasks[{words}w]",
+                          lambda t=text: main._split_writing_3_tasks(t),
+                          number=max(1, 2_000 // words)))
+
+    # --- is_uzbek_text ---
+    samples = {
+        "en": "improve quickly",
+        "uz_latin": "bugun kecha qanday",
+        "uz_cyr": "қандай яхши",
+        "long_en": make_text(rng, 200),
+    }
+    for label, s in samples.items():
+        cases.append(Case(f"is_uzbek_text[{label}]", lambda s=s: main.is_uzbek_text(s), number=2_000))
+
+    # --- local pre-scorer ---
+    for words in (60, 600):
+        text = make_text(rng, words)
+        cases.append(Case(f"text_features[{words}w]", lambda t=text: main.text_features(t),
+                          number=max(1, 3_000 // words)))
+
+    # --- long voice split ---
+    if wanted("voice_cut_points"):
+        voice = make_voice(random.Random(120), 120)
+        cases.append(Case("voice_cut_points[120s]", lambda: main.voice_cut_points(voice), number=5))
+
+    # --- CEFR ---
+    scores = list(range(0, 100))
+    cases.append(Case("cefr_from_score_20_75[x100]",
+                      lambda: [main.cefr_from_score_20_75(x) for x in scores], number=200))
+
+    # --- JSON extraction ---
+    for items in (10, 200):
+        content = make_model_output(rng, items)
+        cases.append(Case(f"extract_json_object[{len(content) // 1024}KB]",
+                          lambda c=content: main._extract_json_object(c),
+                          number=max(1, 200 // items)))
+        truncated = content[:len(content) * 2 // 3]
+        cases.append(Case(f"repair_truncated_json[{len(truncated) // 1024}KB]",
+                          lambda c=truncated: main.parse_model_json(c),
+                          number=max(1, 100 // items)))
+
+    # --- event log ---
+    if wanted("event_append"):
+        store = main.EventStore(os.path.join(tmpdir, "events_append"))
+        store.open("p0")
+        cases.append(Case("event_append", lambda: store.append("dict", 1_000_001, None, 0.25), number=5_000))
+    for n in (1_000_000, 10_000_000):
+        name = f"events_report[{n // 1_000_000}M,30d]"
+        if not wanted(name):
+            continue
+        root = os.path.join(tmpdir, f"events_{n}")
+        make_events(n, n, root)
+
+        saved_events = (main.EVENTS_DIR, main.EVENTS)
+
+        def use_events(root=root):
+            main.EVENTS_DIR = root
+
+        def restore_events(saved=saved_events):
+            main.EVENTS_DIR, main.EVENTS = saved
+
+        cases.append(Case(name, lambda: main.events_report(30), setup=use_events, teardown=restore_events))
+
+    # --- users table / persistence ---
+    for n in sizes:
+        if not any(wanted(f"{k}[{n}]") for k in ("load_users", "save_json", "count_active_users")):
+            continue   # katta fixture’ni bekorga yasamaymiz
+        users = make_users(random.Random(n), n)
+        path = os.path.join(tmpdir, f"users_{n}.json")
+        main.save_json(path, users)
+
+        def use_file(path=path):
+            main.USERS_FILE = path
+
+        def reset_db():
+            main.USERS_DB = {}
+
+        # load_users fayldagini jonli USERS_DB bilan birlashtiradi — cold start’dagidek bo‘sh jadvaldan
+        cases.append(Case(f"load_users[{n}]", main.load_users, setup=use_file, teardown=reset_db, each=reset_db))
+        cases.append(Case(f"save_json[{n}]",
+                          lambda users=users, n=n: main.save_json(os.path.join(tmpdir, f"out_{n}.json"), users)))
+
+        def load_db(path=path):
+            use_file(path)
+            main.load_users()
+
+        cases.append(Case(f"count_active_users[{n}]", lambda: main._count_active_users(7),
+                          setup=load_db, teardown=reset_db))
+        del users
+
+    return [c for c in cases if wanted(c.name)]
+
+
+# ---------------------------------------------------------
+# Report / gate
+# ---------------------------------------------------------
+def fmt(sec: float) -> str:
+    if sec >= 1:
+        return f"{sec:.3f} s"
+    if sec >= 1e-3:
+        return f"{sec * 1e3:.3f} ms"
+    return f"{sec * 1e6:.2f} µs"
+
+
+def load_baselines() -> Dict:
+    try:
+        with open(BASELINES_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def machine_info() -> str:
+    return f"{platform.python_implementation()} {platform.python_version()} · {platform.machine()} · {os.cpu_count()} cpu"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Microbenchmarks with baseline regression gate")
+    p.add_argument("--save", action="store_true", help="natijani baselines.json ga yozish")
+    p.add_argument("--threshold", type=float, default=0.25, help="ruxsat etilgan sekinlashish (0.25 = 25%%)")
+    p.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",") if x],
+                   default=[10_000, 100_000, 1_000_000], help="users soni, vergul bilan")
+    p.add_argument("--only", help="faqat nomida shu substring bor case’lar")
+    p.add_argument("--min-time", type=float, default=0.3, help="har case uchun minimal o‘lchov vaqti (s)")
+    p.add_argument("--min-repeat", type=int, default=5)
+    return p.parse_args()
+
+
+def main_cli() -> int:
+    args = parse_args()
+    baselines = load_baselines()
+    base_cases: Dict[str, Dict] = baselines.get("cases", {})
+    if baselines.get("machine") and baselines["machine"] != machine_info() and not args.save:
+        print(f"⚠️ baseline boshqa mashinada olingan: {baselines['machine']}")
+
+    results: Dict[str, Dict] = {}
+    regressions: List[str] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cases = build_cases(args.sizes, tmpdir, args.only)
+
+        print(f"{'case':<36}{'best':>14}{'baseline':>14}{'delta':>9}  runs")
+        for case in cases:
+            best, runs = measure(case, args.min_time, args.min_repeat)
+            results[case.name] = {"best_s": best}
+            base = (base_cases.get(case.name) or {}).get("best_s")
+            delta = ""
+            mark = ""
+            if base:
+                ratio = best / base - 1.0
+                delta = f"{ratio * 100:+.1f}%"
+                if ratio > args.threshold:
+                    regressions.append(case.name)
+                    mark = "  ❌"
+            print(f"{case.name:<36}{fmt(best):>14}{fmt(base) if base else '-':>14}{delta:>9}  {runs}{mark}")
+
+    if args.save:
+        merged = dict(base_cases)
+        merged.update(results)
+        with open(BASELINES_FILE, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine_info(), "cases": dict(sorted(merged.items()))}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\n💾 baseline saqlandi: {BASELINES_FILE}")
+        return 0
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} ta regressiya (> {args.threshold * 100:.0f}%): {', '.join(regressions)}")
+        return 1
+    print("\n✅ regressiya yo‘q")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
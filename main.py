@@ -18,21 +18,40 @@ import math
 import asyncio
 import random
 import tempfile
-from typing import Dict, List, Tuple, Optional, Any
+import heapq
+import itertools
+import functools
+import glob
+import bisect
+import importlib.util
+import zlib
+import signal
+import multiprocessing
+from contextlib import contextmanager
+import contextvars
+from contextvars import ContextVar
+from typing import Dict, List, Tuple, Optional, Any, Iterator, Set
 from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+
+_BOOT_T0 = time.perf_counter()
 
 import requests
-from flask import Flask
-from pydub import AudioSegment
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import Bot, Dispatcher, F, BaseMiddleware
 from aiogram.types import (
-    Message, CallbackQuery,
+    Message, CallbackQuery, ChatMemberUpdated,
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton,
-    FSInputFile
+    FSInputFile, Update
 )
 from aiogram.filters import CommandStart, Command
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import GetUpdates
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
@@ -50,7 +69,13 @@ CHANNEL_URL = (os.getenv("CHANNEL_URL", "https://t.me/speakingzoneway") or "http
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "0"))
 
 PORT = int(os.getenv("PORT", "10000"))
-GROQ_BASE = "https://api.groq.com/openai/v1"
+GROQ_BASE = (os.getenv("GROQ_BASE", "") or "https://api.groq.com/openai/v1").rstrip("/")
+
+# tashqi API’lar (benchmark/test uchun lokal stand-in’ga yo‘naltirsa bo‘ladi)
+TELEGRAM_API_URL = (os.getenv("TELEGRAM_API_URL", "") or "").strip()
+TRANSLATE_URL = os.getenv("TRANSLATE_URL", "") or "https://translate.googleapis.com/translate_a/single"
+DICT_API_URL = (os.getenv("DICT_API_URL", "") or "https://api.dictionaryapi.dev/api/v2/entries/en").rstrip("/")
+TTS_URL = os.getenv("TTS_URL", "") or "https://translate.google.com/translate_tts"
 
 GROQ_CHAT_MODELS = [
     (os.getenv("GROQ_CHAT_MODEL", "") or "").strip() or "llama-3.3-70b-versatile",
@@ -59,6 +84,25 @@ GROQ_CHAT_MODELS = [
     "llama3-8b-8192",
 ]
 
+# arzon/tez model’lar (kichik input’lar, writing merge)
+GROQ_FAST_MODELS = [
+    (os.getenv("GROQ_FAST_MODEL", "") or "").strip() or "llama-3.1-8b-instant",
+    "llama3-8b-8192",
+]
+
+# routing: input shu tokendan kichik bo‘lsa -> GROQ_FAST_MODELS, aks holda katta model
+GROQ_SMALL_INPUT_TOKENS = int(os.getenv("GROQ_SMALL_INPUT_TOKENS", "250"))
+# max_tokens = base + per_input * input_tokens (maqsad bo‘yicha), GROQ_MAX_OUTPUT_TOKENS gacha
+GROQ_MAX_OUTPUT_TOKENS = 4096
+GROQ_OUTPUT_BUDGETS = {
+    "default": (400, 2.0),
+    "speaking": (700, 1.0),
+    "writing": (500, 2.5),
+    "writing_task": (250, 2.0),
+    "writing_merge": (300, 0.0),
+}
+GROQ_FORCED_ROUTES = {"writing_merge": "fast"}
+
 STATS_FILE = "stats.json"
 ADMINS_FILE = "admins.json"
 USERS_FILE = "users.json"
@@ -66,34 +110,164 @@ IMAGE_FOLDER = "images"
 
 DEFAULT_ADMIN_IDS = {858726164, 1593591147}
 
-# ✅ speaking timer each 1 second
-TIMER_EDIT_EVERY = 1
-
-# stats/users batch save
-STATS_AUTOSAVE_EVERY = 10
-USERS_AUTOSAVE_EVERY = 10
-
-# ✅ subscription cache (strict)
-SUB_CACHE_TTL = 5
+# ✅ speaking timer: boshida siyrak, oxirgi soniyalarda har 1 sekund
+TIMER_FINE_SECONDS = 5
+TIMER_MID_SECONDS = 30
+TIMER_MID_EVERY = 5
+TIMER_COARSE_EVERY = 10
+
+# stats/users batch save — to‘xtashda (SIGTERM/SIGINT) baribir yakuniy flush bor
+STATS_AUTOSAVE_EVERY = int(os.getenv("STATS_AUTOSAVE_EVERY", "300"))
+USERS_AUTOSAVE_EVERY = int(os.getenv("USERS_AUTOSAVE_EVERY", "300"))
+
+# event log: har tugagan exam/lookup/writing — ustunli append-only fayllar (numpy memmap)
+EVENTS_DIR = os.getenv("EVENTS_DIR", "events")
+EVENTS_GROW_ROWS = 1 << 20
+EVENTS_DEFAULT_DAYS = 7
+
+# graceful shutdown: in-flight handlerlar va outbound navbat shuncha kutiladi (Render ~30s beradi)
+SHUTDOWN_DRAIN_SECONDS = int(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+
+# ✅ Broadcast (/broadcast): checkpoint shu faylga (shard’da — har shard o‘z faylida)
+BROADCAST_FILE = "broadcast.json"
+BROADCAST_INFLIGHT = 20           # OUTBOUND’da bir vaqtda turgan bulk xabarlar
+BROADCAST_CHECKPOINT_EVERY = 5
+BROADCAST_PROGRESS_EVERY = 10
+
+# cold start: users/stats fonda yuklanadi; to‘liq jadval kerak bo‘lgan handlerlar shuncha kutadi
+STATE_READY_TIMEOUT = 60
+
+# blocking ishlar uchun pool’lar (thread soni + pool ichidagi navbat)
+EXEC_GROQ_THREADS = int(os.getenv("EXEC_GROQ_THREADS", "16"))
+EXEC_LOOKUP_THREADS = int(os.getenv("EXEC_LOOKUP_THREADS", "16"))
+EXEC_AUDIO_THREADS = int(os.getenv("EXEC_AUDIO_THREADS", str(os.cpu_count() or 2)))
+EXEC_ANALYTICS_THREADS = int(os.getenv("EXEC_ANALYTICS_THREADS", "2"))
+EXEC_QUEUE_MAX = int(os.getenv("EXEC_QUEUE_MAX", "64"))
+
+# outbound: Telegram limitlari (global ~30 msg/s, chat ~1 msg/s)
+SEND_GLOBAL_RATE = 25
+SEND_CHAT_RATE = 1.0
+SEND_CHAT_BURST = 4
+SEND_MAX_RETRIES = 3
+SEND_CONCURRENCY = 32
+
+# per-user navbat: bitta user uchun max kutayotgan update, global parallel ishlar
+USER_QUEUE_MAX = 3
+USER_ACTOR_WORKERS = 64
+
+# multi-process: SHARDS>1 bo‘lsa supervisor polling qiladi, update’lar user_id hash bo‘yicha
+# N ta worker process’ga taqsimlanadi (FSM, speaking timer, users/stats — shu shard’da)
+SHARDS = max(1, int(os.getenv("SHARDS", "1")))
+SHARD_QUERY_TIMEOUT = 10
+SHARD_RESTART_DELAY = 2          # har ketma-ket restart’da ikki barobar
+SHARD_RESTART_MAX = 5            # SHARD_RESTART_WINDOW ichida shundan ko‘p yiqilsa — cooldown
+SHARD_RESTART_WINDOW = 60
+SHARD_RESTART_COOLDOWN = 60      # bu vaqtda shard’ga update yuborilmaydi (tashlab yuboriladi)
+SHARD_BACKLOG_MAX = 1000         # restart kutayotgan shard uchun navbatdagi update’lar
+
+# obuna tekshirilmaydigan buyruqlar
+GATE_EXEMPT_COMMANDS = ("/admin", "/all", "/online", "/sub", "/pools", "/perf", "/groq", "/events", "/broadcast")
+
+# online oynalari (sekund): 1, 5, 15 min
+ONLINE_WINDOWS = (60, 300, 900)
+
+# /admin TOP ro‘yxati
+TOP_K_SIZE = 10
+
+# admin: profil (username) topilmasa get_chat — parallel, limit bilan
+PROFILE_FETCH_CONCURRENCY = 8
+PROFILE_FETCH_RATE = 20
+
+# ✅ subscription: chat_member update’lar + uzoq TTL + fon tekshiruv
+SUB_STATUS_TTL = 6 * 3600
+SUB_ERROR_TTL = 30               # get_chat_member xatosi + keshda yozuv yo‘q: qisqa muddatli "yo‘q"
+SUB_RECHECK_EVERY = 30
+SUB_RECHECK_RATE = 5
+
+# tracing: span’lar ring buffer’i, tugagan trace’lar, /perf oynasi (min)
+TRACE_SPANS_MAX = 20000
+TRACE_TRACES_MAX = 2000
+TRACE_WINDOW_MINUTES = 15
+PERF_SLOW_TRACES = 5              # /perf «eng sekin» ro‘yxati
+
+# writing baholash: "parallel" (har task alohida, bir vaqtda), "stream" (bitta so‘rov,
+# natija bo‘lib-bo‘lib chiqadi) yoki "single"
+WRITING_EVAL_MODE = (os.getenv("WRITING_EVAL_MODE", "") or "parallel").strip().lower()
+WRITING_EDIT_EVERY = 1.5
+# parallel: task’lar og‘irligi (essay ikki barobar), LLM’siz o‘tkaziladigan minimal so‘z soni,
+# javobsiz task bo‘lsa umumiy ball shu qiymatdan oshmaydi
+WRITING_TASK_WEIGHTS = (1, 1, 2)
+WRITING_MIN_WORDS = (8, 20, 40)
+WRITING_SKIPPED_CAP = 37
+
+# LLM’siz pre-scorer: kutilgan hajm (so‘z), shundan kam bo‘lsa LLM chaqirilmaydi
+WRITING_TARGET_WORDS = (50, 120, 180)
+WRITING_DEGENERATE_WORDS = 20
+SPEAKING_TARGET_WORDS = 250
+SPEAKING_MIN_WORDS = 12
+
+# speaking voice: uzun javob pauzalardan bo‘linib, bo‘laklari parallel STT qilinadi
+VOICE_MAX_SECONDS = 180          # bundan uzuni yuklab ham olinmaydi
+VOICE_CHUNK_AFTER = 30           # voice.duration shundan uzun bo‘lsa bo‘linadi
+VOICE_CHUNK_SECONDS = 20         # bo‘lak uzunligi (taxminan)
+VOICE_CUT_WINDOW = 5             # kesish nuqtasi — ±shu oraliqdagi eng jim joy
+VOICE_FRAME_MS = 20
+VOICE_PAUSE_MS = 300             # energiya shu oyna bo‘yicha o‘rtalanadi (bitta jim frame emas, pauza)
+STT_CHUNK_CONCURRENCY = 8        # bitta voice’ning bir vaqtdagi bo‘laklari
+GROQ_STT_RATE = float(os.getenv("GROQ_STT_RATE", "5"))   # so‘rov/sek (shard’larga bo‘linadi)
+GROQ_STT_BURST = 8               # bir voice’ning bo‘laklari kutmasdan birga ketadi
+
+# dictionary batch (bir xabarda bir nechta so‘z)
+DICT_BATCH_MAX = 20
+DICT_BATCH_CONCURRENCY = 4
+DICT_BATCH_AUDIO = True
 
 
 # =========================================================
 # Flask keep alive (Render)
 # =========================================================
-app = Flask(__name__)
+def create_web_app():
+    from flask import Flask   # lazy: faqat web thread ichida kerak
+
+    app = Flask(__name__)
 
-@app.get("/")
-def home():
-    return "OK"
+    @app.get("/")
+    def home():
+        return "OK"
 
-@app.get("/health")
-def health():
-    return "healthy", 200
+    @app.get("/health")
+    def health():
+        return "healthy", 200
+
+    return app
 
 def run_web():
+    with startup_phase("web_import"):
+        app = create_web_app()
     app.run(host="0.0.0.0", port=PORT)
 
 
+# =========================================================
+# Startup timing
+# =========================================================
+STARTUP_PHASES: List[Tuple[str, float]] = []
+
+@contextmanager
+def startup_phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_PHASES.append((name, time.perf_counter() - t0))
+
+def startup_mark(name: str):
+    # boot boshidan beri (import + ...) o‘tgan vaqt
+    STARTUP_PHASES.append((name, time.perf_counter() - _BOOT_T0))
+
+def startup_report() -> str:
+    return " · ".join(f"{name} {sec:.2f}s" for name, sec in STARTUP_PHASES) or "—"
+
+
 # =========================================================
 # States (FSM)
 # =========================================================
@@ -160,38 +334,384 @@ def dictionary_menu() -> ReplyKeyboardMarkup:
 if not BOT_TOKEN or "PASTE_" in BOT_TOKEN:
     print("❌ ERROR: BOT_TOKEN qo‘yilmagan. main.py ichida BOT_TOKEN ni to‘ldiring.")
 
-bot = Bot(token=BOT_TOKEN) if BOT_TOKEN and "PASTE_" not in BOT_TOKEN else None
+def _bot_session() -> Optional[AiohttpSession]:
+    if not TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+
+bot = Bot(token=BOT_TOKEN, session=_bot_session()) if BOT_TOKEN and "PASTE_" not in BOT_TOKEN else None
 dp = Dispatcher()
 
 
 # =========================================================
-# Online tracking
+# Tracing: har update — trace, ichida span’lar (download, stt, llm, send...)
 # =========================================================
-LAST_SEEN: Dict[int, float] = {}
+class _Trace:
+    __slots__ = ("name", "user_id", "wall", "started", "total", "spans")
 
-def touch_user(user_id: int):
-    now = time.time()
-    LAST_SEEN[user_id] = now
+    def __init__(self, name: str, user_id: int):
+        self.name = name
+        self.user_id = user_id
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.spans: List[Tuple[str, float]] = []
+
+
+CURRENT_TRACE: ContextVar[Optional[_Trace]] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    def __init__(self, spans_max: int, traces_max: int):
+        self.spans: deque = deque(maxlen=spans_max)     # (wall_ts, step, seconds)
+        self.traces: deque = deque(maxlen=traces_max)   # tugagan _Trace’lar
+
+    def record(self, step: str, seconds: float):
+        # executor thread’laridan ham chaqiriladi (context copy_context bilan keladi)
+        self.spans.append((time.time(), step, seconds))
+        tr = CURRENT_TRACE.get()
+        if tr is not None:
+            tr.spans.append((step, seconds))
+
+    @contextmanager
+    def span(self, step: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - t0)
+
+    @contextmanager
+    def trace(self, name: str, user_id: int = 0):
+        tr = _Trace(name, user_id)
+        token = CURRENT_TRACE.set(tr)
+        try:
+            yield tr
+        finally:
+            CURRENT_TRACE.reset(token)
+            tr.total = time.perf_counter() - tr.started
+            self.traces.append(tr)
+
+    def step_stats(self, within_seconds: float) -> Dict[str, List[float]]:
+        cutoff = time.time() - within_seconds
+        by_step: Dict[str, List[float]] = {}
+        for ts, step, sec in reversed(list(self.spans)):
+            if ts < cutoff:
+                break
+            by_step.setdefault(step, []).append(sec)
+        return by_step
+
+    def recent_traces(self, within_seconds: float) -> List[_Trace]:
+        cutoff = time.time() - within_seconds
+        out = []
+        for tr in reversed(list(self.traces)):
+            if tr.wall < cutoff:
+                break
+            out.append(tr)
+        return out
+
+
+TRACER = Tracer(TRACE_SPANS_MAX, TRACE_TRACES_MAX)
+
+
+def traced(step: str):
+    def deco(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with TRACER.span(step):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(step):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# =========================================================
+# Outbound queue (Telegram rate limit + flood wait + edit coalescing)
+# =========================================================
+PRIO_RESULT = 0
+PRIO_QUESTION = 1
+PRIO_NORMAL = 2
+PRIO_TIMER = 3
+PRIO_BULK = 4      # broadcast — interaktiv xabarlardan keyin
+
+OUTBOUND_METHOD_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+SEND_PRIORITY: ContextVar[Optional[int]] = ContextVar("send_priority", default=None)
+
+@contextmanager
+def send_priority(prio: int):
+    token = SEND_PRIORITY.set(prio)
     try:
-        with _users_lock:
-            if user_id not in USERS_DB:
-                USERS_DB[user_id] = {"first": now, "last": now}
-                mark_users_dirty()
+        yield
+    finally:
+        SEND_PRIORITY.reset(token)
+
+
+class _OutJob:
+    __slots__ = ("prio", "seq", "chat_id", "method", "make_request", "bot", "future", "edit_key", "tries")
+
+    def __lt__(self, other: "_OutJob") -> bool:
+        return (self.prio, self.seq) < (other.prio, other.seq)
+
+
+def _chain_future(src: asyncio.Future, dst: asyncio.Future):
+    def _done(f: asyncio.Future):
+        if dst.done():
+            return
+        if f.cancelled():
+            dst.cancel()
+        elif f.exception() is not None:
+            dst.set_exception(f.exception())
+        else:
+            dst.set_result(f.result())
+    src.add_done_callback(_done)
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    def __init__(self):
+        self.heap: List[_OutJob] = []
+        # chat bloklangan / token tugagan: job’lar shu chat’ning navbatida, heap’da emas;
+        # har parked chat uchun wakes’da bitta (uyg‘onish vaqti, seq, chat_id)
+        self.parked: Dict[Any, List[_OutJob]] = {}
+        self.wakes: List[Tuple[float, int, Any]] = []
+        self.seq = itertools.count()
+        self.pending_edits: Dict[Tuple[Any, int], _OutJob] = {}
+        self.chat_tokens: Dict[Any, Tuple[float, float]] = {}
+        self.chat_blocked_until: Dict[Any, float] = {}
+        self.global_next = 0.0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "coalesced": 0, "retry_after": 0, "failed": 0}
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(SEND_CONCURRENCY)
+        self.task = asyncio.create_task(self._run())
+
+    def qsize(self) -> int:
+        return len(self.heap) + sum(len(q) for q in self.parked.values())
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            # long-poll: kutish vaqti polling timeout’gacha — "api" statistikasini buzmasin
+            return await make_request(bot, method)
+        outgoing = type(method).__name__.startswith(OUTBOUND_METHOD_PREFIXES)
+        step = ("send_bulk" if SEND_PRIORITY.get() == PRIO_BULK else "send") if outgoing else "api"
+        with TRACER.span(step):
+            return await self._submit(make_request, bot, method, outgoing)
+
+    async def _submit(self, make_request, bot, method, outgoing: bool):
+        chat_id = getattr(method, "chat_id", None)
+        name = type(method).__name__
+        if self.task is None or chat_id is None or not outgoing:
+            return await make_request(bot, method)
+
+        prio = SEND_PRIORITY.get()
+        if prio is None:
+            prio = PRIO_TIMER if name == "EditMessageText" else PRIO_NORMAL
+
+        edit_key = None
+        if name == "EditMessageText" and getattr(method, "message_id", None):
+            edit_key = (chat_id, method.message_id)
+            old = self.pending_edits.get(edit_key)
+            if old is not None and old.prio == prio:
+                # ✅ navbatdagi edit’ni yangilaymiz — faqat oxirgi matn ketadi
+                old.method = method
+                old.make_request = make_request
+                self.stats["coalesced"] += 1
+                return await asyncio.shield(old.future)
+
+        job = _OutJob()
+        job.prio = prio
+        job.seq = next(self.seq)
+        job.chat_id = chat_id
+        job.method = method
+        job.make_request = make_request
+        job.bot = bot
+        job.future = asyncio.get_running_loop().create_future()
+        job.edit_key = edit_key
+        job.tries = 0
+        self._push(job)
+        return await asyncio.shield(job.future)
+
+    def _push(self, job: _OutJob):
+        if job.edit_key is not None:
+            self.pending_edits[job.edit_key] = job
+        parked = self.parked.get(job.chat_id)
+        if parked is not None:
+            heapq.heappush(parked, job)   # chat baribir kutyapti — heap’ni aylantirmaymiz
+        else:
+            heapq.heappush(self.heap, job)
+        self.wakeup.set()
+
+    def _chat_wait(self, chat_id, now: float) -> float:
+        # chat yana yubora olishigacha sekund (0 — hozir)
+        tokens, ts = self.chat_tokens.get(chat_id, (float(SEND_CHAT_BURST), now))
+        tokens = min(float(SEND_CHAT_BURST), tokens + (now - ts) * SEND_CHAT_RATE)
+        self.chat_tokens[chat_id] = (tokens, now)
+        blocked = self.chat_blocked_until.get(chat_id, 0.0) - now
+        return max(0.0, blocked, (1.0 - tokens) / SEND_CHAT_RATE)
+
+    def _park(self, job: _OutJob, until: float):
+        parked = self.parked.get(job.chat_id)
+        if parked is None:
+            self.parked[job.chat_id] = [job]
+            heapq.heappush(self.wakes, (until, next(self.seq), job.chat_id))
+        else:
+            heapq.heappush(parked, job)
+
+    def _unpark(self, now: float):
+        while self.wakes and self.wakes[0][0] <= now:
+            _until, _seq, chat_id = heapq.heappop(self.wakes)
+            for job in self.parked.pop(chat_id, ()):
+                heapq.heappush(self.heap, job)
+
+    def _pop_ready(self) -> Optional[_OutJob]:
+        now = time.monotonic()
+        self._unpark(now)
+        while self.heap:
+            job = heapq.heappop(self.heap)
+            if job.future.done():
+                continue
+            wait = self._chat_wait(job.chat_id, now)
+            if wait > 0:
+                # RetryAfter o‘sgan bo‘lsa ham: erta uyg‘onsa qayta tekshirilib yana park bo‘ladi
+                self._park(job, now + wait)
+                continue
+            tokens, ts = self.chat_tokens[job.chat_id]
+            self.chat_tokens[job.chat_id] = (tokens - 1.0, ts)
+            return job
+        return None
+
+    def _next_wake(self) -> Optional[float]:
+        if self.heap:
+            return 0.01
+        if not self.wakes:
+            return None
+        return max(self.wakes[0][0] - time.monotonic(), 0.01)
+
+    def _gc(self):
+        now = time.monotonic()
+        for chat_id, (tokens, ts) in list(self.chat_tokens.items()):
+            if now - ts > 60:
+                self.chat_tokens.pop(chat_id, None)
+        for chat_id, until in list(self.chat_blocked_until.items()):
+            if until <= now:
+                self.chat_blocked_until.pop(chat_id, None)
+
+    async def _run(self):
+        last_gc = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if self.global_next > now:
+                await asyncio.sleep(self.global_next - now)
+
+            job = self._pop_ready()
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self._next_wake())
+                except asyncio.TimeoutError:
+                    pass
+                if time.monotonic() - last_gc > 60:
+                    self._gc()
+                    last_gc = time.monotonic()
+                continue
+
+            if job.edit_key is not None and self.pending_edits.get(job.edit_key) is job:
+                self.pending_edits.pop(job.edit_key, None)
+
+            self.global_next = max(time.monotonic(), self.global_next) + 1.0 / SEND_GLOBAL_RATE
+            await self.slots.acquire()
+            asyncio.create_task(self._send(job))
+
+    async def _send(self, job: _OutJob):
+        try:
+            res = await job.make_request(job.bot, job.method)
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(res)
+        except TelegramRetryAfter as e:
+            self.stats["retry_after"] += 1
+            until = time.monotonic() + float(e.retry_after)
+            self.chat_blocked_until[job.chat_id] = max(self.chat_blocked_until.get(job.chat_id, 0.0), until)
+            job.tries += 1
+            newer = self.pending_edits.get(job.edit_key) if job.edit_key is not None else None
+            if newer is not None:
+                # shu xabarga yangiroq edit navbatda — o‘sha natijani kutamiz
+                _chain_future(newer.future, job.future)
+            elif job.tries <= SEND_MAX_RETRIES:
+                self._push(job)
             else:
-                rec = USERS_DB.get(user_id) or {}
-                if not isinstance(rec, dict):
-                    rec = {"first": now, "last": now}
-                if not rec.get("first"):
-                    rec["first"] = now
-                rec["last"] = now
-                USERS_DB[user_id] = rec
-                mark_users_dirty()
-    except Exception:
-        pass
+                self.stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self.slots.release()
+            self.wakeup.set()
+
+
+OUTBOUND = OutboundQueue()
+
+
+# =========================================================
+# Online tracking
+# =========================================================
+class OnlineTracker:
+    # insertion-ordered: eng eski boshida, horizon’dan eskilari o‘chiriladi
+    def __init__(self, horizon: int):
+        self.horizon = horizon
+        self.seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def touch(self, user_id: int, now: float):
+        self.seen[user_id] = now
+        self.seen.move_to_end(user_id)
+        self._evict(now)
+
+    def _evict(self, now: float):
+        limit = now - self.horizon
+        while self.seen:
+            uid, ts = next(iter(self.seen.items()))
+            if ts >= limit:
+                break
+            self.seen.popitem(last=False)
+
+    def last_seen(self, user_id: int) -> Optional[float]:
+        return self.seen.get(user_id)
+
+    def users(self, within_seconds: int) -> List[int]:
+        # ✅ O(online): oxiridan boshlab, oyna tugaguncha
+        now = time.time()
+        self._evict(now)
+        out = []
+        for uid, ts in reversed(self.seen.items()):
+            if now - ts > within_seconds:
+                break
+            out.append(uid)
+        return out
+
+    def count(self, within_seconds: int) -> int:
+        return len(self.users(within_seconds))
+
+
+ONLINE = OnlineTracker(max(ONLINE_WINDOWS))
 
 def online_users(within_seconds: int = 300) -> List[int]:
-    now = time.time()
-    return [uid for uid, ts in LAST_SEEN.items() if now - ts <= within_seconds]
+    return ONLINE.users(within_seconds)
 
 
 # =========================================================
@@ -203,6 +723,8 @@ _users_lock = Lock()
 stats_dirty = False
 users_dirty = False
 
+STATS_SECTIONS = ("exams_completed", "dict_lookups", "writings_completed")
+
 stats = {
     "exams_completed": {},
     "dict_lookups": {},
@@ -211,6 +733,18 @@ stats = {
 
 USERS_DB: Dict[int, Dict[str, Any]] = {}
 
+# users/stats fayldan yuklanib, erta yozuvlar bilan birlashtirilgach set bo‘ladi
+STATE_READY = asyncio.Event()
+
+async def wait_state_ready(timeout: float = STATE_READY_TIMEOUT) -> bool:
+    if STATE_READY.is_set():
+        return True
+    try:
+        await asyncio.wait_for(STATE_READY.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
 def load_json(path: str, default):
     try:
         if os.path.exists(path):
@@ -220,18 +754,106 @@ def load_json(path: str, default):
         pass
     return default
 
-def save_json(path: str, data):
+@traced("storage")
+def save_json(path: str, data) -> bool:
+    # vaqtinchalik faylga yozib os.replace: kill/OOM yozish o‘rtasida bo‘lsa ham eski fayl butun qoladi
+    tmp = None
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                   dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return True
     except Exception:
-        pass
+        if tmp:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        return False
+
+class TopK:
+    # counter’lar faqat o‘sadi: top’dan tashqaridagi user faqat min’dan oshganda kiradi
+    def __init__(self, k: int):
+        self.k = k
+        self.index: Dict[str, int] = {}
+        self.heap: List[Tuple[int, str]] = []
+
+    def _min(self) -> Optional[Tuple[int, str]]:
+        while self.heap:
+            value, key = self.heap[0]
+            if self.index.get(key) == value:
+                return (value, key)
+            heapq.heappop(self.heap)   # eskirgan yozuv
+        return None
+
+    def update(self, key: str, value: int):
+        if key in self.index:
+            self.index[key] = value
+            heapq.heappush(self.heap, (value, key))
+            if len(self.heap) > 4 * self.k + 16:
+                self.heap = [(v, k) for k, v in self.index.items()]
+                heapq.heapify(self.heap)
+            return
+
+        if len(self.index) >= self.k:
+            low = self._min()
+            if low is None or value <= low[0]:
+                return
+            heapq.heappop(self.heap)
+            del self.index[low[1]]
+
+        self.index[key] = value
+        heapq.heappush(self.heap, (value, key))
+
+    def clear(self):
+        self.index.clear()
+        self.heap.clear()
+
+    def items(self) -> List[Tuple[str, int]]:
+        return sorted(self.index.items(), key=lambda kv: kv[1], reverse=True)
+
+
+# ✅ /admin uchun tayyor yig‘indilar (inc_stat’da yangilanadi)
+STATS_TOTALS: Dict[str, int] = {}
+USER_TOTALS: Dict[str, int] = {}
+TOP_USERS = TopK(TOP_K_SIZE)
+
+def _rebuild_aggregates():
+    STATS_TOTALS.clear()
+    USER_TOTALS.clear()
+    TOP_USERS.clear()
+    for section in STATS_SECTIONS:
+        per_user = stats.get(section)
+        if not isinstance(per_user, dict):
+            continue
+        for uid, v in per_user.items():
+            STATS_TOTALS[section] = STATS_TOTALS.get(section, 0) + int(v)
+            USER_TOTALS[uid] = USER_TOTALS.get(uid, 0) + int(v)
+    for uid, total in USER_TOTALS.items():
+        TOP_USERS.update(uid, total)
 
 def load_stats():
     global stats
-    loaded = load_json(STATS_FILE, stats)
-    if isinstance(loaded, dict):
-        stats = loaded
+    loaded = load_json(STATS_FILE, None)
+    if loaded is None and os.path.exists(STATS_FILE):
+        raise ValueError(f"{STATS_FILE} o‘qilmadi")
+    with _stats_lock:
+        if isinstance(loaded, dict):
+            # fon yuklash paytida kelgan inc_stat’lar yo‘qolmasin
+            for section, per_user in stats.items():
+                if not isinstance(per_user, dict):
+                    continue
+                dst = loaded.get(section)
+                if not isinstance(dst, dict):
+                    dst = loaded[section] = {}
+                for uid, v in per_user.items():
+                    dst[uid] = int(dst.get(uid, 0)) + int(v)
+            stats = loaded
+        _rebuild_aggregates()
 
 def mark_stats_dirty():
     global stats_dirty
@@ -240,21 +862,43 @@ def mark_stats_dirty():
 def inc_stat(section: str, user_id: int, amount: int = 1):
     global stats
     uid = str(user_id)
+    amount = int(amount)
     with _stats_lock:
         if section not in stats or not isinstance(stats.get(section), dict):
             stats[section] = {}
-        stats[section][uid] = int(stats[section].get(uid, 0)) + int(amount)
+        stats[section][uid] = int(stats[section].get(uid, 0)) + amount
         mark_stats_dirty()
 
-async def autosave_stats_job():
+        if section not in STATS_SECTIONS:
+            return
+        STATS_TOTALS[section] = STATS_TOTALS.get(section, 0) + amount
+        USER_TOTALS[uid] = USER_TOTALS.get(uid, 0) + amount
+        if amount >= 0:
+            TOP_USERS.update(uid, USER_TOTALS[uid])
+        else:
+            _rebuild_aggregates()
+
+_stats_save_lock = Lock()
+
+def save_stats():
+    # snapshot lock ostida, yozish lock’siz (executor’da) — save’lar ketma-ket, eski snapshot yangisini bosmaydi
     global stats_dirty
+    with _stats_save_lock:
+        with _stats_lock:
+            if not stats_dirty:
+                return
+            snapshot = {sec: dict(v) if isinstance(v, dict) else v for sec, v in stats.items()}
+            stats_dirty = False
+        if not save_json(STATS_FILE, snapshot):
+            mark_stats_dirty()
+
+async def autosave_stats_job():
     while True:
         await asyncio.sleep(STATS_AUTOSAVE_EVERY)
+        if not STATE_READY.is_set():
+            continue   # yarim jadval bilan faylni ustidan yozmaymiz
         try:
-            with _stats_lock:
-                if stats_dirty:
-                    save_json(STATS_FILE, stats)
-                    stats_dirty = False
+            await asyncio.get_running_loop().run_in_executor(None, save_stats)
         except Exception:
             pass
 
@@ -274,60 +918,130 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMINS
 
 
-def load_users():
-    global USERS_DB
-    raw = load_json(USERS_FILE, {})
+USERS_LOAD_CHUNK_CHARS = 1 << 20
+
+def _iter_json_object_chunks(text: str, chunk_chars: int = USERS_LOAD_CHUNK_CHARS) -> Iterator[Dict[str, Any]]:
+    # json.load butun parse davomida GIL’ni ushlab turadi (1M user ~ sekundlar, polling qotadi).
+    # save_json indent=2 yozadi: top-level kalitlar doim "\n  \"" bilan boshlanadi
+    # (string ichida xom \n bo‘lmaydi) — shu joylardan ~1MB bo‘laklarga bo‘lib parse qilamiz.
+    start = text.index("{") + 1
+    end = text.rindex("}")
+    while start < end:
+        cut = text.find('\n  "', min(end, start + chunk_chars), end)
+        if cut < 0:
+            cut = end
+        body = text[start:cut].rstrip().rstrip(",")
+        if body.strip():
+            yield json.loads("{" + body + "}")
+        start = cut
+
+def _user_rec(v: Any) -> Dict[str, Any]:
+    if not isinstance(v, dict):
+        return {"first": 0.0, "last": 0.0, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
+    rec: Dict[str, Any] = {
+        "first": float(v.get("first", 0.0) or 0.0),
+        "last": float(v.get("last", 0.0) or 0.0),
+        "sub_ok": int(v.get("sub_ok", 0) or 0),
+        "sub_first": float(v.get("sub_first", 0.0) or 0.0),
+        "sub_last": float(v.get("sub_last", 0.0) or 0.0),
+    }
+    if v.get("username"):
+        rec["username"] = str(v["username"])
+    if v.get("name"):
+        rec["name"] = str(v["name"])
+    if v.get("blocked"):
+        rec["blocked"] = float(v["blocked"])
+    return rec
+
+def _merge_user_rec(saved: Optional[Dict[str, Any]], live: Dict[str, Any]) -> Dict[str, Any]:
+    # saved — fayldagi, live — yuklash tugaguncha record_activity yozgani
+    if not isinstance(saved, dict):
+        return live
+    out = dict(saved)
+    if live.get("first") and (not out.get("first") or live["first"] < out["first"]):
+        out["first"] = live["first"]
+    out["last"] = max(float(out.get("last", 0.0) or 0.0), float(live.get("last", 0.0) or 0.0))
+    out["sub_last"] = max(float(out.get("sub_last", 0.0) or 0.0), float(live.get("sub_last", 0.0) or 0.0))
+    if int(live.get("sub_ok", 0) or 0) == 1 and int(out.get("sub_ok", 0) or 0) != 1:
+        out["sub_ok"] = 1
+        out["sub_first"] = live.get("sub_first", 0.0)
+    if live.get("username") or live.get("name"):
+        out["username"] = live.get("username", "")
+        out["name"] = live.get("name", "")
+    if live.get("blocked"):
+        out["blocked"] = live["blocked"]
+    elif out.get("blocked") and out["last"] > float(out["blocked"]):
+        out.pop("blocked")   # bloklagandan keyin yozgan — blokdan chiqargan
+    return out
+
+def _read_users_file(path: str) -> Dict[int, Dict[str, Any]]:
     db: Dict[int, Dict[str, Any]] = {}
-
-    if isinstance(raw, list):
-        for x in raw:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except FileNotFoundError:
+        return db
+    if not text.strip():
+        return db
+
+    if text.lstrip().startswith("["):
+        # eski format: faqat id’lar ro‘yxati
+        raw = load_json(path, [])
+        for x in raw if isinstance(raw, list) else []:
             try:
-                uid = int(x)
-                db[uid] = {"first": 0.0, "last": 0.0, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
+                db[int(x)] = _user_rec(None)
             except Exception:
                 pass
+        return db
 
-    elif isinstance(raw, dict):
-        for k, v in raw.items():
+    # o‘qilmaydigan/buzuq fayl — xato (yarim jadval bilan ishlab, faylni ustidan yozmaslik uchun)
+    for chunk in _iter_json_object_chunks(text):
+        for k, v in chunk.items():
             try:
-                uid = int(k)
-                rec: Dict[str, Any] = {}
-                if isinstance(v, dict):
-                    rec["first"] = float(v.get("first", 0.0) or 0.0)
-                    rec["last"] = float(v.get("last", 0.0) or 0.0)
-                    rec["sub_ok"] = int(v.get("sub_ok", 0) or 0)
-                    rec["sub_first"] = float(v.get("sub_first", 0.0) or 0.0)
-                    rec["sub_last"] = float(v.get("sub_last", 0.0) or 0.0)
-                else:
-                    rec = {"first": 0.0, "last": 0.0, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
-                db[uid] = rec
+                db[int(k)] = _user_rec(v)
             except Exception:
                 pass
+    return db
 
-    USERS_DB = db
+def load_users():
+    global USERS_DB
+    db = _read_users_file(USERS_FILE)
+    with _users_lock:
+        for uid, live in USERS_DB.items():
+            db[uid] = _merge_user_rec(db.get(uid), live)
+        USERS_DB = db
 
 def mark_users_dirty():
     global users_dirty
     users_dirty = True
 
-def register_user(user_id: int):
+def record_activity(user, subscribed: Optional[bool] = None):
+    # ✅ online + register + profil + obuna — bitta lock, bitta dirty
     now = time.time()
+    ONLINE.touch(user.id, now)
+    uname = (getattr(user, "username", None) or "").strip()
+    name = (getattr(user, "first_name", None) or "").strip()
     with _users_lock:
-        if user_id not in USERS_DB:
-            USERS_DB[user_id] = {"first": now, "last": now, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
-            mark_users_dirty()
-        else:
-            rec = USERS_DB.get(user_id) or {}
-            if not isinstance(rec, dict):
-                rec = {"first": now, "last": now, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
-            if not rec.get("first"):
-                rec["first"] = now
-            rec["last"] = now
-            rec.setdefault("sub_ok", 0)
-            rec.setdefault("sub_first", 0.0)
-            rec.setdefault("sub_last", 0.0)
-            USERS_DB[user_id] = rec
-            mark_users_dirty()
+        rec = USERS_DB.get(user.id)
+        if not isinstance(rec, dict):
+            rec = {"first": now, "last": now, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
+            USERS_DB[user.id] = rec
+        if not rec.get("first"):
+            rec["first"] = now
+        rec["last"] = now
+        rec.setdefault("sub_ok", 0)
+        rec.setdefault("sub_first", 0.0)
+        rec.setdefault("sub_last", 0.0)
+        if uname or name:
+            rec["username"] = uname
+            rec["name"] = name
+        rec.pop("blocked", None)
+        if subscribed:
+            if int(rec.get("sub_ok", 0) or 0) != 1:
+                rec["sub_ok"] = 1
+                rec["sub_first"] = now
+            rec["sub_last"] = now
+        mark_users_dirty()
 
 def mark_user_subscribed_ok(user_id: int):
     now = time.time()
@@ -347,19 +1061,60 @@ def mark_user_subscribed_ok(user_id: int):
         USERS_DB[user_id] = rec
         mark_users_dirty()
 
-async def autosave_users_job():
+def mark_user_blocked(user_id: int):
+    # botni bloklagan / o‘chirilgan akkaunt — keyingi broadcast’lar o‘tkazib yuboradi
+    with _users_lock:
+        rec = USERS_DB.get(user_id)
+        if isinstance(rec, dict):
+            rec["blocked"] = time.time()
+            mark_users_dirty()
+
+def cached_profile(user_id: int) -> Optional[Tuple[str, str, float]]:
+    with _users_lock:
+        rec = USERS_DB.get(user_id)
+        if not isinstance(rec, dict) or not (rec.get("username") or rec.get("name")):
+            return None
+        return (rec.get("username", ""), rec.get("name", ""), float(rec.get("last", 0.0) or 0.0))
+
+_users_save_lock = Lock()
+USERS_SNAPSHOT_CHUNK = 50_000
+
+def save_users():
+    # record’lar joyida o‘zgaradi (record_activity) — snapshot’ga nusxasi ketadi.
+    # 1M user’ni bir lock’da nusxalash ~1s — bo‘laklab olamiz; keyingi o‘zgarishlar dirty’ni qayta yoqadi
     global users_dirty
+    with _users_save_lock:
+        with _users_lock:
+            if not users_dirty:
+                return
+            items = list(USERS_DB.items())
+            users_dirty = False
+        snapshot: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(items), USERS_SNAPSHOT_CHUNK):
+            with _users_lock:
+                for uid, rec in items[i:i + USERS_SNAPSHOT_CHUNK]:
+                    snapshot[str(uid)] = dict(rec)
+        if not save_json(USERS_FILE, snapshot):
+            mark_users_dirty()
+
+async def autosave_users_job():
     while True:
         await asyncio.sleep(USERS_AUTOSAVE_EVERY)
+        if not STATE_READY.is_set():
+            continue
         try:
-            with _users_lock:
-                if users_dirty:
-                    payload = {str(uid): rec for uid, rec in USERS_DB.items()}
-                    save_json(USERS_FILE, payload)
-                    users_dirty = False
+            await asyncio.get_running_loop().run_in_executor(None, save_users)
         except Exception:
             pass
 
+def flush_state():
+    # blocking — executor’dan chaqiriladi; yuklanmagan (yarim) jadval bilan faylni ustidan yozmaymiz
+    if not STATE_READY.is_set():
+        return
+    save_stats()
+    save_users()
+    EVENTS.flush()
+
 
 def _count_active_users(days: int) -> int:
     now = time.time()
@@ -391,6 +1146,185 @@ def _total_sub_passed() -> int:
                    if isinstance(rec, dict) and int(rec.get("sub_ok", 0) or 0) == 1)
 
 
+# =========================================================
+# Event log (columnar, memmap): /events uchun
+# =========================================================
+# Har ustun alohida fayl, qator — bitta event (ts, user, kind, score, latency). Fayllar
+# EVENTS_GROW_ROWS bo‘laklarida kattalashadi (sparse), qatorlar soni count.i8 da —
+# u ham memmap: boshqa process (shard) lar yozilgan qatorni darhol ko‘radi, crash’da ham
+# page cache’dagi yozuv yo‘qolmaydi. Har process o‘z partition’iga yozadi (p{shard}),
+# so‘rovlar hamma partition’ni o‘qiydi.
+EVENT_KINDS = ("speaking", "writing", "dict")
+EVENT_COLUMNS = (("ts", "<u4"), ("user", "<i8"), ("kind", "u1"), ("score", "i1"), ("latency_ms", "<u4"))
+
+# numpy ixtiyoriy: yo‘q bo‘lsa event log / /events o‘chadi, broadcast va voice bo‘lish sof Python’da
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+def _np():
+    import numpy   # lazy: faqat event log ochilganda
+    return numpy
+
+class EventStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.path: Optional[str] = None
+        self.cols: Dict[str, Any] = {}
+        self.count_map = None
+        self.count = 0
+        self.capacity = 0
+        self._lock = Lock()
+
+    def open(self, partition: str):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy o‘rnatilmagan — event log o‘chiq")
+        np = _np()
+        with self._lock:
+            if self.count_map is not None:
+                return
+            self.path = os.path.join(self.root, partition)
+            os.makedirs(self.path, exist_ok=True)
+            count_path = os.path.join(self.path, "count.i8")
+            if not os.path.exists(count_path):
+                np.zeros(1, dtype="<i8").tofile(count_path)
+            self.count_map = np.memmap(count_path, dtype="<i8", mode="r+", shape=(1,))
+            self.count = int(self.count_map[0])
+            self._map(max(EVENTS_GROW_ROWS, self.count))
+
+    def _map(self, capacity: int):
+        np = _np()
+        for name, dtype in EVENT_COLUMNS:
+            path = os.path.join(self.path, f"{name}.col")
+            size = capacity * np.dtype(dtype).itemsize
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                with open(path, "ab") as f:
+                    f.truncate(size)
+            self.cols[name] = np.memmap(path, dtype=dtype, mode="r+", shape=(capacity,))
+        self.capacity = capacity
+
+    def append(self, kind: str, user_id: int, score: Optional[int] = None, latency: Optional[float] = None):
+        if self.count_map is None:
+            return   # load_state_job hali ochmagan: numpy import’ni event loop’da qilmaymiz
+        with self._lock:
+            if self.count >= self.capacity:
+                for col in self.cols.values():
+                    col.flush()
+                self._map(self.capacity + EVENTS_GROW_ROWS)
+            i = self.count
+            self.cols["ts"][i] = int(time.time())
+            self.cols["user"][i] = user_id
+            self.cols["kind"][i] = EVENT_KINDS.index(kind)
+            self.cols["score"][i] = -1 if score is None else score
+            self.cols["latency_ms"][i] = 0 if latency is None else min(2**32 - 1, int(latency * 1000))
+            # avval qator, keyin count — o‘quvchi yarim yozilgan qatorni ko‘rmaydi
+            self.count = self.count_map[0] = i + 1
+
+    def flush(self):
+        with self._lock:
+            for col in self.cols.values():
+                col.flush()
+            if self.count_map is not None:
+                self.count_map.flush()
+
+    @staticmethod
+    def scan(root: str, since: int = 0) -> Dict[str, Any]:
+        # hamma partition, faqat ts >= since qatorlar; ustunlar birlashtirilgan (kopiya)
+        np = _np()
+        parts: Dict[str, List[Any]] = {name: [] for name, _dtype in EVENT_COLUMNS}
+        for path in sorted(glob.glob(os.path.join(glob.escape(root), "p*"))):
+            try:
+                n = int(np.fromfile(os.path.join(path, "count.i8"), dtype="<i8", count=1)[0])
+            except Exception:
+                continue
+            if n <= 0:
+                continue
+            ts = np.memmap(os.path.join(path, "ts.col"), dtype="<u4", mode="r", shape=(n,))
+            # searchsorted emas: soat orqaga surilsa (NTP) ts monoton bo‘lmay qoladi
+            keep = ts >= since if since else slice(None)
+            for name, dtype in EVENT_COLUMNS:
+                col = ts if name == "ts" else np.memmap(os.path.join(path, f"{name}.col"), dtype=dtype, mode="r", shape=(n,))
+                parts[name].append(col[keep])
+        out = {}
+        for name, dtype in EVENT_COLUMNS:
+            cols = parts[name]
+            out[name] = cols[0] if len(cols) == 1 else np.concatenate(cols) if cols else np.zeros(0, dtype=dtype)
+        return out
+
+
+EVENTS = EventStore(EVENTS_DIR)
+
+def record_event(kind: str, user_id: int, score: Optional[int] = None):
+    # latency — handler trace boshidan (navbat + ish), trace bo‘lmasa 0
+    tr = CURRENT_TRACE.get()
+    latency = time.perf_counter() - tr.started if tr else None
+    try:
+        EVENTS.append(kind, user_id, score, latency)
+    except Exception:
+        pass
+
+# cefr_from_score_20_75 chegaralari: A2 28+, B1 38+, B2 51+, C1 65+, C2 74+
+CEFR_LEVELS = ("A1", "A2", "B1", "B2", "C1", "C2")
+CEFR_CUTS = (28, 38, 51, 65, 74)
+
+def _hist_quantile(hist: Any, q: float) -> float:
+    # butun qiymatlar histogrammasidan (score 0..127) kvantil — sort’siz
+    np = _np()
+    c = np.cumsum(hist)
+    return float(np.searchsorted(c, c[-1] * q)) if c.size and c[-1] else 0.0
+
+def events_report(days: int) -> Dict[str, Any]:
+    # hamma agregatsiya bincount / bitta sort bilan: o‘n millionlab event’da ham sekundlar ichida
+    np = _np()
+    now = int(time.time())
+    since = now - days * 86400
+    ev = EventStore.scan(EVENTS_DIR, since)
+    nk = len(EVENT_KINDS)
+    k = ev["kind"].astype(np.intp)
+    # soat oldinga sakragan paytdagi (kelajakdagi) event’lar oxirgi soatga tushadi
+    offset = np.minimum(ev["ts"].astype(np.intp) - since, days * 86400 - 1)
+
+    counts = np.bincount(k, minlength=nk)
+    hourly = np.bincount(offset // 3600 * nk + k, minlength=days * 24 * nk).reshape(-1, nk)
+    daily = np.bincount(offset // 86400 * nk + k, minlength=days * nk).reshape(-1, nk)[:days]
+
+    # (user, kind) juftliklari: bitta sort, keyin qo‘shni farqlar
+    pairs = np.sort(ev["user"] * nk + k)
+    first = np.ones(pairs.size, dtype=bool)
+    np.not_equal(pairs[1:], pairs[:-1], out=first[1:])
+    users = np.bincount(pairs[first] % nk, minlength=nk)
+
+    score = ev["score"]
+    valid = score >= 0
+    score_hist = np.bincount(k[valid] * 128 + score[valid], minlength=nk * 128).reshape(nk, 128)
+    bounds = (0,) + CEFR_CUTS + (128,)
+
+    lat = ev["latency_ms"]
+    out: Dict[str, Any] = {"days": days, "total": int(k.size), "kinds": {}}
+    for i, name in enumerate(EVENT_KINDS):
+        n = int(counts[i]) if i < counts.size else 0
+        if not n:
+            continue
+        kl = lat[(k == i) & (lat > 0)]
+        p50, p95 = (np.percentile(kl, [50, 95]) / 1000).tolist() if kl.size else (0.0, 0.0)
+        hist = score_hist[i]
+        by_cefr = {}
+        for lvl, lo, hi in zip(CEFR_LEVELS, bounds, bounds[1:]):
+            part = hist[lo:hi]
+            if part.sum():
+                by_cefr[lvl] = (int(part.sum()), lo + _hist_quantile(part, 0.5))
+        out["kinds"][name] = {
+            "n": n,
+            "users": int(users[i]),
+            "per_hour": n / (days * 24),
+            "peak_hour": int(hourly[:, i].max()),
+            "per_day": daily[:, i].tolist(),
+            "latency_p50": p50,
+            "latency_p95": p95,
+            "score_median": _hist_quantile(hist, 0.5) if hist.sum() else None,
+            "by_cefr": by_cefr,
+        }
+    return out
+
+
 # =========================================================
 # CEFR / IELTS mapping
 # =========================================================
@@ -417,53 +1351,249 @@ def ielts_from_cefr(cefr: str) -> str:
     }.get(cefr, "~3.0–3.5")
 
 
+# =========================================================
+# Local pre-scorer (LLM’siz): darhol taxminiy ball, degenerate javoblar, fallback
+# =========================================================
+_WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+_SENTENCE_SPLIT_RE = re.compile(r"[.!?]+")
+_CONNECTORS = frozenset((
+    "because", "however", "although", "therefore", "which", "while", "whereas", "moreover",
+    "if", "when", "so", "but", "since", "unless", "though", "furthermore",
+))
+
+_SV_BASE_FORM_BEFORE = (
+    "do", "does", "did", "can", "could", "will", "would", "should", "may", "might", "must",
+    "let", "make", "made", "help", "see", "saw", "watch", "hear",
+)
+
+GRAMMAR_SIGNALS = (
+    ("lowercase 'i'", re.compile(r"(?<![\w'])i(?![\w'])")),
+    # "a usual / a user / a utility / a Ukrainian" — u harfi "yu" deb o‘qiladi
+    ("a + vowel (an)", re.compile(r"\ba (?!one|once|eu|uni|u[bfkv]|us[aeiu]|ut[aeiou]|ur[aeiou])[aeiou]\w*", re.I)),
+    ("an + consonant (a)", re.compile(r"\ban (?!h)[b-df-hj-np-tv-z]\w*", re.I)),
+    # "had had", "that that" — to‘g‘ri ingliz tili
+    ("repeated word", re.compile(r"\b(?!(?:had|that)\b)(\w+) \1\b", re.I)),
+    # "Does she like", "Can it go", "Let it go" — so‘roq/infinitiv: fe’l asosiy shaklda bo‘ladi
+    ("S-V agreement", re.compile(
+        # lookbehind’lar faqat "he/she/it + fe’l" topilgan joyda tekshiriladi (har pozitsiyada emas)
+        r"\b(?=(?:he|she|it) (?:do|have|are|were|go|want|like|need)\b)"
+        + "".join(rf"(?<!\b{w} )" for w in _SV_BASE_FORM_BEFORE)
+        + r"(?:he|she|it) (?:do|have|are|were|go|want|like|need)\b"
+        r"|\b(?:i|you|we|they) (?:is|has|does|wants|likes|needs)\b"
+        r"|\b(?:you|we|they) was\b", re.I)),
+    ("double comparative", re.compile(
+        r"\bmore (?:better|worse|easier|bigger|faster|cheaper|harder|smaller|happier|larger|older|younger)\b", re.I)),
+    ("did + past form", re.compile(r"\bdid(?:n't| not)? (?!(?:(?:n|f|s|sp|h|bl|br|proc|succ|exc)e|emb|sh|shr|w)ed\b)\w+ed\b", re.I)),
+)
+
+def text_features(text: str) -> Dict[str, Any]:
+    text = text or ""
+    words = [w.lower() for w in _WORD_RE.findall(text)]
+    n = len(words)
+    sentences = [x.strip() for x in _SENTENCE_SPLIT_RE.split(text) if x.strip()]
+
+    grammar: Dict[str, int] = {}
+    for label, rx in GRAMMAR_SIGNALS:
+        c = len(rx.findall(text))
+        if c:
+            grammar[label] = c
+    lower_starts = sum(1 for x in sentences if x[0].islower())
+    if lower_starts:
+        grammar["sentence starts lowercase"] = lower_starts
+
+    types = len(set(words))
+    return {
+        "words": n,
+        "types": types,
+        "sentences": len(sentences),
+        "avg_sentence": n / len(sentences) if sentences else float(n),
+        "connectors": sum(1 for w in words if w in _CONNECTORS),
+        "grammar": grammar,
+        "grammar_per_100": 100.0 * sum(grammar.values()) / n if n else 0.0,
+    }
+
+def heuristic_score(f: Dict[str, Any], target_words: int) -> int:
+    # maksimum ~65: LLM’siz C2 bermaymiz
+    n = f["words"]
+    if n < 5:
+        return 20
+    score = 20.0
+    score += 22.0 * min(1.0, n / max(1, target_words))
+    # TTR (types/n) uzun matnda o‘z-o‘zidan tushadi — o‘rniga Guiraud index (types/√n)
+    guiraud = f["types"] / math.sqrt(n)
+    score += max(-4.0, min(10.0, (guiraud - 4.0) * 3.0))
+    if 8 <= f["avg_sentence"] <= 25:
+        score += 5.0
+    score += min(8.0, f["connectors"] * 100.0 / n)
+    score -= min(15.0, f["grammar_per_100"] * 3.0)
+    return clamp_20_75(round(score))
+
+def _grammar_notes(f: Dict[str, Any], limit: int = 6) -> List[str]:
+    hits = sorted(f["grammar"].items(), key=lambda kv: -kv[1])
+    return [f"{label} ×{c}" for label, c in hits[:limit]]
+
+def speaking_prescore(answers: List[str], asked: int) -> Dict[str, Any]:
+    answered = [a.strip() for a in answers if a and a.strip()]
+    f = text_features(" ".join(answered))
+    score = heuristic_score(f, SPEAKING_TARGET_WORDS)
+    coverage = sum(1 for a in answered if len(a.split()) >= 3) / max(1, asked)
+    if coverage < 0.5:
+        score = min(score, 27)
+    return {
+        "score_20_75": score,
+        "features": f,
+        "coverage": coverage,
+        "degenerate": f["words"] < SPEAKING_MIN_WORDS,
+    }
+
+def speaking_heuristic_result(answers: List[str], pre: Dict[str, Any], reason: str) -> Dict[str, Any]:
+    f = pre["features"]
+    joined = " ".join(a.strip() for a in answers if a and a.strip())
+    tips = []
+    if pre["coverage"] < 0.5:
+        tips.append("Ko‘p savollarga javob berilmadi yoki javob juda qisqa.")
+    if f["words"] and f["avg_sentence"] < 6:
+        tips.append("Gaplar juda qisqa — fikrni 2-3 gap bilan kengaytiring.")
+    return {
+        "score_20_75": pre["score_20_75"],
+        "feedback_uz": " ".join([reason] + tips),
+        "corrected_best_version": joined or "—",
+        "avg_relevance": 0.0,
+        "mistakes": _grammar_notes(f) or [f"{f['words']} ta so‘z"],
+    }
+
+def writing_prescore(tasks: List[Dict[str, str]]) -> Dict[str, Any]:
+    per_task = []
+    for no, t in enumerate(tasks[:3], 1):
+        f = text_features((t.get("answer") or "").strip())
+        covered = f["words"] >= WRITING_MIN_WORDS[no - 1]
+        per_task.append({
+            "task_no": no,
+            "score_20_75": heuristic_score(f, WRITING_TARGET_WORDS[no - 1]) if covered else 20,
+            "skipped": not covered,
+            "features": f,
+        })
+    total_words = sum(t["features"]["words"] for t in per_task)
+    return {
+        "score_20_75": _merge_writing_score(per_task),
+        "per_task": per_task,
+        "degenerate": total_words < WRITING_DEGENERATE_WORDS or all(t["skipped"] for t in per_task),
+    }
+
+def writing_heuristic_result(tasks: List[Dict[str, str]], pre: Dict[str, Any], reason: str) -> Dict[str, Any]:
+    joined = "\n\n".join((t.get("answer") or "").strip() for t in tasks if (t.get("answer") or "").strip())
+    per_task = []
+    overall: List[str] = []
+    for t in pre["per_task"]:
+        f = t["features"]
+        notes = _grammar_notes(f, 4)
+        overall.extend(n for n in notes if n not in overall)
+        issues = ["Javob yo‘q yoki juda qisqa."] if t["skipped"] else [
+            f"{f['words']} so‘z (kutilgan ~{WRITING_TARGET_WORDS[t['task_no'] - 1]})",
+        ]
+        per_task.append({"task_no": t["task_no"], "score_20_75": t["score_20_75"],
+                         "issues": issues, "grammar_mistakes": notes})
+    return {
+        "score_20_75": pre["score_20_75"],
+        "feedback_uz": reason,
+        "overall_mistakes": overall[:10],
+        "corrected_best_version": joined.strip() or "—",
+        "per_task": per_task,
+    }
+
+
 # =========================================================
 # Subscription check + cache (STRICT FIX)
 # =========================================================
+# ✅ holat kanalning chat_member update’laridan keladi (bot kanalda admin bo‘lishi kerak);
+# API’ga faqat holat noma’lum bo‘lsa yoki fon tekshiruvida murojaat qilamiz
 _SUB_CACHE: Dict[int, Tuple[bool, float]] = {}
+_SUB_STALE: set = set()
+
+SUB_OK_STATUSES = ("creator", "administrator", "member")
+
+def _is_our_channel(chat) -> bool:
+    if CHANNEL_ID != 0:
+        return chat.id == CHANNEL_ID
+    return (chat.username or "").lower() == CHANNEL_USERNAME.lstrip("@").lower()
 
-async def is_subscribed(user_id: int) -> bool:
+async def check_subscription_live(user_id: int) -> bool:
     if not bot:
         return False
 
-    now = time.time()
-    cached = _SUB_CACHE.get(user_id)
-    if cached and (now - cached[1] <= SUB_CACHE_TTL):
-        return cached[0]
-
     chat_ref = CHANNEL_ID if CHANNEL_ID != 0 else CHANNEL_USERNAME
     try:
         member = await bot.get_chat_member(chat_ref, user_id)
-        ok = member.status in ("creator", "administrator", "member")
+        ok = member.status in SUB_OK_STATUSES
     except Exception:
-        ok = False
+        # tarmoq / flood wait / 5xx — obuna haqida yangi ma’lumot yo‘q: eski yozuv qoladi
+        _SUB_STALE.add(user_id)
+        prev = _SUB_CACHE.get(user_id)
+        if prev is not None:
+            return prev[0]
+        # yozuv yo‘q: SUB_ERROR_TTL’dan keyin eskirgan hisoblanadi va qayta tekshiriladi
+        _SUB_CACHE[user_id] = (False, time.time() - SUB_STATUS_TTL + SUB_ERROR_TTL)
+        return False
 
-    _SUB_CACHE[user_id] = (ok, now)
+    _SUB_CACHE[user_id] = (ok, time.time())
+    _SUB_STALE.discard(user_id)
     return ok
 
-async def require_sub(message: Message, state: Optional[FSMContext] = None) -> bool:
-    uid = message.from_user.id
-    _SUB_CACHE.pop(uid, None)
-
-    if not await is_subscribed(uid):
-        if state:
-            await state.clear()
-        await message.answer(
-            "Botdan foydalanish uchun avval kanalga obuna bo‘ling:\n"
-            f"➡️ {CHANNEL_URL}\n\n"
-            "Obuna bo‘lgach, «Obunani tekshirish» ni bosing.",
-            reply_markup=sub_keyboard()
-        )
+async def is_subscribed(user_id: int, live: bool = False) -> bool:
+    if not bot:
         return False
 
-    mark_user_subscribed_ok(uid)
-    return True
+    cached = _SUB_CACHE.get(user_id)
+    if cached and not live:
+        if time.time() - cached[1] <= SUB_STATUS_TTL:
+            return cached[0]
+        if cached[0]:
+            _SUB_STALE.add(user_id)   # eskirgan "ha": fon job qayta tekshiradi
+            return True
+        # eskirgan "yo‘q" bilan user’ni to‘sib qo‘ymaymiz — hozir tekshiramiz
+
+    return await check_subscription_live(user_id)
+
+@dp.chat_member()
+async def on_channel_member(event: ChatMemberUpdated):
+    if not _is_our_channel(event.chat):
+        return
+    member = event.new_chat_member
+    _SUB_CACHE[member.user.id] = (member.status in SUB_OK_STATUSES, time.time())
+    _SUB_STALE.discard(member.user.id)
+
+async def sub_recheck_job():
+    while True:
+        await asyncio.sleep(SUB_RECHECK_EVERY)
+        try:
+            now = time.time()
+            for uid, (_ok, ts) in list(_SUB_CACHE.items()):
+                if now - ts > 2 * SUB_STATUS_TTL and uid not in _SUB_STALE:
+                    _SUB_CACHE.pop(uid, None)
+
+            # xato bo‘lganlar qayta _SUB_STALE’ga tushadi — keyingi aylanishda
+            batch = list(_SUB_STALE)
+            _SUB_STALE.clear()
+            for uid in batch:
+                await check_subscription_live(uid)
+                await asyncio.sleep(1.0 / SUB_RECHECK_RATE)
+        except Exception:
+            pass
+
+async def ask_to_subscribe(message: Message, state: Optional[FSMContext] = None):
+    if state:
+        await state.clear()
+    await message.answer(
+        "Botdan foydalanish uchun avval kanalga obuna bo‘ling:\n"
+        f"➡️ {CHANNEL_URL}\n\n"
+        "Obuna bo‘lgach, «Obunani tekshirish» ni bosing.",
+        reply_markup=sub_keyboard()
+    )
 
 @dp.callback_query(F.data == "check_sub")
 async def cb_check_sub(call: CallbackQuery, state: FSMContext):
     uid = call.from_user.id
-    _SUB_CACHE.pop(uid, None)
-    if await is_subscribed(uid):
+    if await is_subscribed(uid, live=True):
         mark_user_subscribed_ok(uid)
         await call.message.answer("✅ Obuna tasdiqlandi. Menu:", reply_markup=main_menu())
     else:
@@ -472,41 +1602,318 @@ async def cb_check_sub(call: CallbackQuery, state: FSMContext):
 
 
 # =========================================================
-# ✅ GLOBAL SUB GUARD — /start ni “yemaydi” (SkipHandler)
+# ✅ Per-user actor: bitta user’ning update’lari navbat bilan,
+# turli userlar parallel (USER_ACTOR_WORKERS gacha)
 # =========================================================
-@dp.message()
-async def _global_subscription_guard(message: Message, state: FSMContext):
-    try:
-        touch_user(message.from_user.id)
-        register_user(message.from_user.id)
-    except Exception:
-        pass
+class ActorQueueFull(Exception):
+    pass
 
-    txt = (message.text or "")
 
-    # ✅ /start va admin buyruqlarni keyingi handlerlarga o'tkazamiz
-# /start va admin buyruqlarini o‘tkazib yuboramiz
-    if txt.startswith(("/start", "/admin", "/all", "/online", "/sub")):
-        return
+class _UserActor:
+    __slots__ = ("queue", "task")
 
-# Orqaga bosilsa ham o‘tkazamiz
-    if txt == "⬅️ Orqaga":
-        return
-# Qolgan hamma narsa obuna talab qiladi
-    if not await require_sub(message, state):
-        return
+    def __init__(self):
+        self.queue: deque = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class UserActors:
+    def __init__(self):
+        self.actors: Dict[int, _UserActor] = {}
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.running = 0
+        self.stats = {"done": 0, "rejected": 0}
+
+    def __len__(self) -> int:
+        return len(self.actors)
+
+    def pending(self) -> int:
+        return sum(len(a.queue) for a in self.actors.values()) + self.running
+
+    async def run(self, user_id: int, fn, force: bool = False):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(USER_ACTOR_WORKERS)
+
+        actor = self.actors.get(user_id)
+        if actor is None:
+            actor = self.actors[user_id] = _UserActor()
+        if not force and len(actor.queue) >= USER_QUEUE_MAX:
+            self.stats["rejected"] += 1
+            raise ActorQueueFull()
+
+        fut = asyncio.get_running_loop().create_future()
+        actor.queue.append((fn, fut))
+        if actor.task is None or actor.task.done():
+            actor.task = asyncio.create_task(self._drain(user_id, actor))
+        return await fut
+
+    async def _drain(self, user_id: int, actor: _UserActor):
+        try:
+            while actor.queue:
+                fn, fut = actor.queue.popleft()
+                if fut.done():
+                    continue
+                async with self.slots:
+                    self.running += 1
+                    try:
+                        res = await fn()
+                        if not fut.done():
+                            fut.set_result(res)
+                    except asyncio.CancelledError:
+                        if not fut.done():
+                            fut.cancel()
+                        raise
+                    except Exception as e:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    finally:
+                        self.running -= 1
+                        self.stats["done"] += 1
+        finally:
+            if self.actors.get(user_id) is actor and not actor.queue:
+                self.actors.pop(user_id, None)
+
+
+USER_ACTORS = UserActors()
+
+
+class UserActorMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        data["actor_enqueued"] = time.monotonic()
+        try:
+            return await USER_ACTORS.run(user.id, lambda: handler(event, data))
+        except ActorQueueFull:
+            try:
+                await event.answer("⏳ Oldingi so‘rovlaringiz bajarilmoqda. Biroz kuting.")
+            except Exception:
+                pass
+            return None
+        except ExecutorBusy:
+            try:
+                await event.answer("⏳ Server hozir band. Birozdan keyin qayta urinib ko‘ring.")
+            except Exception:
+                pass
+            return None
+
+
+dp.message.outer_middleware(UserActorMiddleware())
+dp.callback_query.outer_middleware(UserActorMiddleware())
+
+
+# =========================================================
+# ✅ UPDATE GATE — har update uchun BIR marta: activity + register + obuna
+# =========================================================
+class UpdateGateMiddleware(BaseMiddleware):
+    def __init__(self, gate: bool = True):
+        self.gate = gate
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        txt = (getattr(event, "text", None) or "") if self.gate else ""
+        # admin buyruqlari va «Orqaga» obunasiz ham o‘tadi
+        need_sub = self.gate and not txt.startswith(GATE_EXEMPT_COMMANDS) and txt != "⬅️ Orqaga"
+
+        sub_ok = await is_subscribed(user.id) if need_sub else None
+        try:
+            record_activity(user, subscribed=sub_ok)
+        except Exception:
+            pass
+
+        if need_sub and not sub_ok:
+            await ask_to_subscribe(event, data.get("state"))
+            return None
+
+        return await handler(event, data)
+
+
+dp.message.outer_middleware(UpdateGateMiddleware())
+dp.callback_query.outer_middleware(UpdateGateMiddleware(gate=False))
+
+
+class TraceMiddleware(BaseMiddleware):
+    # inner middleware: handler aniqlangan, actor ichida ishlaydi
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        callback = getattr(data.get("handler"), "callback", None)
+        user = data.get("event_from_user")
+        with TRACER.trace(getattr(callback, "__name__", "handler"), user.id if user else 0):
+            enqueued = data.get("actor_enqueued")
+            if enqueued:
+                TRACER.record("queue", time.monotonic() - enqueued)   # actor navbati + gate
+            return await handler(event, data)
+
+
+dp.message.middleware(TraceMiddleware())
+dp.callback_query.middleware(TraceMiddleware())
+
+
+# =========================================================
+# Blocking ishlar: har workload uchun alohida pool (Groq / lookup / audio)
+# =========================================================
+class ExecutorBusy(Exception):
+    pass
+
+
+class WorkloadExecutor:
+    def __init__(self, name: str, threads: int, queue_max: int):
+        self.name = name
+        self.threads = max(1, int(threads))
+        self.queue_max = max(0, int(queue_max))
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f"{name}-")
+        self._lock = Lock()
+        self.active = 0
+        self.queued = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.waits: deque = deque(maxlen=512)
+
+    async def run(self, fn, *args):
+        # navbat haqiqatan chegaralangan: threads ishlaydi, queue_max kutadi, qolgani darhol rad (ExecutorBusy)
+        t0 = time.monotonic()
+        dequeued = [False]   # queued’dan kim birinchi chiqarsa (_call yoki cancel) — o‘sha
+        with self._lock:
+            if self.queued >= self.queue_max + max(0, self.threads - self.active):
+                self.rejected += 1
+                raise ExecutorBusy(self.name)
+            self.queued += 1
+        try:
+            ctx = contextvars.copy_context()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, self._call, t0, ctx, dequeued, fn, args)
+        finally:
+            # pool navbatida cancel bo‘lsa _call hech qachon ishlamaydi
+            self._dequeue(dequeued)
+
+    def _dequeue(self, dequeued: List[bool]):
+        with self._lock:
+            if not dequeued[0]:
+                dequeued[0] = True
+                self.queued -= 1
+
+    def _call(self, t0: float, ctx, dequeued: List[bool], fn, args):
+        self._dequeue(dequeued)
+        with self._lock:
+            self.active += 1
+            self.submitted += 1
+            self.waits.append(time.monotonic() - t0)
+        try:
+            return ctx.run(fn, *args)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self.waits)
+            return {
+                "threads": self.threads,
+                "active": self.active,
+                "queued": self.queued,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+
+
+EXECUTORS: Dict[str, WorkloadExecutor] = {
+    "groq": WorkloadExecutor("groq", EXEC_GROQ_THREADS, EXEC_QUEUE_MAX),      # STT + chat (60s timeout)
+    "lookup": WorkloadExecutor("lookup", EXEC_LOOKUP_THREADS, EXEC_QUEUE_MAX),  # translate, dictionary, TTS
+    "audio": WorkloadExecutor("audio", EXEC_AUDIO_THREADS, EXEC_QUEUE_MAX),    # pydub
+    "analytics": WorkloadExecutor("analytics", EXEC_ANALYTICS_THREADS, EXEC_QUEUE_MAX),  # numpy: /events, broadcast snapshot
+}
+
+async def run_blocking(kind: str, fn, *args):
+    return await EXECUTORS[kind].run(fn, *args)
+
+async def groq_chat_json(system: str, payload: Dict[str, Any], purpose: str = "default") -> Optional[Dict[str, Any]]:
+    # groq pool to‘la — Groq ishlamagandek: chaqiruvchi lokal (heuristic) fallback’ga o‘tadi
+    try:
+        return await run_blocking("groq", groq_chat_json_sync, system, payload, purpose)
+    except ExecutorBusy:
+        return None
 
 
 # =========================================================
 # Audio + Groq
 # =========================================================
-def convert_ogg_to_wav_sync(ogg_path: str, wav_path: str) -> None:
-    audio = AudioSegment.from_file(ogg_path)
-    audio.export(wav_path, format="wav")
+def _audio_segment():
+    from pydub import AudioSegment   # lazy: pydub (+ ffmpeg qidirish) faqat birinchi audio’da
+    return AudioSegment
+
+def voice_cut_points(audio: Any) -> List[int]:
+    # har ~VOICE_CHUNK_SECONDS’da, ±VOICE_CUT_WINDOW ichidagi eng jim joydan kesamiz (so‘z o‘rtasidan emas)
+    if not NUMPY_AVAILABLE:
+        return _voice_cut_points_py(audio)
+    np = _np()
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float32)
+    frame = max(1, audio.frame_rate * VOICE_FRAME_MS // 1000)
+    n = len(samples) // frame
+    if n == 0:
+        return []
+    energy = np.sqrt((samples[:n * frame].reshape(n, frame) ** 2).mean(axis=1))
+    k = max(1, VOICE_PAUSE_MS // VOICE_FRAME_MS)
+    smooth = np.convolve(energy, np.ones(k) / k, mode="same")
+
+    target, window = VOICE_CHUNK_SECONDS * 1000, VOICE_CUT_WINDOW * 1000
+    total = n * VOICE_FRAME_MS
+    cuts: List[int] = []
+    pos = 0
+    while total - pos > target + window:   # oxirgi bo‘lak juda qisqa qolmasin
+        lo = (pos + target - window) // VOICE_FRAME_MS
+        hi = (pos + target + window) // VOICE_FRAME_MS
+        pos = (lo + int(np.argmin(smooth[lo:hi]))) * VOICE_FRAME_MS + VOICE_FRAME_MS // 2
+        cuts.append(pos)
+    return cuts
+
+def _voice_cut_points_py(audio: Any) -> List[int]:
+    # numpy’siz: faqat kesish oynalarida, har frame markazidagi VOICE_PAUSE_MS bo‘lakning rms’i (pydub)
+    total = len(audio) // VOICE_FRAME_MS * VOICE_FRAME_MS
+    target, window = VOICE_CHUNK_SECONDS * 1000, VOICE_CUT_WINDOW * 1000
+    half = VOICE_PAUSE_MS // 2
+    cuts: List[int] = []
+    pos = 0
+    while total - pos > target + window:
+        lo = (pos + target - window) // VOICE_FRAME_MS * VOICE_FRAME_MS
+        hi = (pos + target + window) // VOICE_FRAME_MS * VOICE_FRAME_MS
+        pos = min(
+            (t + VOICE_FRAME_MS // 2 for t in range(lo, hi, VOICE_FRAME_MS)),
+            key=lambda c: audio[max(0, c - half):c + half].rms,
+        )
+        cuts.append(pos)
+    return cuts
+
+@traced("transcode")
+def convert_voice_to_wav_chunks_sync(ogg_path: str, split: bool) -> List[str]:
+    # whisper ichida baribir 16kHz mono — shu formatda yuboramiz (upload ~3x kichik)
+    audio = _audio_segment().from_file(ogg_path).set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    cuts = voice_cut_points(audio) if split else []
+    paths: List[str] = []
+    try:
+        for a, b in zip([0] + cuts, cuts + [len(audio)]):
+            fd, path = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+            paths.append(path)
+            audio[a:b].export(path, format="wav")
+    except Exception:
+        for path in paths:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+        raise
+    return paths
 
 def groq_headers() -> Dict[str, str]:
     return {"Authorization": f"Bearer {GROQ_API_KEY}"}
 
+@traced("stt")
 def groq_stt_whisper_sync(wav_path: str) -> str:
     if not GROQ_API_KEY:
         return ""
@@ -523,52 +1930,402 @@ def groq_stt_whisper_sync(wav_path: str) -> str:
     except Exception:
         return ""
 
-def groq_chat_json_sync(system: str, user_json: Dict) -> Optional[Dict]:
+_stt_tat = 0.0
+
+async def _stt_rate_wait():
+    # Groq audio limiti: o‘rtacha GROQ_STT_RATE so‘rov/sek, GROQ_STT_BURST tagacha birdan (GCRA)
+    global _stt_tat
+    now = time.monotonic()
+    tat = max(_stt_tat, now)
+    wait = tat - now - (GROQ_STT_BURST - 1) / GROQ_STT_RATE
+    _stt_tat = tat + 1.0 / GROQ_STT_RATE
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+async def transcribe_wav_chunks(paths: List[str]) -> str:
+    # bo‘laklar parallel, matn tartib bo‘yicha yig‘iladi; bo‘lingan voice’da bo‘sh bo‘lak bir marta qayta so‘raladi
+    sem = asyncio.Semaphore(STT_CHUNK_CONCURRENCY)
+
+    async def one(path: str) -> str:
+        async with sem:
+            for _ in range(2 if len(paths) > 1 else 1):
+                await _stt_rate_wait()
+                text = await run_blocking("groq", groq_stt_whisper_sync, path)
+                if text:
+                    return text
+            return ""
+
+    parts = await asyncio.gather(*(one(p) for p in paths))
+    return " ".join(p for p in parts if p)
+
+class IncrementalJSONObject:
+    # stream’dan kelayotgan {"k": v, ...}: tugagan top-level field’lar va
+    # top-level massivlarning tugagan object/array elementlarini darhol qaytaradi
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.stack: List[str] = []
+        self.in_str = False
+        self.esc = False
+        self.str_start = 0
+        self.expect_key = False
+        self.key: Optional[str] = None
+        self.value_start = -1
+        self.item_start = -1
+        self.done = False
+
+    def _end_value(self, end: int, events: List[Tuple[str, str, Any]]):
+        if self.key is not None and self.value_start >= 0:
+            try:
+                events.append(("field", self.key, json.loads(self.text[self.value_start:end])))
+            except Exception:
+                pass
+        self.key = None
+        self.value_start = -1
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        self.text += chunk
+        text = self.text
+        events: List[Tuple[str, str, Any]] = []
+        i = self.pos
+        while i < len(text) and not self.done:
+            ch = text[i]
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+                    if len(self.stack) == 1 and self.expect_key:
+                        try:
+                            self.key = json.loads(text[self.str_start:i + 1])
+                        except Exception:
+                            self.key = None
+                        self.expect_key = False
+            elif not self.stack:
+                if ch == "{":   # ```json kabi preambula tashlab yuboriladi
+                    self.stack.append(ch)
+                    self.expect_key = True
+            elif ch == '"':
+                if len(self.stack) == 1 and self.value_start >= 0 and text[self.value_start:i].strip():
+                    # qiymatdan keyin vergulsiz kalit: oldingi qiymat tugagan (aks holda kalitga tushib qoladi)
+                    self._end_value(i, events)
+                    self.expect_key = True
+                self.in_str = True
+                self.str_start = i
+            elif ch in "{[":
+                self.stack.append(ch)
+                if len(self.stack) == 3 and self.stack[1] == "[":
+                    self.item_start = i
+            elif ch in "}]":
+                depth = len(self.stack)
+                if depth == 3 and self.stack[1] == "[" and self.item_start >= 0:
+                    try:
+                        events.append(("item", self.key, json.loads(text[self.item_start:i + 1])))
+                    except Exception:
+                        pass
+                    self.item_start = -1
+                elif depth == 1:
+                    self._end_value(i, events)
+                    self.done = True
+                self.stack.pop()
+            elif len(self.stack) == 1:
+                if ch == ":":
+                    self.value_start = i + 1
+                elif ch == ",":
+                    self._end_value(i, events)
+                    self.expect_key = True
+            i += 1
+        self.pos = i
+        return events
+
+    def pending_value(self) -> Optional[Tuple[str, Any]]:
+        # oxirgi field qiymati to‘liq, lekin ortidan "," yoki "}" kelmagan (kesilgan javob)
+        if self.done or len(self.stack) != 1 or self.in_str or self.key is None or self.value_start < 0:
+            return None
+        raw = self.text[self.value_start:].strip()
+        if not raw:
+            return None
+        try:
+            return (self.key, json.loads(raw))
+        except Exception:
+            return None
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+def parse_model_json(content: str) -> Tuple[Optional[Dict], bool]:
+    # -> (object, repaired). 1) birinchi "{" dan raw_decode (ortidagi matn/"}" e’tiborsiz)
+    # 2) kesilgan/buzilgan: tugagan field’lar + kesilgan massivning tugagan elementlari
+    text = content or ""
+    start = text.find("{")
+    if start < 0:
+        return None, False
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(text, start)
+        if isinstance(obj, dict):
+            return obj, False
+    except ValueError:
+        pass
+
+    parser = IncrementalJSONObject()
+    obj: Dict[str, Any] = {}
+    items: Dict[str, List[Any]] = {}
+    for kind, key, value in parser.feed(text[start:]):
+        if kind == "field":
+            obj[key] = value
+        elif key is not None:
+            items.setdefault(key, []).append(value)
+    tail = parser.pending_value()
+    if tail is not None:
+        obj.setdefault(tail[0], tail[1])
+    for key, values in items.items():
+        obj.setdefault(key, values)
+    return (obj, True) if obj else (None, False)
+
+def _extract_json_object(content: str) -> Optional[Dict]:
+    return parse_model_json(content)[0]
+
+# har evaluator javobi: field turi va majburiy field’lar
+JSON_SCHEMAS: Dict[str, Tuple[Dict[str, str], Tuple[str, ...]]] = {
+    "speaking": ({"score_20_75": "number", "feedback_uz": "str", "corrected_best_version": "str",
+                  "per_question": "list"}, ("score_20_75",)),
+    "writing": ({"score_20_75": "number", "feedback_uz": "str", "overall_mistakes": "list",
+                 "per_task": "list", "corrected_best_version": "str"}, ("score_20_75",)),
+    "writing_task": ({"score_20_75": "number", "strengths": "list", "issues": "list",
+                      "grammar_mistakes": "list", "rewrite": "str"}, ("score_20_75",)),
+    "writing_merge": ({"feedback_uz": "str", "overall_mistakes": "list"}, ("feedback_uz",)),
+}
+
+def validate_model_json(obj: Any, purpose: str) -> Optional[Dict]:
+    # noto‘g‘ri turdagi ixtiyoriy field tashlanadi; majburiysi yo‘q/buzuq bo‘lsa -> None
+    if not isinstance(obj, dict):
+        return None
+    spec = JSON_SCHEMAS.get(purpose)
+    if spec is None:
+        return obj
+    fields, required = spec
+    out = dict(obj)
+    for key, kind in fields.items():
+        if key not in out:
+            continue
+        v = out[key]
+        if kind == "number":
+            if isinstance(v, bool):
+                out.pop(key)
+            elif not isinstance(v, (int, float)):
+                try:
+                    out[key] = float(str(v).strip())
+                except Exception:
+                    out.pop(key)
+        elif kind == "str":
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                out[key] = str(v)
+            elif not isinstance(v, str):
+                out.pop(key)
+        elif kind == "list" and not isinstance(v, list):
+            out.pop(key)
+    if any(k not in out for k in required):
+        return None
+    return out
+
+class GroqUsage:
+    # (route, model) bo‘yicha: chaqiruvlar, xatolar, token’lar, vaqt
+    def __init__(self):
+        self._lock = Lock()
+        self.rows: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def _row(self, route: str, model: str) -> Dict[str, float]:
+        row = self.rows.get((route, model))
+        if row is None:
+            row = self.rows[(route, model)] = {
+                "calls": 0, "errors": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                "repaired": 0, "bad_json": 0,
+            }
+        return row
+
+    def count(self, route: str, model: str, key: str):
+        with self._lock:
+            self._row(route, model)[key] += 1
+
+    def record(self, route: str, model: str, seconds: float, usage: Optional[Dict] = None, ok: bool = True):
+        usage = usage or {}
+        with self._lock:
+            row = self._row(route, model)
+            row["calls"] += 1
+            row["errors"] += 0 if ok else 1
+            row["seconds"] += seconds
+            row["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+            row["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self.rows.items()}
+
+
+GROQ_USAGE = GroqUsage()
+
+def groq_route(user_content: str, purpose: str = "default") -> Tuple[str, List[str], int]:
+    # -> (route, model’lar tartibi, max_tokens)
+    in_tokens = len(user_content) // 4 + 1
+    route = GROQ_FORCED_ROUTES.get(purpose) or ("small" if in_tokens <= GROQ_SMALL_INPUT_TOKENS else "large")
+    first = GROQ_FAST_MODELS if route in ("small", "fast") else GROQ_CHAT_MODELS
+    models = list(dict.fromkeys(m for m in first + GROQ_CHAT_MODELS if m))
+
+    base, per_input = GROQ_OUTPUT_BUDGETS.get(purpose, GROQ_OUTPUT_BUDGETS["default"])
+    max_tokens = min(GROQ_MAX_OUTPUT_TOKENS, int(base + per_input * in_tokens))
+    return route, models, max_tokens
+
+_JSON_MODE_UNSUPPORTED: set = set()   # response_format’ni rad etgan model’lar
+
+def _accept_model_json(content: str, purpose: str, route: str, model: str) -> Optional[Dict]:
+    obj, repaired = parse_model_json(content)
+    obj = validate_model_json(obj, purpose)
+    if obj is None:
+        GROQ_USAGE.count(route, model, "bad_json")   # keyingi model’ga o‘tamiz
+    elif repaired:
+        GROQ_USAGE.count(route, model, "repaired")   # qayta so‘rovsiz tuzatildi
+    return obj
+
+def _groq_json_attempt(url: str, system: str, user_content: str, purpose: str,
+                       route: str, model: str, max_tokens: int) -> Tuple[str, Any]:
+    # -> ("ok", obj) | ("retry", None): JSON mode’siz shu model bilan | ("next", xato)
+    json_mode = model not in _JSON_MODE_UNSUPPORTED
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user_content},
+        ],
+        "temperature": 0.1,
+        "max_tokens": max_tokens,
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+
+    t0 = time.perf_counter()
+    try:
+        r = requests.post(
+            url,
+            headers={**groq_headers(), "Content-Type": "application/json"},
+            json=payload,
+            timeout=60
+        )
+        js = r.json() if r.headers.get("content-type", "").startswith("application/json") else {}
+    except Exception as e:
+        GROQ_USAGE.record(route, model, time.perf_counter() - t0, ok=False)
+        return "next", ("EXC", repr(e))
+
+    if r.status_code != 200:
+        GROQ_USAGE.record(route, model, time.perf_counter() - t0, ok=False)
+        err = js.get("error") if isinstance(js.get("error"), dict) else {}
+        if err.get("code") == "json_validate_failed" and err.get("failed_generation"):
+            # JSON mode javobni rad etdi — matn baribir keldi, o‘zimiz tuzatamiz
+            obj = _accept_model_json(err["failed_generation"], purpose, route, model)
+            return ("ok", obj) if obj is not None else ("next", ("BAD_JSON", err["failed_generation"][:250]))
+        if r.status_code == 400 and json_mode and "response_format" in r.text:
+            _JSON_MODE_UNSUPPORTED.add(model)
+            return "retry", None
+        return "next", (r.status_code, r.text[:300])
+
+    GROQ_USAGE.record(route, model, time.perf_counter() - t0, js.get("usage"))
+    try:
+        content = js["choices"][0]["message"]["content"] or ""
+    except Exception:
+        return "next", ("NO_CONTENT", r.text[:250])
+    obj = _accept_model_json(content, purpose, route, model)
+    if obj is None:
+        return "next", ("BAD_JSON", content[:250])
+    return "ok", obj
+
+@traced("llm")
+def groq_chat_json_sync(system: str, user_json: Dict, purpose: str = "default") -> Optional[Dict]:
     if not GROQ_API_KEY:
         return None
 
     url = f"{GROQ_BASE}/chat/completions"
     last_err = None
+    user_content = json.dumps(user_json, ensure_ascii=False)
+    route, models, max_tokens = groq_route(user_content, purpose)
 
-    for model in GROQ_CHAT_MODELS:
-        if not model:
-            continue
+    for model in models:
+        status, res = _groq_json_attempt(url, system, user_content, purpose, route, model, max_tokens)
+        if status == "retry":
+            status, res = _groq_json_attempt(url, system, user_content, purpose, route, model, max_tokens)
+        if status == "ok":
+            return res
+        last_err = res
+
+    print("GROQ CHAT FAILED:", last_err)
+    return None
+
+@traced("llm")
+def groq_chat_stream_sync(system: str, user_json: Dict, on_delta, purpose: str = "default") -> bool:
+    # SSE: har content bo‘lagi on_delta’ga (executor thread’idan) beriladi
+    if not GROQ_API_KEY:
+        return False
+
+    url = f"{GROQ_BASE}/chat/completions"
+    last_err = None
+    user_content = json.dumps(user_json, ensure_ascii=False)
+    route, models, max_tokens = groq_route(user_content, purpose)
 
+    for model in models:
         payload = {
             "model": model,
             "messages": [
                 {"role": "system", "content": system},
-                {"role": "user", "content": json.dumps(user_json, ensure_ascii=False)},
+                {"role": "user", "content": user_content},
             ],
             "temperature": 0.1,
+            "max_tokens": max_tokens,
+            "stream": True,
         }
 
+        got = False
+        usage = None
+        t0 = time.perf_counter()
         try:
-            r = requests.post(
+            with requests.post(
                 url,
                 headers={**groq_headers(), "Content-Type": "application/json"},
                 json=payload,
-                timeout=60
-            )
-
-            if r.status_code != 200:
-                last_err = (r.status_code, r.text[:300])
-                continue
-
-            content = r.json()["choices"][0]["message"]["content"] or ""
-            m = re.search(r"\{.*\}", content, re.S)
-            if not m:
-                last_err = ("NO_JSON", content[:250])
-                continue
-
-            return json.loads(m.group(0))
+                timeout=60,
+                stream=True,
+            ) as r:
+                if r.status_code != 200:
+                    GROQ_USAGE.record(route, model, time.perf_counter() - t0, ok=False)
+                    last_err = (r.status_code, r.text[:300])
+                    continue
+
+                for line in r.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    # usage oxirgi chunk’da: "usage" yoki Groq’da "x_groq.usage"
+                    usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage") or usage
+                    choices = chunk.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        got = True
+                        on_delta(delta)
+            GROQ_USAGE.record(route, model, time.perf_counter() - t0, usage)
+            return True
 
         except Exception as e:
+            GROQ_USAGE.record(route, model, time.perf_counter() - t0, usage, ok=False)
             last_err = ("EXC", repr(e))
+            if got:
+                # yarmi chiqib bo‘lgan — boshqa model bilan qayta boshlash matnni aralashtiradi
+                break
             continue
 
-    print("GROQ CHAT FAILED:", last_err)
-    return None
+    print("GROQ STREAM FAILED:", last_err)
+    return False
 
 
 # =========================================================
@@ -604,42 +2361,36 @@ def _safe_list(x, limit: int = 8) -> List[str]:
         return out
     return []
 
-async def groq_writing_eval(tasks: List[Dict[str, str]]) -> Dict[str, Any]:
-    system = (
-        "You are a VERY STRICT IELTS/CEFR Writing examiner and English teacher.\n"
-        "Evaluate 3 tasks: (1) friend message, (2) manager email, (3) essay.\n"
-        "Score must be realistic. Penalize:\n"
-        "- wrong format (email structure, greeting/closing),\n"
-        "- grammar errors (tense, S-V agreement, articles, prepositions, punctuation),\n"
-        "- weak coherence, repetition, poor vocabulary, off-topic.\n"
-        "Return ONLY valid JSON:\n"
-        "{\n"
-        "  \"score_20_75\": number (20..75),\n"
-        "  \"feedback_uz\": string (Uzbek, practical),\n"
-        "  \"overall_mistakes\": [string,...],\n"
-        "  \"corrected_best_version\": string,\n"
-        "  \"per_task\": [\n"
-        "    {\"task_no\":1|2|3,\"strengths\":[...],\"issues\":[...],\"grammar_mistakes\":[...],\"rewrite\":string}\n"
-        "  ]\n"
-        "}\n"
-        "Rules:\n"
-        "- If any task answer is missing/too short/off-topic, CAP score hard.\n"
-        "- grammar_mistakes must name exact type.\n"
-        "- rewrite must keep original meaning but be natural.\n"
-    )
+WRITING_EVAL_SYSTEM = (
+    "You are a VERY STRICT IELTS/CEFR Writing examiner and English teacher.\n"
+    "Evaluate 3 tasks: (1) friend message, (2) manager email, (3) essay.\n"
+    "Score must be realistic. Penalize:\n"
+    "- wrong format (email structure, greeting/closing),\n"
+    "- grammar errors (tense, S-V agreement, articles, prepositions, punctuation),\n"
+    "- weak coherence, repetition, poor vocabulary, off-topic.\n"
+    "Return ONLY valid JSON, keys in exactly this order:\n"
+    "{\n"
+    "  \"score_20_75\": number (20..75),\n"
+    "  \"feedback_uz\": string (Uzbek, practical),\n"
+    "  \"overall_mistakes\": [string,...],\n"
+    "  \"per_task\": [\n"
+    "    {\"task_no\":1|2|3,\"strengths\":[...],\"issues\":[...],\"grammar_mistakes\":[...],\"rewrite\":string}\n"
+    "  ],\n"
+    "  \"corrected_best_version\": string\n"
+    "}\n"
+    "Rules:\n"
+    "- If any task answer is missing/too short/off-topic, CAP score hard.\n"
+    "- grammar_mistakes must name exact type.\n"
+    "- rewrite must keep original meaning but be natural.\n"
+)
 
-    data = await asyncio.to_thread(groq_chat_json_sync, system, {"tasks": tasks})
-    if not data:
-        joined = "\n\n".join((t.get("answer") or "").strip() for t in tasks if (t.get("answer") or "").strip())
-        joined = joined.strip() or "—"
-        return {
-            "score_20_75": 30,
-            "feedback_uz": "Writing tekshirish xizmati ishlamadi. Keyinroq urinib ko‘ring.",
-            "overall_mistakes": ["Groq ishlamadi (fallback)"],
-            "corrected_best_version": joined,
-            "per_task": []
-        }
+def _writing_fallback(tasks: List[Dict[str, str]]) -> Dict[str, Any]:
+    return writing_heuristic_result(
+        tasks, writing_prescore(tasks),
+        "Writing tekshirish xizmati ishlamadi — avtomatik taxminiy natija. Keyinroq urinib ko‘ring.",
+    )
 
+def _normalize_writing_result(data: Dict[str, Any]) -> Dict[str, Any]:
     try:
         score = clamp_20_75(int(data.get("score_20_75", 30)))
     except Exception:
@@ -653,6 +2404,362 @@ async def groq_writing_eval(tasks: List[Dict[str, str]]) -> Dict[str, Any]:
         "per_task": data.get("per_task") if isinstance(data.get("per_task"), list) else []
     }
 
+async def groq_writing_eval(tasks: List[Dict[str, str]]) -> Dict[str, Any]:
+    data = await groq_chat_json(WRITING_EVAL_SYSTEM, {"tasks": tasks}, "writing")
+    if not data:
+        return _writing_fallback(tasks)
+    return _normalize_writing_result(data)
+
+async def groq_writing_eval_stream(tasks: List[Dict[str, str]], on_event) -> bool:
+    # thread’dagi SSE o‘quvchi -> queue -> parser -> on_event("field"|"item", key, value)
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def work():
+        return groq_chat_stream_sync(
+            WRITING_EVAL_SYSTEM, {"tasks": tasks},
+            lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text),
+            "writing",
+        )
+
+    job = asyncio.ensure_future(run_blocking("groq", work))
+    # work umuman ishlamasa ham (ExecutorBusy / cancel) o‘quvchi osilib qolmasin
+    job.add_done_callback(lambda _: chunks.put_nowait(None))
+    parser = IncrementalJSONObject()
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            for kind, key, value in parser.feed(chunk):
+                await on_event(kind, key, value)
+        return bool(await job)
+    except ExecutorBusy:
+        return False
+    finally:
+        if not job.done():
+            job.cancel()
+
+def _writing_task_text(t: Dict[str, Any]) -> str:
+    try:
+        no = int(t.get("task_no", 0))
+    except Exception:
+        no = 0
+
+    strengths = _safe_list(t.get("strengths"), 3)
+    issues = _safe_list(t.get("issues"), 3)
+    grammar = _safe_list(t.get("grammar_mistakes"), 4)
+    rewrite = str(t.get("rewrite", "")).strip()
+
+    title = f"🧩 Task {no}" if no else "🧩 Task"
+    if t.get("score_20_75") is not None:
+        title += f" ({t['score_20_75']}/75)"
+    lines = [title + ":"]
+    if strengths:
+        lines.append("✅ Kuchli tomonlar: " + "; ".join(strengths))
+    if issues:
+        lines.append("⚠️ Kamchiliklar: " + "; ".join(issues))
+    if grammar:
+        lines.append("❗ Grammar xatolar: " + "; ".join(grammar))
+    if rewrite:
+        lines.append("✍️ Rewrite:\n" + rewrite)
+    return "\n".join(lines)
+
+def writing_result_text(res: Dict[str, Any], pending: bool = False) -> str:
+    # res to‘liq bo‘lmasligi mumkin (stream): faqat kelgan bo‘limlar chiqadi
+    blocks = []
+    if "score_20_75" in res:
+        try:
+            score = clamp_20_75(int(res["score_20_75"]))
+        except Exception:
+            score = 30
+        cefr = cefr_from_score_20_75(score)
+        blocks.append(
+            "📊 Writing natija\n"
+            f"🏷 CEFR: {cefr}\n"
+            f"🎯 IELTS (taxminiy): {ielts_from_cefr(cefr)}\n"
+            f"⭐ Ball: {score}/75"
+        )
+    if "feedback_uz" in res:
+        blocks.append(f"🧠 Izoh (UZ): {str(res['feedback_uz']).strip() or '—'}")
+    if "overall_mistakes" in res:
+        mistakes = _safe_list(res["overall_mistakes"], 10)
+        blocks.append("❗ Umumiy xatolar:\n" + ("\n".join(f"- {m}" for m in mistakes) if mistakes else "—"))
+
+    per_task = [t for t in (res.get("per_task") or [])[:3] if isinstance(t, dict)]
+    blocks.extend(_writing_task_text(t) for t in per_task)
+    if not per_task and not pending:
+        blocks.append("—")
+
+    if "corrected_best_version" in res:
+        corrected = str(res["corrected_best_version"]).strip() or "—"
+        blocks.append(f"✅ To‘g‘rilangan eng yaxshi variant:\n{corrected}")
+    if pending:
+        blocks.append("⏳ Tekshiruv davom etmoqda...")
+    return "\n\n".join(blocks)
+
+def split_message(text: str, limit: int = 4000) -> List[str]:
+    # Telegram 4096 limit: bo‘limlar ("\n\n") bo‘yicha, juda uzun bo‘lim bo‘lsa kesib
+    chunks: List[str] = []
+    cur = ""
+    for block in text.split("\n\n"):
+        while len(block) > limit:
+            if cur:
+                chunks.append(cur)
+                cur = ""
+            chunks.append(block[:limit])
+            block = block[limit:]
+        if cur and len(cur) + 2 + len(block) > limit:
+            chunks.append(cur)
+            cur = block
+        else:
+            cur = f"{cur}\n\n{block}" if cur else block
+    if cur or not chunks:
+        chunks.append(cur)
+    return chunks
+
+
+class ProgressiveMessage:
+    # bitta natija -> 1+ xabar; matn o‘sib borsa edit, lekin `every` sekundda ko‘pi bilan bir marta.
+    # Reply keyboard’li xabarni Telegram edit qilmaydi — reply_markup faqat finish()’da,
+    # endi edit bo‘lmaydigan oxirgi xabarga (yoki alohida xabar bilan) qo‘yiladi.
+    def __init__(self, message: Message, reply_markup=None, every: float = WRITING_EDIT_EVERY):
+        self.message = message
+        self.reply_markup = reply_markup
+        self.every = every
+        self.sent: List[Message] = []
+        self.shown: List[str] = []
+        self.text = ""
+        self.last = 0.0
+        self.lock = asyncio.Lock()
+        self.deferred: Optional[asyncio.Task] = None
+
+    async def update(self, text: str):
+        self.text = text
+        wait = self.last + self.every - time.monotonic()
+        if self.sent and wait > 0:
+            if self.deferred is None or self.deferred.done():
+                self.deferred = asyncio.create_task(self._render_later(wait))
+            return
+        await self._render()
+
+    async def finish(self, text: str):
+        if self.deferred is not None and not self.deferred.done():
+            self.deferred.cancel()
+        self.text = text
+        await self._render(final=True)
+
+    async def _render_later(self, wait: float):
+        await asyncio.sleep(wait)
+        await self._render()
+
+    async def _edit(self, i: int, chunk: str) -> bool:
+        try:
+            await self.sent[i].edit_text(chunk)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                return False
+        except Exception:
+            return False
+        self.shown[i] = chunk
+        return True
+
+    async def _answer(self, chunk: str, markup=None) -> Optional[Message]:
+        try:
+            return await self.message.answer(chunk, reply_markup=markup)
+        except Exception:
+            return None
+
+    async def _render(self, final: bool = False):
+        # xatolar shu yerda qoladi (on_event/stream’ni uzmaydi); shown faqat muvaffaqiyatda yangilanadi
+        async with self.lock:
+            with send_priority(PRIO_RESULT):
+                chunks = split_message(self.text)
+                markup_sent = False
+                for i, chunk in enumerate(chunks):
+                    if i < len(self.sent):
+                        if self.shown[i] == chunk or await self._edit(i, chunk) or not final:
+                            continue
+                        # oxirgi natija yo‘qolmasin: edit bo‘lmasa yangi xabar
+                        msg = await self._answer(chunk)
+                    else:
+                        markup = self.reply_markup if final and i == len(chunks) - 1 else None
+                        msg = await self._answer(chunk, markup)
+                        if msg is None:
+                            break   # tartib buzilmasin — keyingi render qayta urinadi
+                        self.sent.append(msg)
+                        self.shown.append(chunk)
+                        markup_sent = markup is not None
+                if final and self.reply_markup is not None and not markup_sent:
+                    await self._answer("✅ Tekshiruv tugadi.", self.reply_markup)
+            self.last = time.monotonic()
+
+async def writing_eval_progressive(message: Message, tasks: List[Dict[str, str]]) -> Dict[str, Any]:
+    view = ProgressiveMessage(message, reply_markup=main_menu())
+    res: Dict[str, Any] = {}
+    t0 = time.perf_counter()
+
+    async def on_event(kind: str, key: str, value: Any):
+        if kind == "item":
+            if key != "per_task" or not isinstance(value, dict):
+                return
+            res.setdefault("per_task", []).append(value)
+        else:
+            res[key] = value
+        if "score_20_75" not in res:
+            return
+        if not view.sent:
+            TRACER.record("writing_first", time.perf_counter() - t0)
+        await view.update(writing_result_text(res, pending=True))
+
+    await groq_writing_eval_stream(tasks, on_event)
+    if "score_20_75" in res:
+        # stream o‘rtada uzilgan bo‘lsa ham kelgan qismi qoladi
+        res = _normalize_writing_result(res)
+    else:
+        res = await groq_writing_eval(tasks)
+
+    await view.finish(writing_result_text(res))
+    return res
+
+WRITING_TASK_SYSTEM = (
+    "You are a VERY STRICT IELTS/CEFR Writing examiner and English teacher.\n"
+    "Evaluate ONE task of a 3-task writing test.\n"
+    "Score must be realistic. Penalize:\n"
+    "- grammar errors (tense, S-V agreement, articles, prepositions, punctuation),\n"
+    "- weak coherence, repetition, poor vocabulary, off-topic.\n"
+    "Return ONLY valid JSON:\n"
+    "{\"score_20_75\": number (20..75), \"strengths\":[...], \"issues\":[...], "
+    "\"grammar_mistakes\":[...], \"rewrite\": string}\n"
+    "Rules:\n"
+    "- grammar_mistakes must name exact type.\n"
+    "- rewrite must keep original meaning but be natural.\n"
+)
+
+WRITING_TASK_RUBRICS = (
+    "Task: informal message to a friend (~50 words). Check informal tone, clear purpose, "
+    "natural greeting and closing. Do not expect an essay.",
+    "Task: formal email to a manager (~120 words). Check formal register, email structure "
+    "(greeting, purpose, details, request, closing), politeness and clarity of the request.",
+    "Task: opinion essay (~180+ words). Check a clear position, paragraphing, supported arguments, "
+    "coherence and cohesion, range of vocabulary and grammar.",
+)
+
+WRITING_MERGE_SYSTEM = (
+    "You are an English teacher. You get examiner notes for a student's 3 writing tasks.\n"
+    "Write short practical feedback in Uzbek (3-5 sentences) and list the most important overall mistakes.\n"
+    "Return ONLY valid JSON: {\"feedback_uz\": string, \"overall_mistakes\": [string,...]}\n"
+)
+
+async def _writing_eval_task(no: int, task: Dict[str, str]) -> Dict[str, Any]:
+    answer = (task.get("answer") or "").strip()
+    if len(answer.split()) < WRITING_MIN_WORDS[no - 1]:
+        # LLM chaqirmaymiz
+        return {"task_no": no, "score_20_75": 20, "skipped": True,
+                "issues": ["Javob yo‘q yoki juda qisqa — baholanmadi."]}
+
+    system = WRITING_TASK_SYSTEM + WRITING_TASK_RUBRICS[no - 1]
+    data = await groq_chat_json(system, {"prompt": task.get("prompt") or "", "answer": answer}, "writing_task")
+    if not data:
+        return {"task_no": no, "failed": True,
+                "score_20_75": heuristic_score(text_features(answer), WRITING_TARGET_WORDS[no - 1]),
+                "issues": ["Tekshirib bo‘lmadi (xizmat ishlamadi) — taxminiy ball."]}
+
+    try:
+        score = clamp_20_75(int(data.get("score_20_75", 30)))
+    except Exception:
+        score = 30
+    return {
+        "task_no": no,
+        "score_20_75": score,
+        "strengths": _safe_list(data.get("strengths"), 3),
+        "issues": _safe_list(data.get("issues"), 3),
+        "grammar_mistakes": _safe_list(data.get("grammar_mistakes"), 4),
+        "rewrite": str(data.get("rewrite", "")).strip(),
+    }
+
+def _merge_writing_score(per_task: List[Dict[str, Any]]) -> int:
+    total = weight = 0
+    for t in per_task:
+        if t.get("score_20_75") is None:
+            continue
+        w = WRITING_TASK_WEIGHTS[t["task_no"] - 1]
+        total += w * t["score_20_75"]
+        weight += w
+    score = round(total / weight) if weight else 30
+    if any(t.get("skipped") for t in per_task):
+        score = min(score, WRITING_SKIPPED_CAP)
+    return clamp_20_75(score)
+
+async def _writing_merge_feedback(per_task: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # faqat task izohlari (matnlar emas) — kichik model, kichik prompt
+    notes = [
+        {k: t.get(k) for k in ("task_no", "score_20_75", "issues", "grammar_mistakes")}
+        for t in per_task if not t.get("skipped") and not t.get("failed")
+    ]
+    data = await groq_chat_json(WRITING_MERGE_SYSTEM, {"tasks": notes}, "writing_merge") if notes else None
+
+    mistakes = _safe_list(data.get("overall_mistakes"), 10) if data else []
+    if not mistakes:
+        seen = []
+        for t in per_task:
+            for m in t.get("grammar_mistakes") or []:
+                if m not in seen:
+                    seen.append(m)
+        mistakes = seen[:10]
+
+    feedback = str(data.get("feedback_uz", "")).strip() if data else ""
+    if not feedback:
+        parts = []
+        skipped = [str(t["task_no"]) for t in per_task if t.get("skipped")]
+        if skipped:
+            parts.append(f"Task {', '.join(skipped)} javobi yo‘q yoki juda qisqa.")
+        scored = [t for t in per_task if t.get("score_20_75") is not None and not t.get("skipped")]
+        if scored:
+            weak = min(scored, key=lambda t: t["score_20_75"])
+            parts.append(f"Eng zaif joy — Task {weak['task_no']} ({weak['score_20_75']}/75): shu bo‘limga e’tibor bering.")
+        feedback = " ".join(parts) or "—"
+
+    return {"feedback_uz": feedback, "overall_mistakes": mistakes}
+
+async def writing_eval_parallel(message: Message, tasks: List[Dict[str, str]]) -> Dict[str, Any]:
+    # har task alohida so‘rov: umumiy vaqt ≈ eng sekin task; tayyor bo‘lgani darhol chiqadi
+    view = ProgressiveMessage(message, reply_markup=main_menu())
+    res: Dict[str, Any] = {"per_task": []}
+    t0 = time.perf_counter()
+
+    async def one(no: int, task: Dict[str, str]) -> Dict[str, Any]:
+        try:
+            item = await _writing_eval_task(no, task)
+        except Exception:
+            # bitta task xatosi butun natijani "⏳" holatida qoldirmasin
+            answer = (task.get("answer") or "").strip()
+            item = {"task_no": no, "failed": True,
+                    "score_20_75": heuristic_score(text_features(answer), WRITING_TARGET_WORDS[no - 1]),
+                    "issues": ["Tekshirib bo‘lmadi (xizmat ishlamadi) — taxminiy ball."]}
+        res["per_task"].append(item)
+        res["per_task"].sort(key=lambda t: t["task_no"])
+        if not item.get("skipped"):
+            if not view.sent:
+                TRACER.record("writing_first", time.perf_counter() - t0)
+            await view.update(writing_result_text(res, pending=True))
+        return item
+
+    per_task = await asyncio.gather(*(one(i + 1, t) for i, t in enumerate(tasks[:3])))
+
+    evaluated = [t for t in per_task if not t.get("skipped")]
+    if evaluated and all(t.get("failed") for t in evaluated):
+        res = _writing_fallback(tasks)
+    else:
+        res["score_20_75"] = _merge_writing_score(per_task)
+        await view.update(writing_result_text(res, pending=True))
+        try:
+            res.update(await _writing_merge_feedback(per_task))
+        except Exception:
+            res.update({"feedback_uz": "—", "overall_mistakes": []})
+
+    await view.finish(writing_result_text(res))
+    return res
 
 # =========================================================
 # Speaking content
@@ -800,21 +2907,15 @@ async def evaluate_speaking_strict(questions: List[str], answers: List[str]) ->
         "Mistakes must be short but specific (tense, articles, S-V agreement, word choice, cohesion, etc.).\n"
     )
 
-    data = await asyncio.to_thread(groq_chat_json_sync, system, {
+    data = await groq_chat_json(system, {
         "items": [{"question": q, "answer": a} for q, a in zip(questions, answers)]
-    })
+    }, "speaking")
 
     if not data:
-        joined = " ".join(a.strip() for a in answers if a and a.strip())
-        score = 24 if len(joined.split()) < 12 else 35
-        score = clamp_20_75(score)
-        return {
-            "score_20_75": score,
-            "feedback_uz": "Baholash xizmati ishlamadi. Taxminiy natija.",
-            "corrected_best_version": joined or "—",
-            "avg_relevance": 0.0,
-            "mistakes": ["Groq ishlamadi (fallback)"]
-        }
+        return speaking_heuristic_result(
+            answers, speaking_prescore(answers, len(questions)),
+            "Baholash xizmati ishlamadi — avtomatik taxminiy natija.",
+        )
 
     score = clamp_20_75(int(data.get("score_20_75", 20)))
     per_q = data.get("per_question") or []
@@ -844,118 +2945,349 @@ async def evaluate_speaking_strict(questions: List[str], answers: List[str]) ->
 
 
 # =========================================================
-# Speaking timers
+# Speaking session (FSM data: 1 marta o‘qiladi, oxirida faqat o‘zgargan maydonlar yoziladi)
+# =========================================================
+_SPEAKING_FIELDS = (
+    "stage", "idx", "answers", "asked_questions", "questions", "paused",
+    "part12_image", "part2_image", "part3_image", "part3_q_idx",
+    "phase_kind", "phase_end", "current_speak_seconds",
+)
+
+class SpeakingSession:
+    __slots__ = _SPEAKING_FIELDS + ("_changed", "_fresh", "_closed")
+
+    stage: str
+    idx: int
+    answers: List[str]
+    asked_questions: List[str]
+    questions: List[str]
+    paused: bool
+    part12_image: Optional[int]
+    part2_image: Optional[int]
+    part3_image: Optional[int]
+    part3_q_idx: int
+    phase_kind: Optional[str]
+    phase_end: Optional[float]
+    current_speak_seconds: int
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = dict(data or {})
+        set_ = object.__setattr__
+        set_(self, "stage", str(data.pop("stage", None) or "part1"))
+        set_(self, "idx", int(data.pop("idx", 0) or 0))
+        for name in ("answers", "asked_questions", "questions"):
+            v = data.pop(name, None)
+            set_(self, name, list(v) if isinstance(v, list) else [])
+        set_(self, "paused", bool(data.pop("paused", False)))
+        set_(self, "part12_image", data.pop("part12_image", None))
+        set_(self, "part2_image", data.pop("part2_image", None))
+        set_(self, "part3_image", data.pop("part3_image", None))
+        set_(self, "part3_q_idx", int(data.pop("part3_q_idx", 0) or 0))
+        set_(self, "phase_kind", data.pop("phase_kind", None))
+        set_(self, "phase_end", data.pop("phase_end", None))
+        set_(self, "current_speak_seconds", int(data.pop("current_speak_seconds", 30) or 30))
+        set_(self, "_changed", set())
+        set_(self, "_fresh", False)
+        set_(self, "_closed", False)
+
+    def __setattr__(self, name: str, value: Any):
+        if name in _SPEAKING_FIELDS and getattr(self, name) != value:
+            self._changed.add(name)
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    async def load(cls, state: FSMContext) -> "SpeakingSession":
+        with TRACER.span("fsm"):
+            return cls(await state.get_data())
+
+    @classmethod
+    def new(cls) -> "SpeakingSession":
+        sess = cls()
+        sess._changed.update(_SPEAKING_FIELDS)
+        object.__setattr__(sess, "_fresh", True)
+        return sess
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._changed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in _SPEAKING_FIELDS}
+
+    def remember_question(self, q: str):
+        self.asked_questions.append(q)
+        self._changed.add("asked_questions")
+
+    def add_answer(self, text: str):
+        self.answers.append(text)
+        self._changed.add("answers")
+
+    def close(self):
+        # state.clear() dan keyin flush hech narsa yozmaydi
+        object.__setattr__(self, "_closed", True)
+        self._changed.clear()
+
+    async def flush(self, state: FSMContext):
+        if not self._changed or self._closed:
+            return
+        # to‘liq snapshot emas: uzoq await’lar (yuklab olish, STT) davomida
+        # boshqa handler/timer yozgan maydonlarni ustidan yozmaslik uchun
+        changed = {name: getattr(self, name) for name in self._changed}
+        fresh = self._fresh
+        self._changed.clear()
+        object.__setattr__(self, "_fresh", False)
+        with TRACER.span("fsm"):
+            if fresh:
+                # yangi sessiya: oldingi bo‘limdan qolgan data tozalanadi
+                await state.set_data(changed)
+            else:
+                await state.update_data(changed)
+
+
+# =========================================================
+# Speaking timers (bitta scheduler — hierarchical timing wheel)
 # =========================================================
-SPEAKING_TASKS: Dict[int, asyncio.Task] = {}
+class TimingWheel:
+    # 1 tick = 1 sekund; har bir level oldingisidan `slots` marta yiriklashadi
+    def __init__(self, bits: int = 6, levels: int = 3):
+        self.bits = bits
+        self.slots = 1 << bits
+        self.levels = levels
+        self.wheels: List[List[set]] = [[set() for _ in range(self.slots)] for _ in range(levels)]
+        self.overflow: set = set()
+        self.due: Dict[Any, int] = {}
+        self.where: Dict[Any, Tuple[int, int]] = {}
+        self.now_tick = int(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def _place(self, key, due: int):
+        for level in range(self.levels):
+            shift = self.bits * (level + 1)
+            if (due >> shift) == (self.now_tick >> shift):
+                slot = (due >> (self.bits * level)) & (self.slots - 1)
+                self.wheels[level][slot].add(key)
+                self.where[key] = (level, slot)
+                return
+        self.overflow.add(key)
+        self.where[key] = (-1, 0)
+
+    def schedule(self, key, due_tick: int):
+        self.cancel(key)
+        due = max(int(due_tick), self.now_tick + 1)
+        self.due[key] = due
+        self._place(key, due)
+
+    def cancel(self, key):
+        if self.due.pop(key, None) is None:
+            return
+        level, slot = self.where.pop(key)
+        if level < 0:
+            self.overflow.discard(key)
+        else:
+            self.wheels[level][slot].discard(key)
+
+    def _cascade(self, bucket: set):
+        keys = list(bucket)
+        bucket.clear()
+        for key in keys:
+            self._place(key, self.due[key])
+
+    def advance(self, to_tick: int) -> List[Any]:
+        fired: List[Any] = []
+        while self.now_tick < to_tick:
+            self.now_tick += 1
+            t = self.now_tick
+
+            if t & ((1 << (self.bits * self.levels)) - 1) == 0:
+                self._cascade(self.overflow)
+            for level in range(self.levels - 1, 0, -1):
+                if t & ((1 << (self.bits * level)) - 1) == 0:
+                    self._cascade(self.wheels[level][(t >> (self.bits * level)) & (self.slots - 1)])
+
+            bucket = self.wheels[0][t & (self.slots - 1)]
+            for key in list(bucket):
+                if self.due.get(key, t + 1) <= t:
+                    bucket.discard(key)
+                    self.due.pop(key, None)
+                    self.where.pop(key, None)
+                    fired.append(key)
+        return fired
+
+
+class _SpeakingTimer:
+    __slots__ = ("uid", "message", "state", "kind", "end_ts", "msg", "last_shown")
+
+    def __init__(self, message: Message, state: FSMContext, kind: str, end_ts: float):
+        self.uid = message.from_user.id
+        self.message = message
+        self.state = state
+        self.kind = kind
+        self.end_ts = end_ts
+        self.msg: Optional[Message] = None
+        self.last_shown: Optional[int] = None
+
+    @property
+    def label(self) -> str:
+        return "Tayyorlanish" if self.kind == "prep" else "Javob"
+
+
+SPEAKING_WHEEL = TimingWheel()
+SPEAKING_TIMERS: Dict[int, _SpeakingTimer] = {}
+SPEAKING_TASKS: Dict[int, asyncio.Task] = {}   # timer tugagandan keyingi o‘tish (in-flight)
 
 def cancel_task(user_id: int):
-    t = SPEAKING_TASKS.get(user_id)
-    if t and not t.done():
+    SPEAKING_TIMERS.pop(user_id, None)
+    SPEAKING_WHEEL.cancel(user_id)
+    t = SPEAKING_TASKS.pop(user_id, None)
+    if t and not t.done() and t is not asyncio.current_task():
         t.cancel()
-    SPEAKING_TASKS.pop(user_id, None)
 
-def start_timer(message: Message, state: FSMContext, seconds: int, kind: str):
+def _next_timer_mark(remain: int) -> int:
+    # boshida siyrak (10s/5s), oxirgi TIMER_FINE_SECONDS da har sekund
+    if remain <= TIMER_FINE_SECONDS:
+        return remain - 1
+    step = TIMER_MID_EVERY if remain <= TIMER_MID_SECONDS else TIMER_COARSE_EVERY
+    return max(TIMER_FINE_SECONDS, (remain - 1) // step * step)
+
+def _schedule_timer(timer: _SpeakingTimer):
+    remain = math.ceil(timer.end_ts - time.monotonic())
+    mark = _next_timer_mark(remain)
+    SPEAKING_WHEEL.schedule(timer.uid, math.ceil(timer.end_ts - mark))
+
+def start_timer(message: Message, state: FSMContext, seconds: int, kind: str, sess: SpeakingSession):
     uid = message.from_user.id
     cancel_task(uid)
-    SPEAKING_TASKS[uid] = asyncio.create_task(_timer_job(message, state, seconds, kind))
-
-async def _timer_job(message: Message, state: FSMContext, seconds: int, kind: str):
     seconds = max(0, int(seconds))
-    end_ts = time.monotonic() + seconds
-    await state.update_data(phase_kind=kind, phase_end=end_ts)
+    timer = _SpeakingTimer(message, state, kind, time.monotonic() + seconds)
+    SPEAKING_TIMERS[uid] = timer
+    sess.phase_kind = kind
+    sess.phase_end = timer.end_ts
+    _schedule_timer(timer)
+    asyncio.create_task(_timer_open(timer, seconds))
+
+async def _timer_open(timer: _SpeakingTimer, seconds: int):
+    try:
+        timer.msg = await timer.message.answer(f"⏳ {timer.label}: {seconds}s")
+        timer.last_shown = seconds
+    except Exception:
+        pass
 
-    label = "Tayyorlanish" if kind == "prep" else "Javob"
-    timer_msg = await message.answer(f"⏳ {label}: {seconds}s")
-    last_shown = None
+async def _timer_edit(timer: _SpeakingTimer, text: str):
+    # OUTBOUND navbatida shu xabarning eski edit’i bo‘lsa, matni almashtiriladi
+    try:
+        await timer.msg.edit_text(text)
+    except Exception:
+        pass
 
-    while True:
-        if await state.get_state() != SpeakingStates.running.state:
-            return
+def _timer_tick(timer: _SpeakingTimer):
+    remain = math.ceil(timer.end_ts - time.monotonic())
+    if remain <= 0:
+        SPEAKING_TIMERS.pop(timer.uid, None)
+        SPEAKING_TASKS[timer.uid] = asyncio.create_task(_timer_fire_queued(timer))
+        return
 
-        data = await state.get_data()
-        if data.get("paused"):
-            return
-        if data.get("stage") in ("done", "stopped"):
-            return
+    # ✅ edit tushib qolsa ham deadline o‘z vaqtida ishlaydi
+    if timer.msg is not None and timer.last_shown != remain:
+        timer.last_shown = remain
+        asyncio.create_task(_timer_edit(timer, f"⏳ {timer.label}: {remain}s"))
+    _schedule_timer(timer)
 
-        remain = math.ceil(end_ts - time.monotonic())
-        if remain <= 0:
-            break
+async def speaking_scheduler_job():
+    while True:
+        now = time.monotonic()
+        await asyncio.sleep(math.floor(now) + 1 - now)
+        for uid in SPEAKING_WHEEL.advance(int(time.monotonic())):
+            timer = SPEAKING_TIMERS.get(uid)
+            if timer:
+                try:
+                    _timer_tick(timer)
+                except Exception:
+                    pass
 
-        if last_shown != remain:
-            try:
-                await timer_msg.edit_text(f"⏳ {label}: {remain}s")
-            except Exception:
-                pass
-            last_shown = remain
+async def _timer_fire_queued(timer: _SpeakingTimer):
+    # o‘tish ham user’ning actor navbatidan o‘tadi (voice handler bilan aralashmaydi)
+    try:
+        await USER_ACTORS.run(timer.uid, lambda: _timer_fire(timer), force=True)
+    except Exception:
+        pass
+    finally:
+        if SPEAKING_TASKS.get(timer.uid) is asyncio.current_task():
+            SPEAKING_TASKS.pop(timer.uid, None)
+
+async def _timer_fire(timer: _SpeakingTimer):
+    with TRACER.trace(f"timer_{timer.kind}", timer.uid):
+        await _timer_transition(timer)
 
-        await asyncio.sleep(TIMER_EDIT_EVERY)
+async def _timer_transition(timer: _SpeakingTimer):
+    # actor ichida ishlayapti — endi bekor qilinadigan "kutilayotgan" o‘tish emas
+    SPEAKING_TASKS.pop(timer.uid, None)
+    message, state, kind = timer.message, timer.state, timer.kind
 
     if await state.get_state() != SpeakingStates.running.state:
         return
 
-    data = await state.get_data()
-    if data.get("paused") or data.get("stage") in ("done", "stopped"):
+    sess = await SpeakingSession.load(state)
+    if sess.paused or sess.stage in ("done", "stopped"):
         return
 
-    await state.update_data(phase_kind=None, phase_end=None)
+    sess.phase_kind = None
+    sess.phase_end = None
 
     if kind == "prep":
         await message.answer("🎤 Endi JAVOB bering. Voice yuboring.")
-        data2 = await state.get_data()
-        speak_sec = int(data2.get("current_speak_seconds") or 30)
-        start_timer(message, state, speak_sec, "speak")
+        start_timer(message, state, sess.current_speak_seconds or 30, "speak", sess)
     else:
         # ✅ endi bo‘sh javob qo‘shmaymiz (aniqlik uchun)
         await message.answer("⏰ Vaqt tugadi. Keyingisiga o‘tdim.")
-        await speaking_advance(message, state, time_up=True)
+        await speaking_advance(message, state, time_up=True, sess=sess)
+    await sess.flush(state)
 
 
 # =========================================================
 # Speaking engine
 # =========================================================
-async def _remember_question(state: FSMContext, q: str):
-    data = await state.get_data()
-    asked = data.get("asked_questions") or []
-    if not isinstance(asked, list):
-        asked = []
-    asked.append(q)
-    await state.update_data(asked_questions=asked)
-
-async def speaking_advance(message: Message, state: FSMContext, time_up: bool = False):
-    data = await state.get_data()
-    stage = data.get("stage", "part1")
-    idx = int(data.get("idx", 0))
+async def speaking_advance(message: Message, state: FSMContext, time_up: bool = False,
+                           sess: Optional[SpeakingSession] = None):
+    # savollar countdown edit’lardan oldin ketadi
+    own = sess is None
+    if own:
+        sess = await SpeakingSession.load(state)
+    with send_priority(PRIO_QUESTION):
+        await _speaking_advance(message, state, sess, time_up)
+    if own:
+        await sess.flush(state)
+
+async def _speaking_advance(message: Message, state: FSMContext, sess: SpeakingSession, time_up: bool = False):
+    stage = sess.stage
+    idx = sess.idx
 
     if stage in ("done", "stopped"):
         return
 
     if stage == "part1":
-        questions = data.get("questions", [])
-        if not questions:
-            questions = random.sample(SPEAKING_PART1_POOL, k=3)
-            await state.update_data(questions=questions)
+        if not sess.questions:
+            sess.questions = random.sample(SPEAKING_PART1_POOL, k=3)
 
         if idx >= 3:
-            await state.update_data(
-                stage="part12",
-                idx=0,
-                questions=[],
-                part12_image=random.randint(1, 11),
-            )
+            sess.stage = "part12"
+            sess.idx = 0
+            sess.questions = []
+            sess.part12_image = random.randint(1, 11)
             await message.answer("✅ Part 1 tugadi. Endi Part 1.2 (rasm) ...", reply_markup=speaking_menu())
-            return await speaking_advance(message, state)
+            return await _speaking_advance(message, state, sess)
 
-        q = questions[idx]
-        await _remember_question(state, q)
+        q = sess.questions[idx]
+        sess.remember_question(q)
         await message.answer(f"PART 1 — Savol {idx+1}/3:\n{q}", reply_markup=speaking_menu())
-        await state.update_data(current_speak_seconds=30)
-        start_timer(message, state, 10, "prep")
-        await state.update_data(idx=idx + 1)
+        sess.current_speak_seconds = 30
+        start_timer(message, state, 10, "prep", sess)
+        sess.idx = idx + 1
         return
 
     if stage == "part12":
-        img = int(data.get("part12_image", 1))
+        img = int(sess.part12_image or 1)
         qs = PART12_QUESTIONS_BY_IMAGE.get(img, [
             "What can you see in the picture?",
             "What is happening?",
@@ -967,21 +3299,23 @@ async def speaking_advance(message: Message, state: FSMContext, time_up: bool =
             await send_image(message, img, f"🖼 PART 1.2 (image{img})")
 
         if idx >= 3:
-            await state.update_data(stage="part2", idx=0, part2_image=random.randint(12, 25))
+            sess.stage = "part2"
+            sess.idx = 0
+            sess.part2_image = random.randint(12, 25)
             await message.answer("✅ Part 1.2 tugadi. Endi Part 2 (rasm) ...", reply_markup=speaking_menu())
-            return await speaking_advance(message, state)
+            return await _speaking_advance(message, state, sess)
 
         q = qs[idx]
-        await _remember_question(state, q)
+        sess.remember_question(q)
         prep, speak = timings[idx]
         await message.answer(f"PART 1.2 — Savol {idx+1}/3:\n{q}", reply_markup=speaking_menu())
-        await state.update_data(current_speak_seconds=speak)
-        start_timer(message, state, prep, "prep")
-        await state.update_data(idx=idx + 1)
+        sess.current_speak_seconds = speak
+        start_timer(message, state, prep, "prep", sess)
+        sess.idx = idx + 1
         return
 
     if stage == "part2":
-        img = int(data.get("part2_image", 12))
+        img = int(sess.part2_image or 12)
         cue = PART2_CUE_BY_IMAGE.get(img, {
             "title": "Describe the situation shown in the picture.",
             "points": ["What it is", "Why it matters", "Example"]
@@ -992,48 +3326,56 @@ async def speaking_advance(message: Message, state: FSMContext, time_up: bool =
             cue_text = "📌 CUE CARD:\n" + cue["title"] + "\n" + "\n".join(f"- {p}" for p in cue["points"])
             await message.answer(cue_text, reply_markup=speaking_menu())
             # cue card’ni ham “question” sifatida saqlab qo‘yamiz
-            await _remember_question(state, "PART 2 CUE CARD: " + cue["title"])
-            await state.update_data(current_speak_seconds=120)
-            start_timer(message, state, 60, "prep")
-            await state.update_data(idx=1)
+            sess.remember_question("PART 2 CUE CARD: " + cue["title"])
+            sess.current_speak_seconds = 120
+            start_timer(message, state, 60, "prep", sess)
+            sess.idx = 1
             return
 
-        await state.update_data(stage="part3", idx=0, part3_image=random.randint(26, 34), part3_q_idx=0)
+        sess.stage = "part3"
+        sess.idx = 0
+        sess.part3_image = random.randint(26, 34)
+        sess.part3_q_idx = 0
         await message.answer("✅ Part 2 tugadi. Endi Part 3 ...", reply_markup=speaking_menu())
-        return await speaking_advance(message, state)
+        return await _speaking_advance(message, state, sess)
 
     if stage == "part3":
-        img = int(data.get("part3_image", 26))
+        img = int(sess.part3_image or 26)
         topic = PART3_TOPIC_BY_IMAGE.get(img, {"topic": "Discuss the topic", "qs": ["Why?"]})
         qs = topic.get("qs") or ["Why?"]
-        q_idx = int(data.get("part3_q_idx", 0) or 0)
+        q_idx = sess.part3_q_idx
 
         if idx == 0:
             await send_image(message, img, f"🖼 PART 3 (image{img})")
             await message.answer(f"📌 TOPIC: {topic['topic']}", reply_markup=speaking_menu())
-            await state.update_data(idx=1, part3_q_idx=0)
+            sess.idx = 1
+            sess.part3_q_idx = 0
             # davomida savollarni beramiz
-            return await speaking_advance(message, state)
+            return await _speaking_advance(message, state, sess)
 
         # 3 ta savol
         if q_idx < min(3, len(qs)):
             q = qs[q_idx]
-            await _remember_question(state, f"PART 3: {q}")
+            sess.remember_question(f"PART 3: {q}")
             await message.answer(f"PART 3 — Savol {q_idx+1}/3:\n{q}", reply_markup=speaking_menu())
-            await state.update_data(current_speak_seconds=120)
-            start_timer(message, state, 30, "prep")
-            await state.update_data(part3_q_idx=q_idx + 1)
+            sess.current_speak_seconds = 120
+            start_timer(message, state, 30, "prep", sess)
+            sess.part3_q_idx = q_idx + 1
             return
 
-        await state.update_data(stage="done")
-        return await speaking_finish(message, state)
+        sess.stage = "done"
+        return await speaking_finish(message, state, sess)
 
-async def speaking_finish(message: Message, state: FSMContext):
+async def speaking_finish(message: Message, state: FSMContext, sess: Optional[SpeakingSession] = None):
     cancel_task(message.from_user.id)
 
-    data = await state.get_data()
-    answers: List[str] = data.get("answers", []) or []
-    questions: List[str] = data.get("asked_questions", []) or []
+    if sess is None:
+        sess = await SpeakingSession.load(state)
+    # stage=done/stopped baholash davomida ham ko‘rinib tursin
+    await sess.flush(state)
+    sess.close()
+    answers: List[str] = sess.answers
+    questions: List[str] = sess.asked_questions
 
     # ✅ bo‘sh javoblarni filtr
     qa = []
@@ -1050,8 +3392,16 @@ async def speaking_finish(message: Message, state: FSMContext):
     questions2 = [x[0] for x in qa][:20]
     answers2 = [x[1] for x in qa][:20]
 
-    await message.answer("✅ Imtihon tekshirilmoqda...")
-    res = await evaluate_speaking_strict(questions2, answers2)
+    pre = speaking_prescore(answers2, len(questions))
+    if pre["degenerate"]:
+        # 12 so‘zdan kam — LLM’ga yuborishning ma’nosi yo‘q
+        res = speaking_heuristic_result(answers2, pre, "Javoblar juda qisqa — avtomatik baholandi.")
+    else:
+        await message.answer(
+            "✅ Imtihon tekshirilmoqda...\n"
+            f"🔎 Taxminiy: {pre['score_20_75']}/75 ({cefr_from_score_20_75(pre['score_20_75'])})"
+        )
+        res = await evaluate_speaking_strict(questions2, answers2)
 
     score = clamp_20_75(int(res.get("score_20_75", 20)))
     cefr = cefr_from_score_20_75(score)
@@ -1060,18 +3410,20 @@ async def speaking_finish(message: Message, state: FSMContext):
     mistakes = res.get("mistakes") or []
     mistakes_text = "\n".join(f"- {m}" for m in mistakes[:8]) if mistakes else "—"
 
-    await message.answer(
-        "📊 Natija (Speaking):\n"
-        f"🏷 CEFR: {cefr}\n"
-        f"🎯 IELTS (taxminiy): {ielts}\n"
-        f"⭐ Umumiy ball: {score}/75\n\n"
-        f"🧠 Izoh (UZ): {res.get('feedback_uz','—')}\n\n"
-        f"❗ Xatolar (qisqa):\n{mistakes_text}\n\n"
-        f"✅ To‘g‘rilangan eng yaxshi variant:\n{res.get('corrected_best_version','—')}",
-        reply_markup=main_menu()
-    )
+    with send_priority(PRIO_RESULT):
+        await message.answer(
+            "📊 Natija (Speaking):\n"
+            f"🏷 CEFR: {cefr}\n"
+            f"🎯 IELTS (taxminiy): {ielts}\n"
+            f"⭐ Umumiy ball: {score}/75\n\n"
+            f"🧠 Izoh (UZ): {res.get('feedback_uz','—')}\n\n"
+            f"❗ Xatolar (qisqa):\n{mistakes_text}\n\n"
+            f"✅ To‘g‘rilangan eng yaxshi variant:\n{res.get('corrected_best_version','—')}",
+            reply_markup=main_menu()
+        )
 
     inc_stat("exams_completed", message.from_user.id, 1)
+    record_event("speaking", message.from_user.id, score)
     await state.clear()
 
 
@@ -1080,16 +3432,11 @@ async def speaking_finish(message: Message, state: FSMContext):
 # =========================================================
 @dp.message(CommandStart())
 async def start_cmd(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
     await state.clear()
 
     if not bot:
         return await message.answer("❌ BOT_TOKEN qo‘yilmagan. main.py ichida tokenni to‘ldiring.")
 
-    if not await require_sub(message):
-        return
-
     await message.answer(
         "👋 Xush salom kelibsiz!\n\n"
         "🗣 Speaking — CEFR / IELTS simulyatsiya\n"
@@ -1101,16 +3448,13 @@ async def start_cmd(message: Message, state: FSMContext):
 
 @dp.message(Command("sub"))
 async def cmd_sub(message: Message):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
     if message.from_user.id not in ADMINS:
         return await message.answer("⛔ Siz admin emassiz.")
 
-    total = _total_sub_passed()
-    today = _count_sub_passed(1)
-    last7 = _count_sub_passed(7)
-    month = _count_sub_passed(30)
+    summary = await users_summary()
+    if summary is None:
+        return await message.answer("⏳ Ma’lumotlar hali yuklanmoqda, birozdan keyin urinib ko‘ring.")
+    total, today, last7, month = (summary[k] for k in ("sub_total", "sub_today", "sub_last7", "sub_month"))
 
     await message.answer(
         "📌 OBUNA STATISTIKASI (BOT orqali)\n\n"
@@ -1124,9 +3468,6 @@ async def cmd_sub(message: Message):
 
 @dp.message(Command("all"))
 async def cmd_all(message: Message):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
     if message.from_user.id not in ADMINS:
         return await message.answer("⛔ Siz admin emassiz.")
 
@@ -1134,10 +3475,10 @@ async def cmd_all(message: Message):
     parts = text.split()
     arg = parts[1].lower() if len(parts) > 1 else ""
 
-    total = _total_users()
-    today = _count_active_users(1)
-    last7 = _count_active_users(7)
-    month = _count_active_users(30)
+    summary = await users_summary()
+    if summary is None:
+        return await message.answer("⏳ Ma’lumotlar hali yuklanmoqda, birozdan keyin urinib ko‘ring.")
+    total, today, last7, month = (summary[k] for k in ("total", "today", "last7", "month"))
 
     if arg in ("today", "bugun"):
         return await message.answer(f"📅 Bugun aktiv bo‘lganlar: {today}")
@@ -1161,30 +3502,10 @@ async def cmd_all(message: Message):
 
 @dp.message(F.text == "🗣 Speaking")
 async def speaking_start(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
-    if not await require_sub(message, state):
-        return
-
     cancel_task(message.from_user.id)
 
     await state.set_state(SpeakingStates.running)
-    await state.update_data(
-        stage="part1",
-        idx=0,
-        answers=[],
-        asked_questions=[],   # ✅ REAL Qs saved
-        questions=[],
-        paused=False,
-        part12_image=None,
-        part2_image=None,
-        part3_image=None,
-        part3_q_idx=0,
-        phase_kind=None,
-        phase_end=None,
-        current_speak_seconds=30,
-    )
+    sess = SpeakingSession.new()   # ✅ REAL Qs -> sess.asked_questions
 
     await message.answer(
         "🗣 Speaking boshlandi.\n"
@@ -1192,59 +3513,57 @@ async def speaking_start(message: Message, state: FSMContext):
         "🎤 Faqat voice yuboring.",
         reply_markup=speaking_menu()
     )
-    await speaking_advance(message, state)
+    await speaking_advance(message, state, sess=sess)
+    await sess.flush(state)
 
 
 @dp.message(SpeakingStates.running, F.text == "⏸ Pause")
 async def speaking_pause(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
     cancel_task(message.from_user.id)
-    await state.update_data(paused=True)
+    sess = await SpeakingSession.load(state)
+    sess.paused = True
+    await sess.flush(state)
     await message.answer("⏸ Pauza qilindi. ▶️ Resume bosing.")
 
 @dp.message(SpeakingStates.running, F.text == "▶️ Resume")
 async def speaking_resume(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-
-    data = await state.get_data()
-    if not data.get("paused"):
+    sess = await SpeakingSession.load(state)
+    if not sess.paused:
         return await message.answer("▶️ Allaqachon davom etyapti.")
 
-    await state.update_data(paused=False)
+    sess.paused = False
     await message.answer("▶️ Davom ettiramiz...")
 
-    kind = data.get("phase_kind")
-    end_ts = data.get("phase_end")
+    kind = sess.phase_kind
+    end_ts = sess.phase_end
 
     if kind and end_ts:
         remain = math.ceil(float(end_ts) - time.monotonic())
         remain = max(1, remain)
-        start_timer(message, state, remain, kind)
+        start_timer(message, state, remain, kind, sess)
     else:
-        await speaking_advance(message, state)
+        await speaking_advance(message, state, sess=sess)
+    await sess.flush(state)
 
 @dp.message(SpeakingStates.running, F.text == "⛔ Stop")
 async def speaking_stop(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
     cancel_task(message.from_user.id)
-    await state.update_data(stage="stopped", paused=True)
+    sess = await SpeakingSession.load(state)
+    sess.stage = "stopped"
+    sess.paused = True
     await message.answer("⛔ To‘xtatildi. Hozirgi javoblar bo‘yicha baholayman...")
-    await speaking_finish(message, state)
+    await speaking_finish(message, state, sess)
 
 @dp.message(SpeakingStates.running, F.text == "⬅️ Orqaga")
 async def speaking_back(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
     cancel_task(message.from_user.id)
     await state.clear()
     await message.answer("🔙 Menu", reply_markup=main_menu())
 
 @dp.message(SpeakingStates.running, F.voice)
 async def speaking_voice_handler(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
-    data = await state.get_data()
-    if data.get("paused"):
+    sess = await SpeakingSession.load(state)
+    if sess.paused:
         await message.answer("⏸ Pauza. ▶️ Resume bosing.")
         return
 
@@ -1253,35 +3572,40 @@ async def speaking_voice_handler(message: Message, state: FSMContext):
         return
 
     voice = message.voice
+    duration = int(voice.duration or 0)
+    if duration > VOICE_MAX_SECONDS:
+        await message.answer(
+            f"⚠️ Javob juda uzun ({duration} s). Eng ko‘pi {VOICE_MAX_SECONDS} s — qisqaroq qilib qayta yuboring."
+        )
+        return
+
     ogg_fd, ogg_path = tempfile.mkstemp(suffix=".ogg")
     os.close(ogg_fd)
-    wav_fd, wav_path = tempfile.mkstemp(suffix=".wav")
-    os.close(wav_fd)
+    wav_paths: List[str] = []
 
     try:
-        await bot.download(voice.file_id, destination=ogg_path)
-        await asyncio.to_thread(convert_ogg_to_wav_sync, ogg_path, wav_path)
+        with TRACER.span("download"):
+            await bot.download(voice.file_id, destination=ogg_path)
+        wav_paths = await run_blocking("audio", convert_voice_to_wav_chunks_sync, ogg_path,
+                                       duration > VOICE_CHUNK_AFTER)
 
         await message.answer("🎧 Ovoz matnga aylantirilmoqda...")
-        transcript = await asyncio.to_thread(groq_stt_whisper_sync, wav_path)
+        transcript = await transcribe_wav_chunks(wav_paths)
 
         if not transcript:
             await message.answer("❌ Ovoz tushunilmadi.")
             return
 
-        answers = (await state.get_data()).get("answers", [])
-        if not isinstance(answers, list):
-            answers = []
-        answers.append(transcript)
-        await state.update_data(answers=answers)
+        sess.add_answer(transcript)
 
         await message.answer(f"📝 {transcript}")
 
         cancel_task(message.from_user.id)
-        await speaking_advance(message, state)
+        await speaking_advance(message, state, sess=sess)
+        await sess.flush(state)
 
     finally:
-        for p in (ogg_path, wav_path):
+        for p in [ogg_path] + wav_paths:
             try:
                 os.remove(p)
             except Exception:
@@ -1302,12 +3626,13 @@ def is_uzbek_text(s: str) -> bool:
         return True
     return False
 
+@traced("translate")
 def translate_uz_to_en_sync(text: str) -> str:
     text = (text or "").strip()
     if not text:
         return ""
     try:
-        url = "https://translate.googleapis.com/translate_a/single"
+        url = TRANSLATE_URL
         params = {"client": "gtx", "sl": "uz", "tl": "en", "dt": "t", "q": text}
         r = requests.get(url, params=params, timeout=20)
         if r.status_code == 200:
@@ -1317,12 +3642,13 @@ def translate_uz_to_en_sync(text: str) -> str:
         pass
     return ""
 
+@traced("translate")
 def translate_en_to_uz_sync(text: str) -> str:
     text = (text or "").strip()
     if not text:
         return ""
     try:
-        url = "https://translate.googleapis.com/translate_a/single"
+        url = TRANSLATE_URL
         params = {"client": "gtx", "sl": "en", "tl": "uz", "dt": "t", "q": text}
         r = requests.get(url, params=params, timeout=20)
         if r.status_code == 200:
@@ -1332,9 +3658,10 @@ def translate_en_to_uz_sync(text: str) -> str:
         pass
     return ""
 
+@traced("lookup")
 def dict_lookup_en_sync(word: str) -> Tuple[str, str, Optional[str]]:
     try:
-        r = requests.get(f"https://api.dictionaryapi.dev/api/v2/entries/en/{word}", timeout=15)
+        r = requests.get(f"{DICT_API_URL}/{word}", timeout=15)
         if r.status_code != 200:
             return ("—", "—", None)
 
@@ -1357,6 +3684,7 @@ def dict_lookup_en_sync(word: str) -> Tuple[str, str, Optional[str]]:
     except Exception:
         return ("—", "—", None)
 
+@traced("audio_fetch")
 def download_to_temp_sync(url: str, suffix: str) -> Optional[str]:
     try:
         r = requests.get(url, timeout=30)
@@ -1372,50 +3700,135 @@ def download_to_temp_sync(url: str, suffix: str) -> Optional[str]:
 
 def google_tts_url(text: str, lang: str) -> str:
     return (
-        "https://translate.google.com/translate_tts"
+        f"{TTS_URL}"
         f"?ie=UTF-8&q={requests.utils.quote(text)}&tl={lang}&client=tw-ob"
     )
 
-@dp.message(F.text == "📚 Dictionary")
-async def dict_start(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
+def _split_batch_entries(raw: str) -> List[str]:
+    out: List[str] = []
+    seen = set()
+    for line in (raw or "").splitlines():
+        # "1) apple", "- apple", "• apple" -> "apple"
+        s = re.sub(r"^\s*(?:\d+\s*[.)]|[-•*])\s*", "", line).strip()
+        if s and s.lower() not in seen:
+            seen.add(s.lower())
+            out.append(s)
+    return out
+
+@traced("translate")
+def translate_lines_sync(lines: List[str], mode: str) -> List[str]:
+    # ✅ hammasi BITTA so‘rovda: qatorlar "\n" bilan qaytadi
+    fn = translate_uz_to_en_sync if mode == "uz_en" else translate_en_to_uz_sync
+    joined = fn("\n".join(lines))
+    out = [x.strip() for x in joined.split("\n")] if joined else []
+    if len(out) != len(lines):
+        return []
+    return out
+
+@traced("transcode")
+def merge_audio_sync(paths: List[str], out_path: str) -> bool:
+    try:
+        AudioSegment = _audio_segment()
+        merged = AudioSegment.silent(duration=0)
+        pause = AudioSegment.silent(duration=500)
+        for p in paths:
+            merged += AudioSegment.from_file(p) + pause
+        if len(merged) == 0:
+            return False
+        merged.export(out_path, format="mp3")
+        return True
+    except Exception:
+        return False
 
-    if not await require_sub(message, state):
-        return
+async def _dict_batch_entry(src: str, translated: str, mode: str, sem: asyncio.Semaphore) -> Dict[str, Any]:
+    async with sem:
+        if not translated:
+            fn = translate_uz_to_en_sync if mode == "uz_en" else translate_en_to_uz_sync
+            translated = await run_blocking("lookup", fn, src)
+
+        en = translated if mode == "uz_en" else src
+        token = (en.split() or [""])[0]
+        word = re.sub(r"[^a-zA-Z'\-]", "", token).lower()
+        ipa, definition, audio = ("—", "—", None)
+        if word:
+            ipa, definition, audio = await run_blocking("lookup", dict_lookup_en_sync, word)
+
+        path = None
+        if DICT_BATCH_AUDIO and word:
+            if audio:
+                if audio.startswith("//"):
+                    audio = "https:" + audio
+                path = await run_blocking("lookup", download_to_temp_sync, audio, ".mp3")
+            if not path:
+                path = await run_blocking("lookup", download_to_temp_sync, google_tts_url(word, "en"), ".mp3")
+
+        return {"src": src, "tr": translated, "ipa": ipa, "def": definition, "audio_path": path}
+
+async def dict_batch_handler(message: Message, entries: List[str], mode: str):
+    extra = len(entries) - DICT_BATCH_MAX
+    entries = entries[:DICT_BATCH_MAX]
+
+    await message.answer(f"⏳ {len(entries)} ta so‘z tarjima qilinyapti...")
+    translated = await run_blocking("lookup", translate_lines_sync, entries, mode)
+    if not translated:
+        translated = [""] * len(entries)
+
+    sem = asyncio.Semaphore(DICT_BATCH_CONCURRENCY)
+    results = await asyncio.gather(*(
+        _dict_batch_entry(src, tr, mode, sem) for src, tr in zip(entries, translated)
+    ))
+
+    src_flag, tr_flag = ("🇺🇿", "🇬🇧") if mode == "uz_en" else ("🇬🇧", "🇺🇿")
+    # har so‘z alohida bo‘lim: uzun qatorlarda split_message 4096 limitdan so‘z chegarasida bo‘ladi
+    blocks = [f"📚 {len(results)} ta so‘z:"]
+    for i, r in enumerate(results, 1):
+        definition = r["def"] if len(r["def"]) <= 120 else r["def"][:117] + "..."
+        blocks.append(
+            f"{i}) {src_flag} {r['src']} → {tr_flag} {r['tr'] or '—'}\n"
+            f"   🔊 {r['ipa']} | 📘 {definition}"
+        )
+    if extra > 0:
+        blocks.append(f"⚠️ Bir xabarda ko‘pi bilan {DICT_BATCH_MAX} ta so‘z. Qolgan {extra} tasi o‘tkazib yuborildi.")
+    for chunk in split_message("\n\n".join(blocks)):
+        await message.answer(chunk)
+
+    paths = [r["audio_path"] for r in results if r["audio_path"]]
+    if paths:
+        fd, merged_path = tempfile.mkstemp(suffix=".mp3")
+        os.close(fd)
+        try:
+            if await run_blocking("audio", merge_audio_sync, paths, merged_path):
+                await message.answer_voice(FSInputFile(merged_path), caption="🔊 English pronunciation (hammasi)")
+        finally:
+            for p in paths + [merged_path]:
+                try:
+                    os.remove(p)
+                except Exception:
+                    pass
+
+    inc_stat("dict_lookups", message.from_user.id, len(results))
+    for _ in results:
+        record_event("dict", message.from_user.id)
 
+@dp.message(F.text == "📚 Dictionary")
+async def dict_start(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("📚 Dictionary bo‘limini tanlang:", reply_markup=dictionary_menu())
 
 @dp.message(F.text == "🇺🇿 UZ → EN")
 async def dict_mode_uz_en(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
-    if not await require_sub(message, state):
-        return
-
     await state.set_state(DictionaryStates.waiting_word)
     await state.update_data(dict_mode="uz_en")
-    await message.answer("🇺🇿 Uzbekcha so‘z kiriting:", reply_markup=back_menu())
+    await message.answer("🇺🇿 Uzbekcha so‘z kiriting:\n(bir nechta so‘z — har biri yangi qatorda)", reply_markup=back_menu())
 
 @dp.message(F.text == "🇬🇧 EN → UZ 🔊")
 async def dict_mode_en_uz(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
-    if not await require_sub(message, state):
-        return
-
     await state.set_state(DictionaryStates.waiting_word)
     await state.update_data(dict_mode="en_uz")
-    await message.answer("🇬🇧 English so‘z kiriting:", reply_markup=back_menu())
+    await message.answer("🇬🇧 English so‘z kiriting:\n(bir nechta so‘z — har biri yangi qatorda)", reply_markup=back_menu())
 
 @dp.message(DictionaryStates.waiting_word)
 async def dict_handler(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
     if message.text == "⬅️ Orqaga":
         await state.clear()
         await message.answer("🔙 Menu", reply_markup=main_menu())
@@ -1431,9 +3844,15 @@ async def dict_handler(message: Message, state: FSMContext):
     if not mode:
         mode = "uz_en" if is_uzbek_text(raw) else "en_uz"
 
+    # ✅ ko‘p qatorli xabar -> batch rejim
+    entries = _split_batch_entries(raw)
+    if mode in ("uz_en", "en_uz") and len(entries) > 1:
+        await dict_batch_handler(message, entries, mode)
+        return
+
     if mode == "uz_en":
         await message.answer("⏳ UZ → EN tarjima qilinyapti...")
-        en = await asyncio.to_thread(translate_uz_to_en_sync, raw)
+        en = await run_blocking("lookup", translate_uz_to_en_sync, raw)
         if not en:
             await message.answer("❌ Tarjima topilmadi.")
             return
@@ -1443,7 +3862,7 @@ async def dict_handler(message: Message, state: FSMContext):
         ipa, definition, audio = ("—", "—", None)
 
         if word:
-            ipa, definition, audio = await asyncio.to_thread(dict_lookup_en_sync, word)
+            ipa, definition, audio = await run_blocking("lookup", dict_lookup_en_sync, word)
 
         await message.answer(
             f"🇺🇿 UZ: {raw}\n"
@@ -1456,7 +3875,7 @@ async def dict_handler(message: Message, state: FSMContext):
         if audio:
             if audio.startswith("//"):
                 audio = "https:" + audio
-            path = await asyncio.to_thread(download_to_temp_sync, audio, ".mp3")
+            path = await run_blocking("lookup", download_to_temp_sync, audio, ".mp3")
             if path:
                 await message.answer_voice(FSInputFile(path), caption="🔊 English pronunciation")
                 try:
@@ -1467,7 +3886,7 @@ async def dict_handler(message: Message, state: FSMContext):
 
         if (not audio_sent) and word:
             tts = google_tts_url(word, "en")
-            path = await asyncio.to_thread(download_to_temp_sync, tts, ".mp3")
+            path = await run_blocking("lookup", download_to_temp_sync, tts, ".mp3")
             if path:
                 await message.answer_voice(FSInputFile(path), caption="🔊 English (Google TTS)")
                 try:
@@ -1476,11 +3895,12 @@ async def dict_handler(message: Message, state: FSMContext):
                     pass
 
         inc_stat("dict_lookups", message.from_user.id, 1)
+        record_event("dict", message.from_user.id)
         return
 
     if mode == "en_uz":
         await message.answer("⏳ EN → UZ tarjima qilinyapti...")
-        uz = await asyncio.to_thread(translate_en_to_uz_sync, raw)
+        uz = await run_blocking("lookup", translate_en_to_uz_sync, raw)
         if not uz:
             await message.answer("❌ Tarjima topilmadi.")
             return
@@ -1492,7 +3912,7 @@ async def dict_handler(message: Message, state: FSMContext):
         )
 
         tts = google_tts_url(raw, "en")
-        path = await asyncio.to_thread(download_to_temp_sync, tts, ".mp3")
+        path = await run_blocking("lookup", download_to_temp_sync, tts, ".mp3")
         if path:
             await message.answer_voice(FSInputFile(path), caption="🔊 English (Google TTS)")
             try:
@@ -1501,6 +3921,7 @@ async def dict_handler(message: Message, state: FSMContext):
                 pass
 
         inc_stat("dict_lookups", message.from_user.id, 1)
+        record_event("dict", message.from_user.id)
         return
 
     await message.answer("❌ Dictionary mode xato. Menu → Dictionary dan qayta tanlang.")
@@ -1518,12 +3939,6 @@ WRITING_PROMPTS = {
 
 @dp.message(F.text == "✍️ Writing")
 async def writing_start(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
-    if not await require_sub(message, state):
-        return
-
     # ✅ fallback (list bo‘sh bo‘lsa crash bo‘lmasin)
     if not WRITING_PROMPTS["friend"] or not WRITING_PROMPTS["manager"] or not WRITING_PROMPTS["essay"]:
         WRITING_PROMPTS["friend"] = ["Write a message to your friend. Ask them to remind you about an important date."]
@@ -1549,9 +3964,6 @@ async def writing_start(message: Message, state: FSMContext):
 
 @dp.message(WritingStates.writing_text)
 async def writing_handler(message: Message, state: FSMContext):
-    touch_user(message.from_user.id)
-    register_user(message.from_user.id)
-
     if message.text == "⬅️ Orqaga":
         await state.clear()
         await message.answer("🔙 Menu", reply_markup=main_menu())
@@ -1575,156 +3987,1264 @@ async def writing_handler(message: Message, state: FSMContext):
         {"prompt": str(prompts[2] or ""), "answer": a3},
     ]
 
-    await message.answer("✅ Writing tekshirilmoqda (strict grammar + xatolar + rewrite)...")
-    res = await groq_writing_eval(tasks)
-
-    score = clamp_20_75(int(res.get("score_20_75", 30)))
-    cefr = cefr_from_score_20_75(score)
-    ielts = ielts_from_cefr(cefr)
-
-    overall_mistakes = res.get("overall_mistakes") or []
-    overall_txt = "\n".join(f"- {m}" for m in overall_mistakes[:10]) if overall_mistakes else "—"
-
-    per_task = res.get("per_task") if isinstance(res.get("per_task"), list) else []
-
-    per_txt_lines = []
-    for t in per_task[:3]:
-        try:
-            no = int(t.get("task_no", 0))
-        except Exception:
-            no = 0
-
-        strengths = _safe_list(t.get("strengths"), 3)
-        issues = _safe_list(t.get("issues"), 3)
-        grammar = _safe_list(t.get("grammar_mistakes"), 4)
-        rewrite = str(t.get("rewrite", "")).strip()
-
-        per_txt_lines.append(f"🧩 Task {no}:" if no else "🧩 Task:")
-        if strengths:
-            per_txt_lines.append("✅ Kuchli tomonlar: " + "; ".join(strengths))
-        if issues:
-            per_txt_lines.append("⚠️ Kamchiliklar: " + "; ".join(issues))
-        if grammar:
-            per_txt_lines.append("❗ Grammar xatolar: " + "; ".join(grammar))
-        if rewrite:
-            per_txt_lines.append("✍️ Rewrite:\n" + rewrite)
-        per_txt_lines.append("")
-
-    per_txt = "\n".join(per_txt_lines).strip() or "—"
-    corrected = str(res.get("corrected_best_version", "")).strip() or "—"
-    feedback_uz = str(res.get("feedback_uz", "")).strip() or "—"
+    pre = writing_prescore(tasks)
+    if pre["degenerate"]:
+        res = writing_heuristic_result(tasks, pre, "Javoblar juda qisqa — avtomatik baholandi. Har bir task’ni to‘liq yozing.")
+        view = ProgressiveMessage(message, reply_markup=main_menu())
+        await view.finish(writing_result_text(res))
+        inc_stat("writings_completed", message.from_user.id, 1)
+        record_event("writing", message.from_user.id, res["score_20_75"])
+        await state.clear()
+        return
 
     await message.answer(
-        "📊 Writing natija\n"
-        f"🏷 CEFR: {cefr}\n"
-        f"🎯 IELTS (taxminiy): {ielts}\n"
-        f"⭐ Ball: {score}/75\n\n"
-        f"🧠 Izoh (UZ): {feedback_uz}\n\n"
-        f"❗ Umumiy xatolar:\n{overall_txt}\n\n"
-        f"{per_txt}\n"
-        f"✅ To‘g‘rilangan eng yaxshi variant:\n{corrected}",
-        reply_markup=main_menu()
+        "✅ Writing tekshirilmoqda (strict grammar + xatolar + rewrite)...\n"
+        f"🔎 Taxminiy: {pre['score_20_75']}/75 ({cefr_from_score_20_75(pre['score_20_75'])})"
     )
+    if WRITING_EVAL_MODE == "parallel":
+        res = await writing_eval_parallel(message, tasks)
+    elif WRITING_EVAL_MODE == "stream":
+        res = await writing_eval_progressive(message, tasks)
+    else:
+        res = await groq_writing_eval(tasks)
+        view = ProgressiveMessage(message, reply_markup=main_menu())
+        await view.finish(writing_result_text(res))
 
     inc_stat("writings_completed", message.from_user.id, 1)
+    record_event("writing", message.from_user.id, res.get("score_20_75"))
     await state.clear()
 
 
 # =========================================================
 # Admin commands
 # =========================================================
+def _format_label(user_id: int, uname: str, first: str) -> str:
+    if uname:
+        return f"@{uname} ({user_id})"
+    return f"{first or 'User'} ({user_id})"
+
+_profile_next = 0.0
+
+async def _fetch_profile(user_id: int, sem: asyncio.Semaphore) -> Optional[Tuple[str, str]]:
+    global _profile_next
+    async with sem:
+        # get_chat limitga tushmasin: PROFILE_FETCH_RATE so‘rov/sek
+        now = time.monotonic()
+        wait = _profile_next - now
+        _profile_next = max(now, _profile_next) + 1.0 / PROFILE_FETCH_RATE
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            chat = await bot.get_chat(user_id)
+        except Exception:
+            return None
+
+    uname = getattr(chat, "username", None) or ""
+    first = getattr(chat, "first_name", None) or getattr(chat, "title", None) or ""
+    with _users_lock:
+        rec = USERS_DB.get(user_id)
+        if isinstance(rec, dict) and (uname or first):
+            rec["username"] = uname
+            rec["name"] = first
+            mark_users_dirty()
+    return (uname, first)
+
+async def user_labels(user_ids: List[int], known: Optional[Dict[int, Tuple[str, str]]] = None) -> Dict[int, str]:
+    # known — boshqa shard’lardan kelgan profillar (uname, first)
+    out: Dict[int, str] = {}
+    misses: List[int] = []
+    for uid in user_ids:
+        prof = (known or {}).get(uid) or cached_profile(uid)
+        if prof:
+            out[uid] = _format_label(uid, prof[0], prof[1])
+        else:
+            misses.append(uid)
+
+    if misses and bot:
+        sem = asyncio.Semaphore(PROFILE_FETCH_CONCURRENCY)
+        fetched = await asyncio.gather(*(_fetch_profile(uid, sem) for uid in misses))
+        for uid, prof in zip(misses, fetched):
+            if prof:
+                out[uid] = _format_label(uid, prof[0], prof[1])
+
+    for uid in user_ids:
+        out.setdefault(uid, str(uid))
+    return out
+
 async def user_label(user_id: int) -> str:
-    if not bot:
-        return str(user_id)
-    try:
-        chat = await bot.get_chat(user_id)
-        uname = getattr(chat, "username", None)
-        first = getattr(chat, "first_name", None) or getattr(chat, "title", None) or "User"
-        if uname:
-            return f"@{uname} ({user_id})"
-        return f"{first} ({user_id})"
-    except Exception:
-        return str(user_id)
+    return (await user_labels([user_id]))[user_id]
 
 @dp.message(Command("admin"))
 async def cmd_admin(message: Message):
-    touch_user(message.from_user.id)
-
     if not is_admin(message.from_user.id):
         return await message.answer("⛔ Siz admin emassiz.")
 
-    with _stats_lock:
-        exams = dict(stats.get("exams_completed", {}))
-        dicts = dict(stats.get("dict_lookups", {}))
-        writes = dict(stats.get("writings_completed", {}))
-
-    total_speaking = sum(int(v) for v in exams.values())
-    total_dict = sum(int(v) for v in dicts.values())
-    total_writing = sum(int(v) for v in writes.values())
-
-    users = set(exams) | set(dicts) | set(writes)
-    online_count = len(online_users(300))
+    parts = await shard_gather("stats_summary")
+    if not parts or not all(x["ready"] for x in parts):
+        return await message.answer("⏳ Ma’lumotlar hali yuklanmoqda, birozdan keyin urinib ko‘ring.")
+
+    # ✅ O(K): har shard o‘z top-K’sini beradi, bu yerda faqat birlashtiramiz
+    totals: Dict[str, int] = {}
+    known: Dict[int, Tuple[str, str]] = {}
+    rows = []
+    for x in parts:
+        for sec, v in x["totals"].items():
+            totals[sec] = totals.get(sec, 0) + v
+        rows.extend(x["top"])
+        known.update(x["profiles"])
+    unique_users = sum(x["unique_users"] for x in parts)
+    online_count = sum(x["online"] for x in parts)
+    top = [row[:1] + row[2:] for row in sorted(rows, key=lambda r: -r[1])[:TOP_K_SIZE]]
 
     text = (
         "👑 ADMIN STATS\n\n"
-        f"👥 Unique users: {len(users)}\n"
+        + missing_shards_note(parts)
+        + f"👥 Unique users: {unique_users}\n"
         f"🟢 Online (5 min): {online_count}\n\n"
-        f"🗣 Speaking total: {total_speaking}\n"
-        f"📚 Dictionary total: {total_dict}\n"
-        f"✍️ Writing total: {total_writing}\n"
+        f"🗣 Speaking total: {totals.get('exams_completed', 0)}\n"
+        f"📚 Dictionary total: {totals.get('dict_lookups', 0)}\n"
+        f"✍️ Writing total: {totals.get('writings_completed', 0)}\n"
     )
 
-    def user_total(uid_str: str) -> int:
-        return int(exams.get(uid_str, 0)) + int(dicts.get(uid_str, 0)) + int(writes.get(uid_str, 0))
-
-    top = sorted(list(users), key=user_total, reverse=True)[:10]
     if top:
+        labels = await user_labels([int(row[0]) for row in top], known)
         text += "\n🏆 TOP 10 (eng aktiv):\n"
-        for i, uid_str in enumerate(top, 1):
-            uid = int(uid_str)
-            label = await user_label(uid)
+        for i, (uid_str, n_exams, n_dicts, n_writes) in enumerate(top, 1):
+            label = labels[int(uid_str)]
             text += (
                 f"{i}) {label}\n"
-                f"   🗣 {int(exams.get(uid_str,0))} | 📚 {int(dicts.get(uid_str,0))} | ✍️ {int(writes.get(uid_str,0))}\n"
+                f"   🗣 {n_exams} | 📚 {n_dicts} | ✍️ {n_writes}\n"
             )
 
     await message.answer(text)
 
+@dp.message(Command("pools"))
+async def cmd_pools(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ Siz admin emassiz.")
+
+    lines = ["🧵 POOLS\n"]
+    for shard in await shard_gather("pools"):
+        if SHARDS > 1:
+            lines.append(f"— shard {shard['shard']}")
+        for name, m in shard["pools"].items():
+            lines.append(
+                f"{name}: {m['active']}/{m['threads']} band | navbat {m['queued']} | jami {m['submitted']} | rad {m['rejected']}\n"
+                f"   ⏱ kutish p50 {m['wait_p50']*1000:.0f}ms · p95 {m['wait_p95']*1000:.0f}ms · max {m['wait_max']*1000:.0f}ms"
+            )
+    await message.answer("\n".join(lines))
+
+def _fmt_sec(sec: float) -> str:
+    return f"{sec:.1f}s" if sec >= 1 else f"{sec * 1000:.0f}ms"
+
+def _p(xs: List[float], q: float) -> float:
+    return xs[min(len(xs) - 1, int(len(xs) * q))] if xs else 0.0
+
+@dp.message(Command("perf"))
+async def cmd_perf(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ Siz admin emassiz.")
+
+    parts = (message.text or "").split()
+    minutes = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else TRACE_WINDOW_MINUTES
+    window = minutes * 60
+
+    lines = [
+        f"📈 PERF (oxirgi {minutes} min)\n",
+        f"🚀 Startup: {startup_report()}\n",
+        "Bosqichlar: n · p50 · p95",
+    ]
+    steps: Dict[str, List[float]] = {}
+    traces: List[Tuple[str, int, float, float, List[Tuple[str, float]]]] = []
+    known: Dict[int, Tuple[str, str]] = {}
+    for shard in await shard_gather("perf", window):
+        for step, xs in shard["steps"].items():
+            steps.setdefault(step, []).extend(xs)
+        traces.extend(shard["traces"])
+        known.update(shard["profiles"])
+
+    for step, xs in sorted(steps.items(), key=lambda kv: -sum(kv[1])):
+        xs.sort()
+        lines.append(f"{step}: {len(xs)} · {_fmt_sec(_p(xs, 0.5))} · {_fmt_sec(_p(xs, 0.95))}")
+    if not steps:
+        lines.append("— ma’lumot yo‘q")
+
+    by_name: Dict[str, List[float]] = {}
+    for name, _uid, _wall, total, _spans in traces:
+        by_name.setdefault(name, []).append(total)
+    if by_name:
+        lines.append("\nHandlerlar: n · p50 · p95")
+        for name, xs in sorted(by_name.items(), key=lambda kv: -len(kv[1])):
+            xs.sort()
+            lines.append(f"{name}: {len(xs)} · {_fmt_sec(_p(xs, 0.5))} · {_fmt_sec(_p(xs, 0.95))}")
+
+        slow = heapq.nlargest(PERF_SLOW_TRACES, traces, key=lambda t: t[3])
+        labels = await user_labels([t[1] for t in slow if t[1]], known)
+        lines.append("\n🐢 Eng sekin:")
+        for i, (name, uid, wall, total, spans) in enumerate(slow, 1):
+            per_step: Dict[str, float] = {}
+            for step, sec in spans:
+                per_step[step] = per_step.get(step, 0.0) + sec
+            breakdown = ", ".join(f"{k} {_fmt_sec(v)}" for k, v in sorted(per_step.items(), key=lambda kv: -kv[1])[:5])
+            ago = int(time.time() - wall)
+            lines.append(
+                f"{i}) {name} · {labels.get(uid, uid)} · {_fmt_sec(total)} ({ago // 60}m oldin)\n"
+                f"   {breakdown or '—'}"
+            )
+
+    await message.answer("\n".join(lines))
+
+@dp.message(Command("groq"))
+async def cmd_groq(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ Siz admin emassiz.")
+
+    rows: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for shard in await shard_gather("groq"):
+        for key, r in shard.items():
+            acc = rows.setdefault(tuple(key), dict.fromkeys(r, 0))
+            for k, v in r.items():
+                acc[k] = acc.get(k, 0) + v
+    if not rows:
+        return await message.answer("🤖 Groq chaqiruvlari hali yo‘q")
+
+    lines = ["🤖 GROQ (route · model)\n"]
+    for (route, model), r in sorted(rows.items(), key=lambda kv: (kv[0][0], -kv[1]["calls"])):
+        ok = r["calls"] - r["errors"]
+        avg = r["seconds"] / r["calls"] if r["calls"] else 0.0
+        tps = r["completion_tokens"] / r["seconds"] if r["seconds"] else 0.0
+        lines.append(
+            f"{route} · {model}: {r['calls']} ta (✅ {ok}) · o‘rtacha {_fmt_sec(avg)}\n"
+            f"   🔤 in {r['prompt_tokens']} / out {r['completion_tokens']} tok · {tps:.0f} tok/s\n"
+            f"   🧩 JSON: ♻️ tuzatildi {r['repaired']} · ❌ buzuq (retry) {r['bad_json']}"
+        )
+    await message.answer("\n".join(lines))
+
+@dp.message(Command("events"))
+async def cmd_events(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ Siz admin emassiz.")
+
+    parts = (message.text or "").split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else EVENTS_DEFAULT_DAYS
+    days = max(1, min(365, days))
+    if not NUMPY_AVAILABLE:
+        return await message.answer("⚠️ /events uchun numpy kerak (pip install numpy).")
+    t0 = time.perf_counter()
+    report = await run_blocking("analytics", events_report, days)
+    took = time.perf_counter() - t0
+
+    icons = {"speaking": "🗣", "writing": "✍️", "dict": "📚"}
+    lines = [f"🗂 EVENTS (oxirgi {days} kun · {report['total']} ta · {_fmt_sec(took)})\n"]
+    for name, k in report["kinds"].items():
+        lines.append(
+            f"{icons.get(name, '•')} {name}: {k['n']} ta · {k['users']} user\n"
+            f"   ⏱ soatiga {k['per_hour']:.1f} (eng ko‘p {k['peak_hour']}) · "
+            f"latency p50 {_fmt_sec(k['latency_p50'])} · p95 {_fmt_sec(k['latency_p95'])}"
+        )
+        if days <= 14:
+            lines.append("   📅 kunlar: " + " ".join(str(x) for x in k["per_day"]))
+        if k["by_cefr"]:
+            cefr = " | ".join(f"{lvl} {n} (med {med:.0f})" for lvl, (n, med) in k["by_cefr"].items())
+            lines.append(f"   🏷 {cefr} · median {k['score_median']:.0f}")
+    if not report["kinds"]:
+        lines.append("— ma’lumot yo‘q")
+    await message.answer("\n".join(lines))
+
 @dp.message(Command("online"))
 async def cmd_online(message: Message):
-    touch_user(message.from_user.id)
-
     if message.from_user.id not in ADMINS:
         return await message.answer("⛔ Admin emas")
 
-    on = online_users()
-    if not on:
-        return await message.answer("🟢 Online user yo‘q")
-
-    lines = ["🟢 ONLINE:\n"]
-    for uid in on:
-        lines.append("👤 " + await user_label(uid))
+    seen: List[Tuple[int, float]] = []
+    counts_by_window = dict.fromkeys(ONLINE_WINDOWS, 0)
+    known: Dict[int, Tuple[str, str]] = {}
+    parts = await shard_gather("online")
+    for shard in parts:
+        seen.extend(shard["users"])
+        known.update(shard["profiles"])
+        for w, c in shard["counts"].items():
+            counts_by_window[int(w)] += c
+    note = missing_shards_note(parts)
+    if not seen:
+        return await message.answer(note + "🟢 Online user yo‘q")
+
+    seen.sort(key=lambda x: -x[1])
+    labels = await user_labels([uid for uid, _ts in seen], known)
+    now = time.time()
+    counts = " | ".join(f"{w // 60} min: {counts_by_window[w]}" for w in ONLINE_WINDOWS)
+    lines = [f"{note}🟢 ONLINE ({counts}):\n"]
+    for uid, ts in seen:
+        ago = int(now - ts)
+        lines.append(f"👤 {labels[uid]} · {ago // 60}m {ago % 60}s oldin")
 
     await message.answer("\n".join(lines))
 
 
+# =========================================================
+# Broadcast (/broadcast): rate limit + checkpoint + restart’dan keyin davom
+# =========================================================
+# Har process (shard) faqat o‘z USERS_DB’sidagilarga yuboradi, id o‘sish tartibida.
+# Xabarlar OUTBOUND orqali PRIO_BULK bilan ketadi: global limit, per-chat RetryAfter
+# backoff va retry o‘sha yerda; interaktiv javoblar navbatda oldinga o‘tadi.
+# Checkpoint — "cursor": shu id’gacha (shu jumladan) hammasi tugagan; "done_above" — cursor’dan
+# yuqorida allaqachon tugaganlar (pastroqdagi xabar hali OUTBOUND’da turganda), resume’da
+# ular qayta yuborilmaydi va qayta sanalmaydi.
+BROADCAST_COUNTERS = ("sent", "blocked", "skipped", "failed")
+
+BROADCAST_USAGE = (
+    "📣 Broadcast:\n"
+    "• /broadcast <matn> — hammaga matn\n"
+    "• xabarga reply qilib /broadcast — o‘sha xabar nusxasi (rasm/format bilan)\n"
+    "• /broadcast — holat · /broadcast stop — to‘xtatish"
+)
+
+def _new_broadcast_part() -> Dict[str, Any]:
+    return {"cursor": None, "total": 0, "sent": 0, "blocked": 0, "skipped": 0, "failed": 0,
+            "done": False, "stopped": False, "done_above": []}
+
+def broadcast_part(state: Any, index: int, count: int) -> Dict[str, Any]:
+    parts = state.get("parts") if isinstance(state, dict) else None
+    if not isinstance(parts, dict) or not parts:
+        return _new_broadcast_part()
+    own = parts.get(f"{index}/{count}")
+    if isinstance(own, dict):
+        return dict(_new_broadcast_part(), **own)
+    # shard soni o‘zgargan: eng kichik cursor’dan davom etamiz — kimgadir takror ketishi mumkin, tushib qolmaydi
+    olds = [p for p in parts.values() if isinstance(p, dict)]
+    part = _new_broadcast_part()
+    cursors = [p.get("cursor") for p in olds]
+    part["cursor"] = None if None in cursors else min(cursors)
+    part["done"] = all(p.get("done") for p in olds)
+    part["stopped"] = any(p.get("stopped") for p in olds)
+    if index == 0:
+        for k in BROADCAST_COUNTERS:
+            part[k] = sum(int(p.get(k, 0) or 0) for p in olds)
+    return part
+
+def broadcast_snapshot() -> Any:
+    # lock ostida faqat kalitlar; sort numpy’da (1M id ~ 8MB), numpy yo‘q bo‘lsa oddiy list
+    with _users_lock:
+        keys = list(USERS_DB)
+    if not NUMPY_AVAILABLE:
+        keys.sort()
+        return keys
+    np = _np()
+    return np.sort(np.fromiter(keys, dtype=np.int64, count=len(keys)))
+
+def broadcast_recipients(ids: Any, start: int, chunk: int = 1000) -> Iterator[int]:
+    for i in range(start, len(ids), chunk):
+        part = ids[i:i + chunk]
+        yield from part.tolist() if hasattr(part, "tolist") else part
+
+
+class Broadcaster:
+    def __init__(self):
+        self.job: Optional[Dict[str, Any]] = None   # id, source, admin_chat, status_msg, started
+        self.part: Dict[str, Any] = _new_broadcast_part()
+        self.task: Optional[asyncio.Task] = None
+        self.reporter: Optional[asyncio.Task] = None
+        self.inflight: Dict[int, asyncio.Task] = {}
+        self.last_id: Optional[int] = None
+        self.done_above: Set[int] = set()
+        self.stopping = False
+        self.run_t0 = 0.0
+        self.run_n = 0
+
+    @staticmethod
+    def _layout() -> Tuple[int, int]:
+        return (SHARD_INDEX, SHARDS) if SHARD_INDEX is not None else (0, 1)
+
+    @staticmethod
+    def _spawn(coro) -> asyncio.Task:
+        # bo‘sh context: admin trace’i (CURRENT_TRACE) va send priority meros bo‘lib qolmasin
+        return contextvars.Context().run(asyncio.create_task, coro)
+
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def processed(self) -> int:
+        return sum(int(self.part[k]) for k in BROADCAST_COUNTERS)
+
+    def checkpoint(self):
+        if self.job is None:
+            return
+        if self.inflight:
+            self.part["cursor"] = min(self.inflight) - 1
+        elif self.last_id is not None:
+            self.part["cursor"] = self.last_id
+        cursor = self.part["cursor"]
+        if cursor is not None:
+            self.done_above = {uid for uid in self.done_above if uid > cursor}
+        self.part["done_above"] = sorted(self.done_above)
+        index, count = self._layout()
+        save_json(BROADCAST_FILE, {"job": self.job, "parts": {f"{index}/{count}": self.part}})
+
+    def start(self, job: Dict[str, Any]) -> bool:
+        if self.running():
+            return False
+        self.job = job
+        self.part = _new_broadcast_part()
+        self._launch()
+        return True
+
+    def _launch(self):
+        self.stopping = False
+        self.inflight = {}
+        self.last_id = self.part["cursor"]
+        self.done_above = set(self.part.get("done_above") or [])
+        self.task = self._spawn(self._run())
+
+    def resume(self):
+        state = load_json(BROADCAST_FILE, {})
+        if not isinstance(state, dict) or not isinstance(state.get("job"), dict):
+            return
+        self.job = state["job"]
+        self.part = broadcast_part(state, *self._layout())
+        if self.part["done"] or self.part["stopped"]:
+            return
+        self._launch()
+        if SHARD_INDEX is None or shard_of(self.job["admin_chat"]) == SHARD_INDEX:
+            self.report()
+        print(f"📣 Broadcast davom etmoqda: {self.processed()} ta tayyor, cursor {self.part['cursor']}")
+
+    def report(self):
+        if self.job is not None and (self.reporter is None or self.reporter.done()):
+            self.reporter = self._spawn(broadcast_report_job(self.job))
+
+    async def pause(self, stopped: bool = False, timeout: float = SHUTDOWN_DRAIN_SECONDS) -> Dict[str, Any]:
+        # yangi yuborish boshlanmaydi; OUTBOUND’dagi in-flight’lar tugashini kutamiz
+        if self.job is not None and stopped:
+            self.part["stopped"] = True
+        if self.running():
+            self.stopping = True
+            await asyncio.wait({self.task}, timeout=timeout)
+        self.checkpoint()
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        # shard so‘rovi SHARD_QUERY_TIMEOUT ichida javob berishi kerak: kutmaymiz —
+        # _run in-flight’lar tugagach o‘zi checkpoint qiladi
+        if self.job is not None:
+            self.part["stopped"] = True
+        if self.running():
+            self.stopping = True
+        self.checkpoint()
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        # shard so‘rovi: None qaytarsak javob tashlab yuboriladi
+        running = self.running()
+        elapsed = time.monotonic() - self.run_t0
+        rate = self.run_n / elapsed if running and elapsed > 0 else 0.0
+        left = max(0, int(self.part["total"]) - self.processed())
+        return {
+            "id": self.job["id"] if self.job else None,
+            "running": running,
+            "done": bool(self.part["done"]),
+            "stopped": bool(self.part["stopped"]),
+            "total": int(self.part["total"]),
+            "processed": self.processed(),
+            **{k: int(self.part[k]) for k in BROADCAST_COUNTERS},
+            "rate": rate,
+            "eta": left / rate if rate > 0 else None,
+        }
+
+    def _count(self, kind: str):
+        self.part[kind] += 1
+        self.run_n += 1
+
+    def _delivered(self, uid: int, slots: asyncio.Semaphore, t: asyncio.Task):
+        self.inflight.pop(uid, None)
+        slots.release()
+        if not t.cancelled() and self.inflight and min(self.inflight) < uid:
+            self.done_above.add(uid)
+
+    async def _run(self):
+        await wait_state_ready()
+        ids = await run_blocking("analytics", broadcast_snapshot)
+        cursor = self.part["cursor"]
+        start = 0 if cursor is None else bisect.bisect_right(ids, cursor)
+        self.part["total"] = self.processed() + (len(ids) - start) - len(self.done_above)
+        self.run_t0 = time.monotonic()
+        self.run_n = 0
+        slots = asyncio.Semaphore(BROADCAST_INFLIGHT)
+        next_checkpoint = time.monotonic() + BROADCAST_CHECKPOINT_EVERY
+        finished = False
+        try:
+            for n, uid in enumerate(broadcast_recipients(ids, start)):
+                if self.stopping:
+                    break
+                if uid in self.done_above:
+                    self.last_id = uid
+                    continue
+                with _users_lock:
+                    rec = USERS_DB.get(uid)
+                if isinstance(rec, dict) and rec.get("blocked"):
+                    self._count("skipped")
+                    if self.inflight:
+                        self.done_above.add(uid)
+                    if n % 1000 == 999:
+                        await asyncio.sleep(0)
+                else:
+                    await slots.acquire()
+                    if self.stopping:
+                        slots.release()
+                        break
+                    t = asyncio.create_task(self._deliver(uid))
+                    self.inflight[uid] = t
+                    t.add_done_callback(functools.partial(self._delivered, uid, slots))
+                self.last_id = uid
+                if time.monotonic() >= next_checkpoint:
+                    self.checkpoint()
+                    next_checkpoint = time.monotonic() + BROADCAST_CHECKPOINT_EVERY
+            else:
+                finished = True
+            if self.inflight:
+                await asyncio.wait(list(self.inflight.values()))
+            self.part["done"] = finished
+        finally:
+            self.checkpoint()
+
+    async def _deliver(self, uid: int):
+        src = self.job["source"]
+        try:
+            with send_priority(PRIO_BULK):
+                if src.get("text"):
+                    await bot.send_message(uid, src["text"])
+                else:
+                    await bot.copy_message(uid, src["from_chat_id"], src["message_id"])
+        except TelegramForbiddenError:
+            # bot blocked / user is deactivated / kicked
+            mark_user_blocked(uid)
+            return self._count("blocked")
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                mark_user_blocked(uid)
+                return self._count("blocked")
+            return self._count("failed")
+        except Exception:
+            # RetryAfter SEND_MAX_RETRIES’dan oshgan yoki tarmoq xatosi
+            return self._count("failed")
+        self._count("sent")
+
+
+BROADCAST = Broadcaster()
+
+def broadcast_status_text(parts: List[Dict[str, Any]]) -> str:
+    total = sum(p["total"] for p in parts)
+    processed = sum(p["processed"] for p in parts)
+    running = any(p["running"] for p in parts)
+    if parts and all(p["done"] for p in parts) and len(parts) >= SHARDS:
+        head = "✅ Broadcast tugadi"
+    elif any(p["stopped"] for p in parts):
+        head = "⏹ Broadcast to‘xtatildi"
+    elif running:
+        head = "📣 Broadcast ketmoqda"
+    else:
+        head = "⏸ Broadcast kutmoqda"
+    pct = processed * 100 / total if total else 100.0
+    c = {k: sum(p[k] for p in parts) for k in BROADCAST_COUNTERS}
+    lines = [
+        f"{head} — {processed}/{total} ({pct:.0f}%)",
+        f"✅ {c['sent']} yuborildi · 🚫 {c['blocked']} bloklagan · ⏭ {c['skipped']} o‘tkazildi · ❌ {c['failed']} xato",
+    ]
+    if running and not any(p["stopped"] for p in parts):
+        # shard’lar parallel — ETA eng sekin shard bo‘yicha
+        etas = [p["eta"] for p in parts if p["running"] and p["eta"] is not None]
+        eta = f"{int(max(etas)) // 60}m {int(max(etas)) % 60}s" if etas else "—"
+        lines.append(f"⚡️ {sum(p['rate'] for p in parts):.1f} xabar/s · ⏳ ETA {eta}")
+    return "\n".join(lines)
+
+async def broadcast_report_job(job: Dict[str, Any]):
+    # admin’ning shard’ida: status xabarini davriy edit qiladi
+    while True:
+        await asyncio.sleep(BROADCAST_PROGRESS_EVERY)
+        parts = [p for p in await shard_gather("broadcast_status") if p["id"] == job["id"]]
+        if not parts:
+            return   # boshqa broadcast boshlangan
+        finished = len(parts) >= SHARDS and not any(p["running"] for p in parts)
+        text = broadcast_status_text(parts)
+        try:
+            await bot.edit_message_text(text, chat_id=job["admin_chat"], message_id=job["status_msg"])
+            if finished:
+                await bot.send_message(job["admin_chat"], text)
+        except Exception:
+            pass
+        if finished:
+            return
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    if not is_admin(message.from_user.id):
+        return await message.answer("⛔ Siz admin emassiz.")
+
+    arg = ((message.text or "").split(maxsplit=1)[1:] or [""])[0].strip()
+    parts = [p for p in await shard_gather("broadcast_status") if p["id"] is not None]
+    running = any(p["running"] for p in parts)
+
+    if arg.lower() == "stop":
+        if not running:
+            return await message.answer("ℹ️ Hozir broadcast ketmayapti.")
+        return await message.answer(broadcast_status_text(await shard_gather("broadcast_stop")))
+
+    reply = message.reply_to_message
+    if not arg and not reply:
+        if not parts:
+            return await message.answer(BROADCAST_USAGE)
+        latest = max(p["id"] for p in parts)
+        return await message.answer(broadcast_status_text([p for p in parts if p["id"] == latest]))
+
+    if running:
+        return await message.answer("⏳ Broadcast allaqachon ketmoqda. Holat: /broadcast · to‘xtatish: /broadcast stop")
+    users = await users_summary()
+    if users is None:
+        return await message.answer("⏳ Ma’lumotlar hali yuklanmoqda, birozdan keyin urinib ko‘ring.")
+
+    if reply:
+        source = {"from_chat_id": message.chat.id, "message_id": reply.message_id}
+    else:
+        source = {"text": arg}
+    status = await message.answer(f"📣 Broadcast boshlanmoqda: {users['total']} user")
+    job = {"id": time.time_ns(), "source": source, "admin_chat": message.chat.id,
+           "status_msg": status.message_id, "started": time.time()}
+    started = await shard_gather("broadcast_start", job)
+    if sum(1 for ok in started if ok) < SHARDS:
+        await message.answer(f"⚠️ {SHARDS - sum(1 for ok in started if ok)} ta shard broadcast’ni boshlamadi")
+    BROADCAST.report()
+
+
+# =========================================================
+# Shards (multi-process): supervisor + worker’lar
+# =========================================================
+# Supervisor getUpdates qiladi (token bo‘yicha faqat bitta consumer bo‘lishi mumkin) va
+# update’ni user_id hash’i bo‘yicha worker’ga Pipe orqali beradi. Har worker o‘z user’lari
+# uchun FSM, speaking timer, users/stats’ning egasi: fayllar users.shard{i}of{n}.json,
+# start’da asosiy fayldan bo‘linadi, to‘xtaganda qayta birlashtiriladi. Admin buyruqlari
+# SHARD_QUERIES orqali hamma shard’dan yig‘ib oladi.
+SHARD_INDEX: Optional[int] = None   # None — worker emas (bitta process yoki supervisor)
+
+def shard_of(user_id: Any, count: int = 0) -> int:
+    # str(user_id): stats kalitlari (str) va USERS_DB kalitlari (int) bir xil shard’ga tushadi
+    return zlib.crc32(str(user_id).encode()) % (count or SHARDS)
+
+def shard_path(path: str, index: int, count: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}of{count}{ext}"
+
+def _shard_files(path: str) -> List[str]:
+    root, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(root)}.shard*of*{ext}"))
+
+def join_shard_files():
+    # shard fayllar -> asosiy fayllar (crash’dan keyin qolgan bo‘lsa ham)
+    user_parts = _shard_files(USERS_FILE)
+    if user_parts:
+        db = _read_users_file(USERS_FILE)
+        for path in user_parts:
+            for uid, rec in _read_users_file(path).items():
+                db[uid] = _merge_user_rec(db.get(uid), rec)
+        if save_json(USERS_FILE, {str(uid): rec for uid, rec in db.items()}):
+            for path in user_parts:
+                os.remove(path)
+
+    stat_parts = _shard_files(STATS_FILE)
+    if stat_parts:
+        base = load_json(STATS_FILE, {})
+        if not isinstance(base, dict):
+            base = {}
+        for path in stat_parts:
+            part = load_json(path, {})
+            for section, per_user in (part.items() if isinstance(part, dict) else ()):
+                if isinstance(per_user, dict):
+                    # shard’dagi qiymat — shu user’ning to‘liq soni (asosiydan bo‘lingan + yangilari)
+                    dst = base.get(section)
+                    if not isinstance(dst, dict):
+                        dst = base[section] = {}
+                    dst.update(per_user)
+        if save_json(STATS_FILE, base):
+            for path in stat_parts:
+                os.remove(path)
+
+    bc_parts = _shard_files(BROADCAST_FILE)
+    if bc_parts:
+        # shard qismlari asosiy fayldagi eski qismlarni almashtiradi (kalit "index/count");
+        # asosiy faylda yangiroq broadcast bo‘lsa, qoldiqlar shunchaki o‘chiriladi
+        base = load_json(BROADCAST_FILE, {})
+        base_id = base["job"].get("id", 0) if isinstance(base, dict) and isinstance(base.get("job"), dict) else 0
+        states = [x for x in (load_json(path, {}) for path in bc_parts)
+                  if isinstance(x, dict) and isinstance(x.get("job"), dict)]
+        job = max((x["job"] for x in states), key=lambda j: j.get("id", 0), default=None)
+        saved = True
+        if job is not None and job.get("id", 0) >= base_id:
+            merged: Dict[str, Any] = {}
+            for x in states:
+                if x["job"].get("id") == job.get("id") and isinstance(x.get("parts"), dict):
+                    merged.update(x["parts"])
+            saved = save_json(BROADCAST_FILE, {"job": job, "parts": merged})
+        if saved:
+            for path in bc_parts:
+                os.remove(path)
+
+def split_state_files(count: int):
+    join_shard_files()
+    db = _read_users_file(USERS_FILE)
+    base = load_json(STATS_FILE, {})
+    users_parts: List[Dict[str, Any]] = [{} for _ in range(count)]
+    for uid, rec in db.items():
+        users_parts[shard_of(uid, count)][str(uid)] = rec
+    stats_parts: List[Dict[str, Dict[str, int]]] = [{sec: {} for sec in STATS_SECTIONS} for _ in range(count)]
+    for section, per_user in (base.items() if isinstance(base, dict) else ()):
+        if not isinstance(per_user, dict):
+            continue
+        for uid, v in per_user.items():
+            stats_parts[shard_of(uid, count)].setdefault(section, {})[uid] = v
+    for i in range(count):
+        save_json(shard_path(USERS_FILE, i, count), users_parts[i])
+        save_json(shard_path(STATS_FILE, i, count), stats_parts[i])
+
+    bc = load_json(BROADCAST_FILE, {})
+    if isinstance(bc, dict) and isinstance(bc.get("job"), dict):
+        for i in range(count):
+            save_json(shard_path(BROADCAST_FILE, i, count),
+                      {"job": bc["job"], "parts": {f"{i}/{count}": broadcast_part(bc, i, count)}})
+
+def update_user_id(update: Any) -> Optional[int]:
+    try:
+        event = update.event
+    except Exception:
+        return None
+    # chat_member: kimning obunasi o‘zgargan bo‘lsa, o‘sha user’ning shard’i
+    member = getattr(event, "new_chat_member", None)
+    user = getattr(member, "user", None) or getattr(event, "from_user", None)
+    return user.id if user else None
+
+
+# --- admin so‘rovlari: har shard o‘zinikini beradi (faqat oddiy tiplar — Pipe orqali pickle) ---
+async def _q_users_summary() -> Dict[str, Any]:
+    ready = await wait_state_ready(SHARD_QUERY_TIMEOUT / 2)
+    return {
+        "ready": ready,
+        "total": _total_users(),
+        "today": _count_active_users(1),
+        "last7": _count_active_users(7),
+        "month": _count_active_users(30),
+        "sub_total": _total_sub_passed(),
+        "sub_today": _count_sub_passed(1),
+        "sub_last7": _count_sub_passed(7),
+        "sub_month": _count_sub_passed(30),
+    }
+
+async def _q_stats_summary() -> Dict[str, Any]:
+    ready = await wait_state_ready(SHARD_QUERY_TIMEOUT / 2)
+    with _stats_lock:
+        totals = dict(STATS_TOTALS)
+        unique_users = len(USER_TOTALS)
+        top = []
+        for uid_str, total in TOP_USERS.items()[:TOP_K_SIZE]:
+            top.append((uid_str, total, *(int((stats.get(sec) or {}).get(uid_str, 0)) for sec in STATS_SECTIONS)))
+    profiles: Dict[int, Tuple[str, str]] = {}
+    for row in top:
+        prof = cached_profile(int(row[0]))
+        if prof:
+            profiles[int(row[0])] = (prof[0], prof[1])
+    return {
+        "ready": ready,
+        "totals": totals,
+        "unique_users": unique_users,
+        "top": top,
+        "online": len(online_users(300)),
+        "profiles": profiles,
+    }
+
+def _q_online() -> Dict[str, Any]:
+    now = time.time()
+    users: List[Tuple[int, float]] = []
+    profiles: Dict[int, Tuple[str, str]] = {}
+    for uid in online_users():
+        users.append((uid, ONLINE.last_seen(uid) or now))
+        prof = cached_profile(uid)
+        if prof:
+            profiles[uid] = (prof[0], prof[1])
+    return {"users": users, "profiles": profiles, "counts": {w: ONLINE.count(w) for w in ONLINE_WINDOWS}}
+
+def _q_perf(window: float) -> Dict[str, Any]:
+    traces = [(tr.name, tr.user_id, tr.wall, tr.total, list(tr.spans)) for tr in TRACER.recent_traces(window)]
+    # umumiy eng sekinlar har shard’ning o‘z eng sekinlari ichida — profillarini shu yerdan beramiz (getChat’siz)
+    profiles: Dict[int, Tuple[str, str]] = {}
+    for t in heapq.nlargest(PERF_SLOW_TRACES, traces, key=lambda t: t[3]):
+        prof = cached_profile(t[1]) if t[1] else None
+        if prof:
+            profiles[t[1]] = (prof[0], prof[1])
+    return {"steps": TRACER.step_stats(window), "traces": traces, "profiles": profiles}
+
+def _q_pools() -> Dict[str, Any]:
+    return {"shard": SHARD_INDEX or 0, "pools": {name: ex.metrics() for name, ex in EXECUTORS.items()}}
+
+SHARD_QUERIES = {
+    "users_summary": _q_users_summary,
+    "stats_summary": _q_stats_summary,
+    "online": _q_online,
+    "perf": _q_perf,
+    "pools": _q_pools,
+    "groq": GROQ_USAGE.snapshot,
+    "broadcast_status": BROADCAST.status,
+    "broadcast_start": BROADCAST.start,
+    "broadcast_stop": BROADCAST.stop,
+}
+
+async def run_shard_query(name: str, *args):
+    res = SHARD_QUERIES[name](*args)
+    if asyncio.iscoroutine(res):
+        res = await res
+    return res
+
+async def shard_gather(name: str, *args) -> List[Any]:
+    # javob bermagan shard’lar natijada bo‘lmaydi
+    if _SHARD_LINK is None:
+        return [await run_shard_query(name, *args)]
+    return await _SHARD_LINK.gather(name, args)
+
+def missing_shards_note(parts: List[Any]) -> str:
+    # shard_gather javob bermaganlarni tashlab yuboradi — yig‘indi qisman bo‘lsa ogohlantiramiz
+    missing = SHARDS - len(parts)
+    return f"⚠️ {missing} ta shard javob bermadi — raqamlar to‘liq emas\n\n" if missing > 0 else ""
+
+async def users_summary() -> Optional[Dict[str, int]]:
+    parts = await shard_gather("users_summary")
+    if len(parts) < SHARDS or not all(x["ready"] for x in parts):
+        return None
+    return {k: sum(x[k] for x in parts) for k in parts[0] if k != "ready"}
+
+
+class ShardLink:
+    # worker tomoni: Pipe ustida (kind, ...) tuple’lar; recv alohida thread’da
+    def __init__(self, conn, loop: asyncio.AbstractEventLoop):
+        self.conn = conn
+        self.loop = loop
+        self.closed = asyncio.Event()
+        self._send_lock = Lock()
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._on_update = None
+
+    def send(self, msg: Tuple) -> bool:
+        try:
+            with self._send_lock:
+                self.conn.send(msg)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def start(self, on_update):
+        self._on_update = on_update
+        Thread(target=self._reader, daemon=True, name="shard-link").start()
+
+    def _reader(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                msg = ("stop",)
+            self.loop.call_soon_threadsafe(self._dispatch, msg)
+            if msg[0] == "stop":
+                return
+
+    def _dispatch(self, msg: Tuple):
+        kind = msg[0]
+        if kind == "update":
+            self._on_update(msg[1])
+        elif kind == "query":
+            asyncio.ensure_future(self._answer(msg[1], msg[2], msg[3]))
+        elif kind == "gathered":
+            fut = self._pending.pop(msg[1], None)
+            if fut and not fut.done():
+                fut.set_result(msg[2])
+        elif kind == "stop":
+            self.closed.set()
+
+    async def _answer(self, qid: int, name: str, args: Tuple):
+        try:
+            result = await run_shard_query(name, *args)
+        except Exception:
+            result = None
+        self.send(("reply", qid, result))
+
+    async def gather(self, name: str, args: Tuple) -> List[Any]:
+        qid = next(self._ids)
+        fut = self.loop.create_future()
+        self._pending[qid] = fut
+        if not self.send(("gather", qid, name, args)):
+            self._pending.pop(qid, None)
+            return []
+        try:
+            return await asyncio.wait_for(fut, SHARD_QUERY_TIMEOUT + 2)
+        except asyncio.TimeoutError:
+            self._pending.pop(qid, None)
+            return []
+
+
+_SHARD_LINK: Optional[ShardLink] = None
+
+def shard_worker_main(index: int, count: int, conn):
+    # signallarni supervisor boshqaradi: u "stop" yuboradi, worker drain + flush qilib chiqadi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_shard_worker(index, count, conn))
+
+async def _shard_worker(index: int, count: int, conn):
+    global SHARD_INDEX, SHARDS, USERS_FILE, STATS_FILE, BROADCAST_FILE, _SHARD_LINK
+    global SEND_GLOBAL_RATE, PROFILE_FETCH_RATE, SUB_RECHECK_RATE, GROQ_STT_RATE
+    SHARD_INDEX, SHARDS = index, count
+    USERS_FILE = shard_path(USERS_FILE, index, count)
+    STATS_FILE = shard_path(STATS_FILE, index, count)
+    BROADCAST_FILE = shard_path(BROADCAST_FILE, index, count)
+    # Telegram limitlari bot bo‘yicha umumiy — har shard o‘z ulushini oladi
+    SEND_GLOBAL_RATE /= count
+    PROFILE_FETCH_RATE /= count
+    SUB_RECHECK_RATE /= count
+    GROQ_STT_RATE /= count
+    startup_mark("import")
+
+    link = _SHARD_LINK = ShardLink(conn, asyncio.get_running_loop())
+    handling: set = set()
+
+    def on_update(payload: Dict[str, Any]):
+        update = Update.model_validate(payload, context={"bot": bot})
+        t = asyncio.create_task(dp.feed_update(bot, update))
+        handling.add(t)
+        t.add_done_callback(handling.discard)
+
+    link.start(on_update)
+    start_background_jobs()
+    asyncio.create_task(load_state_job())
+    startup_mark("polling")
+
+    await link.closed.wait()
+    await graceful_shutdown(handling)
+
+
+class ShardProcess:
+    def __init__(self, index: int, count: int, supervisor: "ShardSupervisor"):
+        self.index = index
+        self.count = count
+        self.supervisor = supervisor
+        self.proc = None
+        self.conn = None
+        self._send_lock = Lock()
+        self.restart_task: Optional[asyncio.Task] = None
+        self.restarted: deque = deque(maxlen=SHARD_RESTART_MAX)   # monotonic vaqtlar
+        self.down_until = 0.0
+        self.backlog: List[Dict[str, Any]] = []
+        self.dropped = 0
+
+    def restarting(self) -> bool:
+        return self.restart_task is not None and not self.restart_task.done()
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=shard_worker_main, args=(self.index, self.count, child),
+                                name=f"shard-{self.index}")
+        self.proc.start()
+        child.close()
+        Thread(target=self._reader, args=(self.conn,), daemon=True, name=f"shard-{self.index}-reader").start()
+
+    def alive(self) -> bool:
+        return bool(self.proc and self.proc.is_alive())
+
+    def send(self, msg: Tuple) -> bool:
+        try:
+            with self._send_lock:
+                self.conn.send(msg)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _reader(self, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                return
+            self.supervisor.loop.call_soon_threadsafe(self.supervisor.on_message, self, msg)
+
+    def join(self, timeout: float):
+        if self.proc:
+            self.proc.join(timeout)
+            if self.proc.is_alive():
+                self.proc.terminate()
+
+
+class ShardSupervisor:
+    def __init__(self, count: int):
+        self.count = count
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.shards = [ShardProcess(i, count, self) for i in range(count)]
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.routed = [0] * count
+        self.restarts = 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for sh in self.shards:
+            sh.start()
+
+    def stop(self, timeout: float = SHUTDOWN_DRAIN_SECONDS + 5):
+        # hammasiga birdan "stop" — drain parallel ketadi
+        for sh in self.shards:
+            sh.send(("stop",))
+        end = time.monotonic() + timeout
+        for sh in self.shards:
+            sh.join(max(0.1, end - time.monotonic()))
+
+    def _ensure_alive(self, sh: ShardProcess, broken: bool = False):
+        # loop’ni to‘xtatmaydi: restart alohida task’da (backoff bilan)
+        if sh.restarting() or (sh.alive() and not broken):
+            return
+        sh.restart_task = asyncio.create_task(self._restart(sh))
+
+    async def _restart(self, sh: ShardProcess):
+        loop = asyncio.get_running_loop()
+        exitcode = sh.proc.exitcode if sh.proc else None
+        await loop.run_in_executor(None, sh.join, 1.0)   # pipe uzilgan, lekin process tirik bo‘lsa
+        now = time.monotonic()
+        recent = sum(1 for t in sh.restarted if now - t < SHARD_RESTART_WINDOW)
+        if recent >= SHARD_RESTART_MAX:
+            # state fayldan qayta yuklanadi; tez-tez yiqilayotgan shard’ga cooldown davomida update bermaymiz
+            sh.down_until = now + SHARD_RESTART_COOLDOWN
+            self._drop(sh, len(sh.backlog))
+            sh.backlog.clear()
+            print(f"❌ shard {sh.index} {SHARD_RESTART_WINDOW}s ichida {recent} marta yiqildi — "
+                  f"{SHARD_RESTART_COOLDOWN}s kutamiz, uning update’lari tashlab yuboriladi")
+            await asyncio.sleep(SHARD_RESTART_COOLDOWN)
+            sh.restarted.clear()
+        else:
+            delay = SHARD_RESTART_DELAY * (2 ** recent)
+            print(f"⚠️ shard {sh.index} to‘xtagan (exit {exitcode}) — {delay:.0f}s’dan keyin qayta ishga tushiriladi")
+            await asyncio.sleep(delay)
+        self.restarts += 1
+        sh.restarted.append(time.monotonic())
+        await loop.run_in_executor(None, sh.start)
+        sh.down_until = 0.0
+        backlog, sh.backlog = sh.backlog, []
+        for payload in backlog:
+            if sh.send(("update", payload)):
+                self.routed[sh.index] += 1
+            else:
+                self._drop(sh, 1)
+
+    def _drop(self, sh: ShardProcess, n: int):
+        if n <= 0:
+            return
+        before = sh.dropped
+        sh.dropped += n
+        if before // 100 != sh.dropped // 100 or before == 0:
+            print(f"⚠️ shard {sh.index}: {sh.dropped} ta update tashlab yuborildi")
+
+    def route(self, update: Any):
+        uid = update_user_id(update)
+        idx = shard_of(uid, self.count) if uid else 0
+        sh = self.shards[idx]
+        payload = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+        if not sh.restarting():
+            if sh.send(("update", payload)):
+                self.routed[idx] += 1
+                return
+            self._ensure_alive(sh, broken=True)
+        # restart kutilmoqda: navbatga (cooldown’da yoki navbat to‘lsa — tashlanadi, hisoblanadi)
+        if time.monotonic() < sh.down_until or len(sh.backlog) >= SHARD_BACKLOG_MAX:
+            self._drop(sh, 1)
+        else:
+            sh.backlog.append(payload)
+
+    def on_message(self, origin: ShardProcess, msg: Tuple):
+        kind = msg[0]
+        if kind == "gather":
+            asyncio.ensure_future(self._fan_out(origin, msg[1], msg[2], msg[3]))
+        elif kind == "reply":
+            fut = self._pending.pop(msg[1], None)
+            if fut and not fut.done():
+                fut.set_result(msg[2])
+
+    async def _fan_out(self, origin: ShardProcess, qid: int, name: str, args: Tuple):
+        waits: List[Tuple[int, asyncio.Future]] = []
+        for sh in self.shards:
+            sqid = next(self._ids)
+            fut = self.loop.create_future()
+            self._pending[sqid] = fut
+            if sh.send(("query", sqid, name, args)):
+                waits.append((sqid, fut))
+            else:
+                self._pending.pop(sqid, None)
+        if waits:
+            await asyncio.wait([f for _sqid, f in waits], timeout=SHARD_QUERY_TIMEOUT)
+        results = []
+        for sqid, fut in waits:
+            self._pending.pop(sqid, None)
+            if fut.done() and fut.result() is not None:
+                results.append(fut.result())
+        origin.send(("gathered", qid, results))
+
+    async def poll(self):
+        allowed = dp.resolve_used_update_types()
+        offset: Optional[int] = None
+        backoff = 1.0
+        while True:
+            for sh in self.shards:
+                self._ensure_alive(sh)
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=10, allowed_updates=allowed)
+                backoff = 1.0
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception:
+                await asyncio.sleep(backoff)
+                backoff = min(30.0, backoff * 2)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.route(update)
+
+async def run_supervisor():
+    startup_mark("import")
+    with startup_phase("split_state"):
+        await asyncio.get_running_loop().run_in_executor(None, split_state_files, SHARDS)
+
+    Thread(target=run_web, daemon=True).start()
+
+    sup = ShardSupervisor(SHARDS)
+    sup.start()
+    startup_mark("polling")
+    print(f"🚀 Supervisor: {SHARDS} shard · {startup_report()}")
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    poll_task = asyncio.create_task(sup.poll())
+    try:
+        await asyncio.wait([poll_task, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        poll_task.cancel()
+        for sh in sup.shards:
+            if sh.restart_task:
+                sh.restart_task.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, sup.stop)
+        join_shard_files()
+        await bot.session.close()
+
+
 # =========================================================
 # RUN
 # =========================================================
+BACKGROUND_TASKS: List[asyncio.Task] = []
+
+def start_background_jobs():
+    bot.session.middleware(OUTBOUND)
+    OUTBOUND.start()
+
+    for job in (autosave_stats_job, autosave_users_job, speaking_scheduler_job, sub_recheck_job):
+        BACKGROUND_TASKS.append(asyncio.create_task(job()))
+
+async def _wait_until(cond, deadline: float, every: float = 0.05) -> bool:
+    while not cond():
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(every)
+    return True
+
+async def graceful_shutdown(handling: Optional[set] = None):
+    # polling allaqachon to‘xtagan: yangi update kelmaydi
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    for t in BACKGROUND_TASKS:
+        t.cancel()   # timer scheduler ham — yangi o‘tishlar boshlanmaydi
+    await asyncio.gather(*BACKGROUND_TASKS, return_exceptions=True)
+    BACKGROUND_TASKS.clear()
+
+    # speaking: sessiya xotirada (MemoryStorage) — restart’dan keyin davom etmaydi, user’ga aytamiz
+    for uid, timer in list(SPEAKING_TIMERS.items()):
+        cancel_task(uid)
+        with send_priority(PRIO_RESULT):
+            asyncio.create_task(timer.message.answer(
+                "♻️ Bot qayta ishga tushirilmoqda — Speaking to‘xtatildi. Birozdan keyin qayta boshlang.",
+                reply_markup=main_menu(),
+            ))
+    for uid in list(SPEAKING_TASKS):
+        cancel_task(uid)
+
+    # broadcast: yangi yuborish to‘xtaydi, cursor saqlanadi — keyingi start’da davom etadi
+    if BROADCAST.reporter:
+        BROADCAST.reporter.cancel()
+    await BROADCAST.pause(timeout=max(0.1, deadline - time.monotonic()))
+
+    drained = await _wait_until(
+        lambda: USER_ACTORS.pending() == 0 and not handling, deadline)
+    sent = await _wait_until(lambda: OUTBOUND.qsize() == 0, deadline)
+    await asyncio.get_running_loop().run_in_executor(None, flush_state)
+    print(
+        f"🛑 Shutdown: handlerlar {'✅' if drained else f'⚠️ {USER_ACTORS.pending()} qoldi'} · "
+        f"outbound {'✅' if sent else f'⚠️ {OUTBOUND.qsize()} qoldi'} · state saqlandi"
+    )
+    if OUTBOUND.task:
+        OUTBOUND.task.cancel()
+    await bot.session.close()
+
+async def load_state_job():
+    # polling bilan parallel; erta kelgan yozuvlar load_* ichida birlashtiriladi
+    loop = asyncio.get_running_loop()
+    try:
+        if SHARD_INDEX is None:
+            # oldingi multi-process ishga tushirishdan qolgan shard fayllar
+            with startup_phase("join_shards"):
+                await loop.run_in_executor(None, join_shard_files)
+        with startup_phase("stats"):
+            await loop.run_in_executor(None, load_stats)
+        with startup_phase("users"):
+            await loop.run_in_executor(None, load_users)
+    except Exception as e:
+        # STATE_READY o‘rnatilmaydi: yarim USERS_DB/stats faylni ustidan yozmasin (autosave/flush o‘chiq)
+        print(f"❌ State yuklanmadi, saqlash o‘chirildi: {type(e).__name__}: {e}")
+        return
+    try:
+        with startup_phase("events"):
+            await loop.run_in_executor(None, EVENTS.open, f"p{SHARD_INDEX or 0}")
+    except Exception as e:
+        # event log’siz ham ishlaymiz: append’lar ochilmagan store’da tashlab yuboriladi
+        print(f"⚠️ Event log ochilmadi: {type(e).__name__}: {e}")
+    STATE_READY.set()
+    startup_mark("state_ready")
+    shard = f" [shard {SHARD_INDEX}/{SHARDS}]" if SHARD_INDEX is not None else ""
+    print(f"🚀 Startup{shard}: {startup_report()} · users {_total_users()}")
+    # restart’dan oldin tugamay qolgan broadcast
+    BROADCAST.resume()
+
+@dp.startup()
+async def _on_polling_startup():
+    startup_mark("polling")
+
 async def main():
     if not bot:
         print("❌ BOT_TOKEN yo‘q yoki PASTE_ holatda. Tokenni qo‘yib qayta ishga tushiring.")
         return
 
-    load_stats()
-    load_users()
+    if SHARDS > 1:
+        return await run_supervisor()
+
+    startup_mark("import")
 
+    # Render port’ni tez ko‘rsin — web birinchi
     Thread(target=run_web, daemon=True).start()
 
-    asyncio.create_task(autosave_stats_job())
-    asyncio.create_task(autosave_users_job())
+    start_background_jobs()
+    asyncio.create_task(load_state_job())
 
-    await dp.start_polling(bot)
+    # chat_member update’lari default kelmaydi — aniq so‘raymiz.
+    # SIGTERM/SIGINT’da aiogram polling’ni to‘xtatadi; session’ni drain’dan keyin o‘zimiz yopamiz
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), close_bot_session=False)
+    await graceful_shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,40 @@
+import random
+
+import main
+
+
+def top_values(pairs, k):
+    return sorted((v for _key, v in pairs), reverse=True)[:k]
+
+
+def test_topk_matches_full_sort_under_increments():
+    rng = random.Random(3)
+    top = main.TopK(5)
+    totals = {}
+    for _ in range(5_000):   # heap bir necha marta siqiladi (4k + 16 dan oshganda)
+        key = f"u{rng.randrange(40)}"
+        totals[key] = totals.get(key, 0) + rng.randint(0, 3)
+        top.update(key, totals[key])
+        assert top_values(top.items(), 5) == top_values(totals.items(), 5)
+    assert len(top.heap) <= 4 * top.k + 16 + 1
+
+
+def test_topk_ignores_values_below_the_minimum():
+    top = main.TopK(2)
+    top.update("a", 5)
+    top.update("b", 7)
+    top.update("c", 5)
+    assert dict(top.items()) == {"b": 7, "a": 5}
+    top.update("c", 6)
+    assert dict(top.items()) == {"b": 7, "c": 6}
+
+
+def test_inc_stat_keeps_aggregates_equal_to_a_rebuild(monkeypatch):
+    monkeypatch.setattr(main, "stats", {section: {} for section in main.STATS_SECTIONS})
+    main._rebuild_aggregates()
+    rng = random.Random(5)
+    for _ in range(500):
+        main.inc_stat(rng.choice(main.STATS_SECTIONS), rng.randrange(30), rng.randint(1, 3))
+    live = (dict(main.STATS_TOTALS), dict(main.USER_TOTALS), top_values(main.TOP_USERS.items(), main.TOP_K_SIZE))
+    main._rebuild_aggregates()
+    assert live == (main.STATS_TOTALS, main.USER_TOTALS, top_values(main.TOP_USERS.items(), main.TOP_K_SIZE))
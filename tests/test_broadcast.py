@@ -0,0 +1,84 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def broadcast_env(tmp_path, monkeypatch):
+    users = {uid: {"first": 1.0, "last": 1.0} for uid in range(1, 301)}
+    for uid in range(7, 301, 23):
+        users[uid]["blocked"] = 1.0
+    monkeypatch.setattr(main, "USERS_DB", users)
+    monkeypatch.setattr(main, "BROADCAST_FILE", str(tmp_path / "broadcast.json"))
+    monkeypatch.setattr(main, "BROADCAST_INFLIGHT", 8)
+
+    async def no_report(job):
+        return None
+
+    monkeypatch.setattr(main, "broadcast_report_job", no_report)
+    return users
+
+
+def run_broadcast(monkeypatch, stop_after=None, resume=False):
+    # yetkazish tartibsiz tugaydi (har xil kechikish) — done_above yo‘li ham sinaladi
+    delivered = []
+    rng = random.Random(2 if resume else 1)
+
+    async def go():
+        monkeypatch.setattr(main, "STATE_READY", asyncio.Event())
+        main.STATE_READY.set()
+        b = main.Broadcaster()
+
+        async def deliver(uid):
+            await asyncio.sleep(rng.random() * 0.003)
+            delivered.append(uid)
+            b._count("sent")
+            if stop_after is not None and len(delivered) >= stop_after:
+                b.stopping = True
+
+        monkeypatch.setattr(b, "_deliver", deliver)
+        if resume:
+            b.resume()
+        else:
+            b.start({"id": 1, "source": {"text": "hi"}, "admin_chat": 1, "status_msg": 0, "started": 0})
+        if b.task is not None:
+            await b.task
+        return b
+
+    return asyncio.run(go()), delivered
+
+
+def test_stop_and_resume_delivers_everyone_exactly_once(broadcast_env, monkeypatch):
+    wanted = {uid for uid, rec in broadcast_env.items() if not rec.get("blocked")}
+    first, sent1 = run_broadcast(monkeypatch, stop_after=100)
+    assert not first.part["done"]
+    second, sent2 = run_broadcast(monkeypatch, resume=True)
+    assert second.part["done"]
+    counts = Counter(sent1 + sent2)
+    assert set(counts) == wanted
+    assert max(counts.values()) == 1
+    status = second.status()
+    assert status["sent"] == len(wanted)
+    assert status["skipped"] == len(broadcast_env) - len(wanted)
+
+
+def test_finished_broadcast_is_not_resumed(broadcast_env, monkeypatch):
+    run_broadcast(monkeypatch)
+    again, sent = run_broadcast(monkeypatch, resume=True)
+    assert sent == []
+    assert again.task is None
+
+
+def test_broadcast_part_after_shard_count_change():
+    state = {"parts": {"0/2": {"cursor": 50, "sent": 3, "done": True},
+                       "1/2": {"cursor": 20, "sent": 4, "done": False}}}
+    p0 = main.broadcast_part(state, 0, 3)
+    p2 = main.broadcast_part(state, 2, 3)
+    assert (p0["cursor"], p0["sent"], p0["done"]) == (20, 7, False)
+    assert (p2["cursor"], p2["sent"]) == (20, 0)
+    assert main.broadcast_part(state, 1, 2)["cursor"] == 20
+    assert main.broadcast_part({}, 0, 1) == main._new_broadcast_part()
@@ -0,0 +1,37 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+
+class FakeMessage:
+    def __init__(self):
+        self.from_user = SimpleNamespace(id=42)
+        self.sent = []
+
+    async def answer(self, text, **kwargs):
+        self.sent.append(text)
+
+
+def test_long_batch_reply_is_split_between_entries(monkeypatch):
+    async def fake_blocking(kind, fn, *args):
+        return ["t" * 300 for _ in args[0]]
+
+    async def fake_entry(src, tr, mode, sem):
+        return {"src": src, "tr": tr, "ipa": "/x/", "def": "d" * 200, "audio_path": None}
+
+    monkeypatch.setattr(main, "run_blocking", fake_blocking)
+    monkeypatch.setattr(main, "_dict_batch_entry", fake_entry)
+    monkeypatch.setattr(main, "inc_stat", lambda *a, **k: None)
+    monkeypatch.setattr(main, "record_event", lambda *a, **k: None)
+
+    msg = FakeMessage()
+    entries = ["s" * 300 for _ in range(main.DICT_BATCH_MAX + 3)]
+    asyncio.run(main.dict_batch_handler(msg, entries, "en_uz"))
+
+    replies = msg.sent[1:]
+    assert len(replies) > 1
+    assert all(len(r) <= 4096 for r in replies)
+    # har bo‘lak butun yozuvdan boshlanadi — yozuv o‘rtasidan kesilmaydi
+    assert all(r.startswith(("📚", "⚠️")) or r.split(")", 1)[0].isdigit() for r in replies)
+    assert "Qolgan 3 tasi" in replies[-1]
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def test_rejects_beyond_threads_plus_queue_max():
+    async def go():
+        ex = main.WorkloadExecutor("t", 2, 3)
+        results = await asyncio.gather(*(ex.run(time.sleep, 0.05) for _ in range(9)), return_exceptions=True)
+        return ex, results
+
+    ex, results = asyncio.run(go())
+    assert sum(r is None for r in results) == 5
+    assert all(isinstance(r, main.ExecutorBusy) for r in results if r is not None)
+    m = ex.metrics()
+    assert (m["submitted"], m["rejected"], m["queued"], m["active"]) == (5, 4, 0, 0)
+
+
+def test_accepts_again_once_the_queue_drains():
+    async def go():
+        ex = main.WorkloadExecutor("t", 1, 0)
+        first = asyncio.ensure_future(ex.run(time.sleep, 0.05))
+        await asyncio.sleep(0.01)
+        with pytest.raises(main.ExecutorBusy):
+            await ex.run(time.sleep, 0)
+        await first
+        await ex.run(time.sleep, 0)
+        return ex.metrics()
+
+    m = asyncio.run(go())
+    assert (m["submitted"], m["rejected"]) == (2, 1)
+
+
+def test_cancelled_queued_task_releases_its_slot():
+    async def go():
+        ex = main.WorkloadExecutor("t", 1, 1)
+        release = threading.Event()
+        running = asyncio.ensure_future(ex.run(release.wait))
+        await asyncio.sleep(0.01)
+        queued = asyncio.ensure_future(ex.run(time.sleep, 0))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.sleep(0)
+        queued_after_cancel = ex.metrics()["queued"]
+        release.set()
+        await running
+        return queued_after_cancel
+
+    assert asyncio.run(go()) == 0
+
+
+def test_context_vars_reach_the_worker_thread():
+    var = main.ContextVar("v", default="none")
+
+    async def go():
+        var.set("set")
+        return await main.WorkloadExecutor("t", 1, 1).run(var.get)
+
+    assert asyncio.run(go()) == "set"
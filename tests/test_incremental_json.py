@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import main
+
+OBJ = {
+    "score_20_75": 48,
+    "feedback_uz": "Yaxshi, \"lekin\" {qavs} [va] \\ belgilar",
+    "per_task": [{"task_no": 1, "issues": ["a", "b"]}, {"task_no": 2, "issues": []}],
+    "overall_mistakes": ["x, y", "z"],
+    "nested": {"a": [1, {"b": 2}]},
+}
+
+
+def collect(chunks):
+    parser = main.IncrementalJSONObject()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, 10_000])
+def test_same_events_for_any_chunking(size):
+    text = "```json\n" + json.dumps(OBJ, ensure_ascii=False, indent=2) + "\n```"
+    _parser, events = collect(text[i:i + size] for i in range(0, len(text), size))
+    fields = {key: value for kind, key, value in events if kind == "field"}
+    items = [(key, value) for kind, key, value in events if kind == "item"]
+    assert fields == OBJ
+    assert items == [("per_task", t) for t in OBJ["per_task"]]
+
+
+def test_field_is_emitted_as_soon_as_it_ends():
+    parser = main.IncrementalJSONObject()
+    assert parser.feed('{"score_20_75": 5') == []
+    assert parser.feed('0, "feedback_uz": "ok') == [("field", "score_20_75", 50)]
+    assert parser.feed('"}') == [("field", "feedback_uz", "ok")]
+    assert parser.done
+
+
+def test_pending_value_of_a_cut_stream():
+    parser, _events = collect(['{"a": 1, "b": [1, 2]'])
+    assert parser.pending_value() == ("b", [1, 2])
+    parser, _events = collect(['{"a": 1, "b": "cut'])
+    assert parser.pending_value() is None
@@ -0,0 +1,52 @@
+import json
+
+import main
+
+FULL = {
+    "score_20_75": 52,
+    "feedback_uz": "Yaxshi",
+    "per_task": [{"task_no": 1, "issues": ["a"]}, {"task_no": 2, "issues": ["b"]}, {"task_no": 3, "issues": []}],
+    "corrected_best_version": "text",
+}
+
+
+def test_clean_json_with_preamble_and_trailing_text():
+    content = "Here you go:\n```json\n" + json.dumps(FULL) + "\n```\nHope it helps }"
+    assert main.parse_model_json(content) == (FULL, False)
+
+
+def test_truncated_json_keeps_finished_fields_and_items():
+    text = json.dumps(FULL, indent=2)
+    cut = text[:text.index('"task_no": 3')]
+    obj, repaired = main.parse_model_json(cut)
+    assert repaired
+    assert obj["score_20_75"] == 52
+    assert obj["feedback_uz"] == "Yaxshi"
+    assert obj["per_task"] == FULL["per_task"][:2]
+    assert "corrected_best_version" not in obj
+
+
+def test_missing_comma_is_repaired_from_the_fields_around_it():
+    obj, repaired = main.parse_model_json('{"score_20_75": 40 "feedback_uz": "x", "per_task": []}')
+    assert repaired
+    assert obj == {"score_20_75": 40, "feedback_uz": "x", "per_task": []}
+
+
+def test_no_object_at_all():
+    assert main.parse_model_json("no json here") == (None, False)
+    assert main.parse_model_json('{"score_20_75": ') == (None, False)
+
+
+def test_validate_model_json_coerces_and_drops_bad_fields():
+    obj = {"score_20_75": "47", "feedback_uz": 5, "per_task": "oops", "overall_mistakes": ["m"]}
+    assert main.validate_model_json(obj, "writing") == {
+        "score_20_75": 47.0, "feedback_uz": "5", "overall_mistakes": ["m"],
+    }
+    assert main.validate_model_json({"score_20_75": True}, "speaking") is None
+    assert main.validate_model_json({"feedback_uz": "x"}, "writing") is None
+    assert main.validate_model_json([], "writing") is None
+
+
+def test_missing_comma_never_shifts_a_value_onto_the_previous_key():
+    obj, _repaired = main.parse_model_json('{"score_20_75": 40 "overall": 75, "feedback_uz": "a" "b": "c"}')
+    assert obj == {"score_20_75": 40, "overall": 75, "feedback_uz": "a", "b": "c"}
@@ -0,0 +1,26 @@
+import time
+
+import main
+
+
+def test_window_counts_and_horizon_eviction():
+    tr = main.OnlineTracker(horizon=600)
+    now = time.time()
+    tr.touch(1, now - 900)
+    tr.touch(2, now - 400)
+    tr.touch(3, now - 100)
+    tr.touch(4, now - 10)
+    assert len(tr) == 3          # 1 horizon’dan eski
+    assert tr.last_seen(1) is None
+    assert sorted(tr.users(300)) == [3, 4]
+    assert tr.count(60) == 1
+
+
+def test_touch_moves_user_to_the_newest_end():
+    tr = main.OnlineTracker(horizon=600)
+    now = time.time()
+    tr.touch(1, now - 500)
+    tr.touch(2, now - 200)
+    tr.touch(1, now - 5)
+    assert tr.users(60) == [1]
+    assert tr.count(300) == 2
@@ -0,0 +1,45 @@
+import json
+import os
+
+import main
+
+
+def test_save_json_replaces_atomically(tmp_path):
+    path = tmp_path / "stats.json"
+    assert main.save_json(str(path), {"a": 1})
+    assert main.save_json(str(path), {"a": 2})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"a": 2}
+    assert os.listdir(tmp_path) == ["stats.json"]
+
+
+def test_failed_save_keeps_the_old_file_and_no_temp(tmp_path):
+    path = tmp_path / "stats.json"
+    main.save_json(str(path), {"a": 1})
+    assert not main.save_json(str(path), {"a": object()})   # serialize qilinmaydi — yozish o‘rtasida xato
+    assert json.loads(path.read_text(encoding="utf-8")) == {"a": 1}
+    assert os.listdir(tmp_path) == ["stats.json"]
+
+
+def test_save_users_writes_a_snapshot_and_clears_dirty(tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    db = {i: {"first": 1.0, "last": float(i)} for i in range(7)}
+    monkeypatch.setattr(main, "USERS_FILE", str(path))
+    monkeypatch.setattr(main, "USERS_DB", db)
+    monkeypatch.setattr(main, "USERS_SNAPSHOT_CHUNK", 3)
+    monkeypatch.setattr(main, "users_dirty", True)
+    main.save_users()
+    assert not main.users_dirty
+    assert main._read_users_file(str(path))[6]["last"] == 6.0
+    assert len(json.loads(path.read_text(encoding="utf-8"))) == 7
+
+    os.remove(path)
+    main.save_users()   # dirty emas — yozmaydi
+    assert not path.exists()
+
+
+def test_failed_users_save_stays_dirty(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "USERS_FILE", str(tmp_path / "missing-dir" / "users.json"))
+    monkeypatch.setattr(main, "USERS_DB", {1: {"first": 1.0}})
+    monkeypatch.setattr(main, "users_dirty", True)
+    main.save_users()
+    assert main.users_dirty
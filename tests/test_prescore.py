@@ -0,0 +1,78 @@
+import pytest
+
+import main
+
+
+def signals(text):
+    return main.text_features(text)["grammar"]
+
+
+# to‘g‘ri gaplar: hech qanday signal bo‘lmasligi kerak
+CLEAN = [
+    "I did proceed with the plan.",
+    "She did succeed in the end.",
+    "It did exceed our budget.",
+    "They did not embed the video.",
+    "The dog did shed a lot of hair.",
+    "We did breed rabbits last year.",
+    "His knee did bleed after the fall.",
+    "I did need more time.",
+    "They didn't feed the cat.",
+    "He did speed up at the end.",
+    "She had had enough of the noise.",
+    "I know that that is true.",
+    "An hour is a long time.",
+    "It was a useful idea and a unique chance.",
+    "He doesn't like it because it is more expensive.",
+    "I was happy yesterday.",
+    "When I was a child, I was happy and I was free.",
+    "Does she like music?",
+    "Did he go home?",
+    "Can it go faster?",
+    "Let it go.",
+    "We should help him. Did you see it go?",
+    "It was a usual day.",
+    "He is a user of the app.",
+    "It is a utility bill.",
+    "I met a Usain fan and a Ukrainian student.",
+]
+
+# xato gaplar: kutilgan signal topilishi kerak
+WRONG = [
+    ("I did walked to school.", "did + past form"),
+    ("He didn't liked it.", "did + past form"),
+    ("Yesterday i went home.", "lowercase 'i'"),
+    ("I ate a apple.", "a + vowel (an)"),
+    ("It is an big house.", "an + consonant (a)"),
+    ("I saw the the cat.", "repeated word"),
+    ("She have a car.", "S-V agreement"),
+    ("They is my friends.", "S-V agreement"),
+    ("They was at home.", "S-V agreement"),
+    ("I think she like music.", "S-V agreement"),
+    ("We bought a umbrella.", "a + vowel (an)"),
+    ("This is more better.", "double comparative"),
+    ("my city is big.", "sentence starts lowercase"),
+]
+
+
+@pytest.mark.parametrize("text", CLEAN)
+def test_grammar_signals_ignore_correct_english(text):
+    assert signals(text) == {}
+
+
+@pytest.mark.parametrize("text,label", WRONG)
+def test_grammar_signals_catch_mistakes(text, label):
+    assert label in signals(text)
+
+
+def test_heuristic_score_bounds():
+    assert main.heuristic_score(main.text_features("yes"), 100) == 20
+    text = " ".join(["My family lives in a small city because my parents work there."] * 20)
+    assert 20 <= main.heuristic_score(main.text_features(text), 100) <= 65
+
+
+def test_writing_prescore_marks_empty_tasks_degenerate():
+    pre = main.writing_prescore([{"answer": ""}, {"answer": "ok"}, {"answer": ""}])
+    assert pre["degenerate"]
+    assert all(t["skipped"] for t in pre["per_task"])
+    assert pre["score_20_75"] == 20
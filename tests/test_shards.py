@@ -0,0 +1,85 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+def test_shard_of_is_stable_for_int_and_str_ids():
+    for uid in (1, 858726164, 10**12):
+        assert main.shard_of(uid, 4) == main.shard_of(str(uid), 4)
+        assert 0 <= main.shard_of(uid, 4) < 4
+    spread = {main.shard_of(uid, 4) for uid in range(1000, 1100)}
+    assert spread == {0, 1, 2, 3}
+
+
+def test_update_user_id():
+    user = SimpleNamespace(id=42)
+    assert main.update_user_id(SimpleNamespace(event=SimpleNamespace(from_user=user))) == 42
+    member = SimpleNamespace(new_chat_member=SimpleNamespace(user=SimpleNamespace(id=7)), from_user=user)
+    assert main.update_user_id(SimpleNamespace(event=member)) == 7
+    assert main.update_user_id(SimpleNamespace(event=SimpleNamespace())) is None
+    assert main.update_user_id(object()) is None
+
+
+@pytest.fixture
+def state_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "USERS_FILE", str(tmp_path / "users.json"))
+    monkeypatch.setattr(main, "STATS_FILE", str(tmp_path / "stats.json"))
+    monkeypatch.setattr(main, "BROADCAST_FILE", str(tmp_path / "broadcast.json"))
+    return tmp_path
+
+
+def test_split_then_join_round_trips_users_and_stats(state_files):
+    users = {str(uid): {"first": 1.0, "last": float(uid), "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0}
+             for uid in range(100, 160)}
+    stats = {"exams_completed": {str(uid): uid % 5 for uid in range(100, 160)}, "dict_lookups": {"100": 3}}
+    main.save_json(main.USERS_FILE, users)
+    main.save_json(main.STATS_FILE, stats)
+
+    main.split_state_files(3)
+    for i in range(3):
+        part = json.loads(open(main.shard_path(main.USERS_FILE, i, 3), encoding="utf-8").read())
+        assert all(main.shard_of(uid, 3) == i for uid in part)
+    assert len(main._shard_files(main.USERS_FILE)) == 3
+
+    # shard ishlagan payt: bitta user yangilangan
+    uid = "130"
+    path = main.shard_path(main.USERS_FILE, main.shard_of(uid, 3), 3)
+    part = json.loads(open(path, encoding="utf-8").read())
+    part[uid]["last"] = 9999.0
+    main.save_json(path, part)
+
+    main.join_shard_files()
+    assert main._shard_files(main.USERS_FILE) == []
+    assert main._shard_files(main.STATS_FILE) == []
+    users[uid]["last"] = 9999.0
+    assert json.loads(open(main.USERS_FILE, encoding="utf-8").read()) == users
+    joined = json.loads(open(main.STATS_FILE, encoding="utf-8").read())
+    assert joined["exams_completed"] == stats["exams_completed"]
+    assert joined["dict_lookups"] == stats["dict_lookups"]
+
+
+def test_shard_files_ignore_other_names(state_files):
+    for name in ("users.shard0of2.json", "users.shard1of2.json", "users.json", "users.shard0of2.json.x.tmp"):
+        open(os.path.join(state_files, name), "w").close()
+    assert [os.path.basename(p) for p in main._shard_files(main.USERS_FILE)] == \
+        ["users.shard0of2.json", "users.shard1of2.json"]
+
+
+def test_missing_shards_note(monkeypatch):
+    monkeypatch.setattr(main, "SHARDS", 3)
+    assert "2 ta shard" in main.missing_shards_note([{}])
+    assert main.missing_shards_note([{}, {}, {}]) == ""
+
+
+def test_perf_query_carries_profiles_of_its_slowest_traces(monkeypatch):
+    trace = lambda uid, total: SimpleNamespace(name="h", user_id=uid, wall=0.0, total=total, spans=[])
+    monkeypatch.setattr(main.TRACER, "recent_traces", lambda window: [trace(u, float(u)) for u in range(1, 9)])
+    monkeypatch.setattr(main.TRACER, "step_stats", lambda window: {})
+    monkeypatch.setattr(main, "USERS_DB", {u: {"username": f"u{u}", "name": "N"} for u in range(1, 9)})
+    res = main._q_perf(60)
+    assert sorted(res["profiles"]) == [4, 5, 6, 7, 8]
+    assert res["profiles"][8] == ("u8", "N")
@@ -0,0 +1,64 @@
+import random
+
+import main
+
+
+def make_wheel(now=1000, bits=2, levels=2):
+    # kichik g‘ildirak: 4 slot, 2 level — cascade va overflow tez sinaladi
+    w = main.TimingWheel(bits=bits, levels=levels)
+    w.now_tick = now
+    return w
+
+
+def test_fires_each_key_exactly_at_its_due_tick():
+    w = make_wheel()
+    due = {f"k{d}": 1000 + d for d in (1, 3, 4, 5, 15, 16, 17, 63, 64, 65, 200)}
+    for key, tick in due.items():
+        w.schedule(key, tick)
+    fired_at = {}
+    for t in range(1001, 1300):
+        for key in w.advance(t):
+            fired_at[key] = t
+    assert fired_at == due
+    assert len(w) == 0
+
+
+def test_matches_naive_scheduler_with_random_jumps():
+    rng = random.Random(7)
+    w = make_wheel(now=0, bits=3, levels=2)
+    pending = {}
+    now = 0
+    for step in range(400):
+        for _ in range(rng.randint(0, 3)):
+            key = rng.randrange(60)
+            due = now + rng.randint(1, 700)
+            w.schedule(key, due)
+            pending[key] = due
+        if rng.random() < 0.2 and pending:
+            key = rng.choice(list(pending))
+            w.cancel(key)
+            del pending[key]
+        now += rng.randint(1, 40)
+        fired = set(w.advance(now))
+        expected = {k for k, d in pending.items() if d <= now}
+        assert fired == expected
+        for k in expected:
+            del pending[k]
+    assert len(w) == len(pending)
+
+
+def test_cancel_and_reschedule():
+    w = make_wheel()
+    w.schedule("a", 1010)
+    w.schedule("b", 1010)
+    w.cancel("a")
+    w.cancel("missing")
+    w.schedule("b", 1020)   # qayta rejalash eski joydan olib tashlaydi
+    assert w.advance(1015) == []
+    assert w.advance(1020) == ["b"]
+
+
+def test_past_due_fires_on_next_tick():
+    w = make_wheel()
+    w.schedule("late", 900)
+    assert w.advance(1001) == ["late"]
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def test_one_user_is_serialized_and_users_run_in_parallel(monkeypatch):
+    monkeypatch.setattr(main, "USER_ACTOR_WORKERS", 4)
+    log = []
+    running = {"now": 0, "max": 0}
+
+    def job(uid, n):
+        async def fn():
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            log.append((uid, n, "start"))
+            await asyncio.sleep(0.01)
+            log.append((uid, n, "end"))
+            running["now"] -= 1
+            return (uid, n)
+        return fn
+
+    async def go():
+        actors = main.UserActors()
+        return actors, await asyncio.gather(*(actors.run(uid, job(uid, n)) for n in range(3) for uid in (1, 2)))
+
+    actors, results = asyncio.run(go())
+    assert sorted(results) == [(uid, n) for uid in (1, 2) for n in range(3)]
+    for uid in (1, 2):
+        mine = [(n, ev) for u, n, ev in log if u == uid]
+        assert mine == [(n, ev) for n in range(3) for ev in ("start", "end")]
+    assert running["max"] == 2
+    assert len(actors) == 0 and actors.pending() == 0
+
+
+def test_full_user_queue_is_rejected(monkeypatch):
+    monkeypatch.setattr(main, "USER_QUEUE_MAX", 2)
+
+    async def go():
+        actors = main.UserActors()
+        gate = asyncio.Event()
+
+        async def wait():
+            await gate.wait()
+
+        first = asyncio.ensure_future(actors.run(1, wait))
+        await asyncio.sleep(0)
+        queued = [asyncio.ensure_future(actors.run(1, wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(main.ActorQueueFull):
+            await actors.run(1, wait)
+        gate.set()
+        await asyncio.gather(first, *queued)
+        return actors.stats
+
+    assert asyncio.run(go()) == {"done": 3, "rejected": 1}
+
+
+def test_handler_exception_reaches_the_caller_and_the_actor_keeps_going():
+    async def boom():
+        raise ValueError("x")
+
+    async def ok():
+        return 1
+
+    async def go():
+        actors = main.UserActors()
+        first = asyncio.ensure_future(actors.run(1, boom))
+        second = asyncio.ensure_future(actors.run(1, ok))
+        with pytest.raises(ValueError):
+            await first
+        return await second
+
+    assert asyncio.run(go()) == 1
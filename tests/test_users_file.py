@@ -0,0 +1,73 @@
+import json
+import random
+
+import pytest
+
+import main
+
+
+def make_users(n, seed=1):
+    rng = random.Random(seed)
+    names = ['Ali', 'O‘g‘il "qo‘shtirnoq"', 'line\n  "fake": {', '{}[],:', '\\', '  "', 'Имя 😀']
+    users = {}
+    for i in range(n):
+        rec = {"first": rng.random() * 1e9, "last": rng.random() * 1e9, "sub_ok": rng.randint(0, 1),
+               "sub_first": 0.0, "sub_last": rng.random() * 1e9}
+        if rng.random() < 0.7:
+            rec["username"] = f"user{i}"
+            rec["name"] = rng.choice(names)
+        users[str(100 + i)] = rec
+    return users
+
+
+@pytest.mark.parametrize("chunk_chars", [1, 50, 1_000, 1 << 20])
+def test_chunks_rebuild_the_saved_object(tmp_path, chunk_chars):
+    users = make_users(300)
+    path = tmp_path / "users.json"
+    assert main.save_json(str(path), users)
+    merged = {}
+    for chunk in main._iter_json_object_chunks(path.read_text(encoding="utf-8"), chunk_chars):
+        assert not merged.keys() & chunk.keys()
+        merged.update(chunk)
+    assert merged == users
+
+
+def test_chunks_of_compact_json_without_indent():
+    users = make_users(20)
+    assert [*main._iter_json_object_chunks(json.dumps(users), 10)] == [users]
+
+
+def test_read_users_file_formats(tmp_path):
+    path = tmp_path / "users.json"
+    assert main._read_users_file(str(tmp_path / "missing.json")) == {}
+    path.write_text("  \n", encoding="utf-8")
+    assert main._read_users_file(str(path)) == {}
+    path.write_text("[5, 6]", encoding="utf-8")
+    assert sorted(main._read_users_file(str(path))) == [5, 6]
+    main.save_json(str(path), {"7": {"first": 1, "last": 2, "name": "A", "extra": "x"}, "bad": {}})
+    assert main._read_users_file(str(path)) == {
+        7: {"first": 1.0, "last": 2.0, "sub_ok": 0, "sub_first": 0.0, "sub_last": 0.0, "name": "A"},
+    }
+
+
+def test_read_users_file_raises_on_a_truncated_file(tmp_path):
+    path = tmp_path / "users.json"
+    main.save_json(str(path), make_users(50))
+    text = path.read_text(encoding="utf-8")
+    path.write_text(text[:len(text) // 2], encoding="utf-8")
+    with pytest.raises(ValueError):
+        main._read_users_file(str(path))
+
+
+def test_load_users_merges_records_seen_before_the_load(tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    main.save_json(str(path), {"1": {"first": 100, "last": 200, "sub_ok": 0}, "2": {"first": 50, "last": 60}})
+    monkeypatch.setattr(main, "USERS_FILE", str(path))
+    monkeypatch.setattr(main, "USERS_DB", {1: {"first": 300, "last": 400, "sub_ok": 1, "sub_first": 300,
+                                               "sub_last": 400, "name": "New"}})
+    main.load_users()
+    assert main.USERS_DB[1]["first"] == 100
+    assert main.USERS_DB[1]["last"] == 400
+    assert main.USERS_DB[1]["sub_ok"] == 1
+    assert main.USERS_DB[1]["name"] == "New"
+    assert main.USERS_DB[2]["last"] == 60.0
@@ -0,0 +1,50 @@
+import pytest
+
+import main
+
+pydub = pytest.importorskip("pydub")
+from pydub import AudioSegment  # noqa: E402
+from pydub.generators import WhiteNoise  # noqa: E402
+
+
+def speech(pauses_ms, total_ms):
+    # shovqin (nutq) + berilgan joylarda 400ms jimlik; 16kHz mono 16-bit
+    seg = AudioSegment.silent(0, frame_rate=16000)
+    pos = 0
+    for p in sorted(pauses_ms) + [total_ms]:
+        seg += WhiteNoise().to_audio_segment(duration=p - pos).apply_gain(-15).set_frame_rate(16000)
+        if p < total_ms:
+            seg += AudioSegment.silent(400, frame_rate=16000)
+            pos = p + 400
+    return seg.set_channels(1).set_sample_width(2)
+
+
+PAUSES = [9_000, 19_000, 41_500, 61_000, 83_000]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_cuts_land_in_pauses(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(main, "NUMPY_AVAILABLE", use_numpy)
+    audio = speech(PAUSES, 100_000)
+    cuts = main.voice_cut_points(audio)
+    assert cuts
+    for c in cuts:
+        assert any(p <= c <= p + 400 for p in PAUSES), c
+    bounds = [0] + cuts + [len(audio)]
+    limit = (main.VOICE_CHUNK_SECONDS + main.VOICE_CUT_WINDOW) * 1000
+    assert all(0 < b - a <= limit + main.VOICE_FRAME_MS for a, b in zip(bounds, bounds[1:]))
+
+
+def test_numpy_and_pure_python_paths_agree(monkeypatch):
+    pytest.importorskip("numpy")
+    audio = speech(PAUSES, 100_000)
+    with_np = main.voice_cut_points(audio)
+    monkeypatch.setattr(main, "NUMPY_AVAILABLE", False)
+    assert main.voice_cut_points(audio) == with_np
+
+
+def test_short_voice_is_not_split():
+    audio = speech([], (main.VOICE_CHUNK_SECONDS + main.VOICE_CUT_WINDOW) * 1000)
+    assert main.voice_cut_points(audio) == []